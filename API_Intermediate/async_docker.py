@@ -0,0 +1,332 @@
+# async_docker.py
+import os
+import asyncio
+import json
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode, urlparse
+
+# Socket del daemon (unix:///ruta o tcp://host:puerto)
+# Daemon socket (unix:///path or tcp://host:port)
+DOCKER_HOST = os.getenv("DOCKER_HOST", "unix:///var/run/docker.sock")
+# Conexiones keep-alive abiertas como máximo contra el daemon
+# Maximum keep-alive connections open against the daemon
+DOCKER_POOL_SIZE = int(os.getenv("DOCKER_POOL_SIZE", "32"))
+DOCKER_TIMEOUT = float(os.getenv("DOCKER_TIMEOUT", "60"))
+# Un pull no tiene límite total (una imagen grande tarda lo que tarde): solo
+# puede pasar este tiempo sin que el daemon mande progreso
+# A pull has no total limit (a big image takes as long as it takes): only
+# this long may go by without the daemon sending progress
+DOCKER_PULL_IDLE_TIMEOUT = float(os.getenv("DOCKER_PULL_IDLE_TIMEOUT", "120"))
+
+
+class DockerAPIError(RuntimeError):
+    """Respuesta de error del daemon | Error response from the daemon"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class DockerNotFound(DockerAPIError):
+    pass
+
+
+_Conn = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class _IdleReader:
+    """
+    Lector con un límite por lectura en vez de uno para toda la respuesta.
+    Reader with a limit per read instead of one for the whole response.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, timeout: float):
+        self._reader = reader
+        self._timeout = timeout
+
+    async def readline(self) -> bytes:
+        return await asyncio.wait_for(self._reader.readline(), self._timeout)
+
+    async def readexactly(self, n: int) -> bytes:
+        return await asyncio.wait_for(self._reader.readexactly(n), self._timeout)
+
+    async def read(self) -> bytes:
+        data = bytearray()
+        while chunk := await asyncio.wait_for(self._reader.read(2 ** 16), self._timeout):
+            data += chunk
+        return bytes(data)
+
+
+class AsyncDockerClient:
+    """
+    Cliente mínimo de la API de Docker para asyncio. Mantiene un pool de
+    conexiones HTTP/1.1 keep-alive contra el socket del daemon, así que
+    muchas operaciones pueden ir a la vez en el event loop sin un hilo por
+    llamada. El tamaño del pool limita las peticiones simultáneas.
+
+    Minimal asyncio client for the Docker API. It keeps a pool of HTTP/1.1
+    keep-alive connections to the daemon socket, so many operations can run
+    at once on the event loop without one thread per call. The pool size
+    caps the number of simultaneous requests.
+    """
+
+    def __init__(
+        self,
+        base_url: str = DOCKER_HOST,
+        pool_size: int = DOCKER_POOL_SIZE,
+        timeout: float = DOCKER_TIMEOUT,
+    ):
+        url = urlparse(base_url)
+        # docker.from_env() sí usa TLS con estas variables: este cliente iría
+        # en claro contra un daemon que espera TLS, así que no se acepta
+        # docker.from_env() does use TLS with these variables: this client
+        # would go in the clear to a daemon expecting TLS, so it is refused
+        tls = url.scheme == "https" or (
+            url.scheme == "tcp" and base_url == DOCKER_HOST
+            and bool(os.getenv("DOCKER_TLS_VERIFY") or os.getenv("DOCKER_CERT_PATH"))
+        )
+        if tls:
+            raise ValueError(
+                f"{base_url} usa TLS y el cliente asíncrono solo habla HTTP: "
+                "usa el socket unix o un tcp:// sin TLS"
+            )
+        self.base_url = base_url
+        self.scheme = url.scheme
+        self.socket_path = url.path
+        self.host = url.hostname or "localhost"
+        self.port = url.port or 2375
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle: Deque[_Conn] = deque()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.opened = 0
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    # El semáforo pertenece al event loop donde se creó
+    # The semaphore belongs to the event loop it was created on
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.pool_size)
+            self._idle.clear()
+
+    async def _connect(self) -> _Conn:
+        self.opened += 1
+        if self.scheme in ("unix", "http+unix"):
+            return await asyncio.open_unix_connection(self.socket_path, limit=2 ** 20)
+        return await asyncio.open_connection(self.host, self.port, limit=2 ** 20)
+
+    async def _acquire(self) -> _Conn:
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return await self._connect()
+
+    def _release(self, conn: _Conn, reusable: bool):
+        reader, writer = conn
+        if reusable and not writer.is_closing():
+            self._idle.append(conn)
+        else:
+            writer.close()
+
+    @staticmethod
+    async def _read_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> bytes:
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip(), 16)
+                if size == 0:
+                    # Trailers opcionales hasta la línea vacía
+                    # Optional trailers up to the empty line
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return bytes(body)
+                body += await reader.readexactly(size)
+                await reader.readexactly(2)
+        if "content-length" in headers:
+            return await reader.readexactly(int(headers["content-length"]))
+        return await reader.read()
+
+    async def _roundtrip(self, conn: _Conn, method: str, target: str, payload: Optional[bytes],
+                         idle: Optional[float] = None):
+        reader, writer = conn
+        if idle is not None:
+            reader = _IdleReader(reader, idle)
+        head = [
+            f"{method} {target} HTTP/1.1",
+            f"Host: {self.host}",
+            "User-Agent: intermediate-api",
+            "Connection: keep-alive",
+        ]
+        if payload is not None:
+            head += ["Content-Type: application/json", f"Content-Length: {len(payload)}"]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + (payload or b""))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("El daemon cerró la conexión")
+        status = int(status_line.split()[1])
+        headers: Dict[str, str] = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        if status in (204, 304) or method == "HEAD":
+            body = b""
+        else:
+            body = await self._read_body(reader, headers)
+        keep = headers.get("connection", "").lower() != "close"
+        return status, body, keep
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Any = None,
+        idle: Optional[float] = None,
+    ) -> Any:
+        """
+        Hace una petición a la API y devuelve el JSON (o el texto) de la
+        respuesta. Lanza DockerAPIError con los códigos >= 400. Con `idle`
+        no hay límite total, solo ese máximo entre lectura y lectura.
+
+        Make an API request and return the response JSON (or text). Raises
+        DockerAPIError for status codes >= 400. With `idle` there is no
+        total limit, only that maximum between one read and the next.
+        """
+        self._bind_loop()
+        target = path
+        if params:
+            target += "?" + urlencode(
+                {k: (json.dumps(v) if isinstance(v, (dict, list)) else v)
+                 for k, v in params.items() if v is not None}
+            )
+        payload = json.dumps(body).encode() if body is not None else None
+
+        async with self._slots:
+            for attempt in (1, 2):
+                conn = await self._acquire()
+                try:
+                    if idle is not None:
+                        status, raw, keep = await self._roundtrip(conn, method, target, payload, idle)
+                    else:
+                        status, raw, keep = await asyncio.wait_for(
+                            self._roundtrip(conn, method, target, payload), self.timeout
+                        )
+                except (ConnectionError, asyncio.IncompleteReadError) as exc:
+                    # Una conexión keep-alive caducada: se reintenta una vez
+                    # A stale keep-alive connection: retry once
+                    self._release(conn, False)
+                    if attempt == 2:
+                        raise DockerAPIError(0, str(exc))
+                    continue
+                except asyncio.TimeoutError:
+                    self._release(conn, False)
+                    if idle is None:
+                        raise
+                    raise DockerAPIError(0, f"El daemon lleva {idle:g}s sin mandar nada")
+                except BaseException:
+                    self._release(conn, False)
+                    raise
+                self._release(conn, keep)
+                break
+
+        text = raw.decode("utf-8", "replace")
+        try:
+            data = json.loads(text) if text.strip() else None
+        except ValueError:
+            data = text
+        if status == 404:
+            raise DockerNotFound(status, data.get("message") if isinstance(data, dict) else text)
+        if status >= 400:
+            raise DockerAPIError(status, data.get("message") if isinstance(data, dict) else text)
+        return data
+
+    async def ping(self) -> bool:
+        return (await self.request("GET", "/_ping")) == "OK"
+
+    async def version(self) -> Dict[str, Any]:
+        return await self.request("GET", "/version")
+
+    async def info(self) -> Dict[str, Any]:
+        return await self.request("GET", "/info")
+
+    async def containers(self, all: bool = False, filters: Optional[Dict[str, List[str]]] = None) -> List[dict]:
+        return await self.request(
+            "GET", "/containers/json", {"all": int(all), "filters": filters}
+        )
+
+    async def inspect_container(self, name: str) -> Dict[str, Any]:
+        return await self.request("GET", f"/containers/{quote(name)}/json")
+
+    async def create_container(self, name: str, config: Dict[str, Any]) -> str:
+        data = await self.request("POST", "/containers/create", {"name": name}, config)
+        return data["Id"]
+
+    async def start_container(self, ident: str):
+        await self.request("POST", f"/containers/{quote(ident)}/start")
+
+    async def stop_container(self, ident: str, timeout: int = 10):
+        await self.request("POST", f"/containers/{quote(ident)}/stop", {"t": timeout})
+
+    async def remove_container(self, ident: str, force: bool = False, volumes: bool = False):
+        await self.request(
+            "DELETE", f"/containers/{quote(ident)}", {"force": int(force), "v": int(volumes)}
+        )
+
+    async def container_stats(self, ident: str) -> Dict[str, Any]:
+        """
+        Una sola muestra de estadísticas (CPU, memoria, red) sin stream.
+        A single stats sample (CPU, memory, network) without streaming.
+        """
+        return await self.request(
+            "GET", f"/containers/{quote(ident)}/stats", {"stream": 0, "one-shot": 1}
+        )
+
+    async def inspect_image(self, ref: str) -> Dict[str, Any]:
+        return await self.request("GET", f"/images/{quote(ref)}/json")
+
+    async def pull_image(self, ref: str):
+        """
+        Descarga la imagen. El daemon contesta 200 y va mandando una línea
+        JSON de progreso tras otra; si falla a medias, lo dice en una de
+        ellas con "error".
+
+        Pull the image. The daemon answers 200 and keeps sending one JSON
+        progress line after another; if it fails half way, it says so in
+        one of them with "error".
+        """
+        repo, _, tag = ref.rpartition(":")
+        data = await self.request(
+            "POST", "/images/create", {"fromImage": repo, "tag": tag}, idle=DOCKER_PULL_IDLE_TIMEOUT
+        )
+        lines = [data] if isinstance(data, dict) else []
+        if isinstance(data, str):
+            for line in data.splitlines():
+                try:
+                    lines.append(json.loads(line))
+                except ValueError:
+                    continue
+        for line in lines:
+            if isinstance(line, dict) and line.get("error"):
+                raise DockerAPIError(500, f"Pull de {ref} fallido: {line['error']}")
+
+    async def networks(self) -> List[dict]:
+        return await self.request("GET", "/networks")
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
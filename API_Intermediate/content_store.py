@@ -0,0 +1,299 @@
+# content_store.py
+import os
+import errno
+import fcntl
+import hashlib
+import pathlib
+import sqlite3
+import threading
+import uuid
+from typing import Any, Dict, List, Optional
+
+# Cómo comparten los proyectos un fichero repetido:
+#   reflink   copia CoW (btrfs/xfs): cada proyecto puede editar su copia
+#             sin tocar las demás. Si el disco no lo soporta, se desactiva
+#   hardlink  el mismo inodo en todos los proyectos. Ojo: filebrowser
+#             edita los ficheros en su sitio, así que un cambio se vería
+#             en todos los proyectos que comparten el fichero
+#   off       sin deduplicación
+# How projects share a repeated file:
+#   reflink   CoW copy (btrfs/xfs): each project can edit its copy without
+#             touching the others. Disabled if the filesystem lacks it
+#   hardlink  the same inode in every project. Beware: filebrowser edits
+#             files in place, so a change would show in every project
+#             sharing the file
+#   off       no deduplication
+# Por defecto reflink, que nunca mezcla proyectos, pero en ext4 (el disco
+# más habitual) no hay reflinks y la deduplicación queda apagada:
+# /docker/storage lo dice en "reason". En ext4 se puede activar con
+# CAS_MODE=hardlink si se acepta que una edición desde filebrowser de un
+# fichero compartido se vea en todos los proyectos que lo tienen (p. ej.
+# lotes de clase con el mismo zip de partida que los alumnos no tocan)
+# Reflink by default, which never mixes projects, but ext4 (the most common
+# filesystem) has no reflinks and deduplication is left off: /docker/storage
+# says so in "reason". On ext4 it can be turned on with CAS_MODE=hardlink
+# when it is acceptable that a filebrowser edit of a shared file shows in
+# every project holding it (e.g. class batches with the same starter zip
+# the students do not touch)
+CAS_MODE = os.getenv("CAS_MODE", "reflink")
+# Ficheros más pequeños no compensan | Smaller files are not worth it
+CAS_MIN_BYTES = int(os.getenv("CAS_MIN_BYTES", "4096"))
+CAS_DIR = ".cas"
+
+# ioctl de Linux para clonar un fichero | Linux ioctl to clone a file
+FICLONE = 0x40049409
+
+
+class ContentStore:
+    """
+    Almacén direccionado por contenido: cada fichero subido se guarda una
+    vez con su sha256 como nombre y los proyectos reciben un reflink (o un
+    hard link) de esa copia. Un índice SQLite apunta cuántos ficheros de
+    los proyectos usan cada blob; DockerManager lo recuenta desde los
+    manifiestos (recount) y los blobs que se quedan a 0 se pueden borrar.
+
+    Content-addressed store: every uploaded file is kept once, named by its
+    sha256, and projects get a reflink (or a hard link) of that copy. A
+    SQLite index records how many project files use each blob; DockerManager
+    recounts it from the manifests (recount) and blobs left at 0 can be
+    deleted.
+    """
+
+    def __init__(self, root: pathlib.Path, mode: str = CAS_MODE):
+        self.root = root
+        self.mode = mode
+        self.requested = mode
+        # Por qué está apagada, si lo está | Why it is off, if it is
+        self.reason: Optional[str] = None
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if mode == "off":
+            self.reason = "CAS_MODE=off"
+            return
+        root.mkdir(parents=True, exist_ok=True)
+        if mode == "reflink" and not self._reflink_supported():
+            self.reason = (
+                f"{root} no admite reflinks (p. ej. ext4); CAS_MODE=hardlink deduplica "
+                "con hard links, pero una edición desde filebrowser se ve en todos los proyectos"
+            )
+            print(f"[Docker] {root} no admite reflinks: deduplicación desactivada")
+            self.mode = "off"
+            return
+        self._conn = sqlite3.connect(
+            str(root / "index.db"), check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "digest TEXT PRIMARY KEY, size INTEGER NOT NULL, refs INTEGER NOT NULL)"
+        )
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    def _reflink_supported(self) -> bool:
+        src = self.root / f".probe-{uuid.uuid4().hex}"
+        dst = src.with_suffix(".clone")
+        try:
+            src.write_bytes(b"probe")
+            self._reflink(src, dst)
+            return True
+        except OSError:
+            return False
+        finally:
+            src.unlink(missing_ok=True)
+            dst.unlink(missing_ok=True)
+
+    @staticmethod
+    def _reflink(src: pathlib.Path, dst: pathlib.Path):
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+    def _share(self, src: pathlib.Path, dst: pathlib.Path):
+        if self.mode == "hardlink":
+            os.link(src, dst)
+        else:
+            self._reflink(src, dst)
+
+    def _blob(self, digest: str) -> pathlib.Path:
+        return self.root / digest[:2] / digest[2:]
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def wants(self, size: int) -> bool:
+        """
+        ¿Merece la pena hashear un fichero de este tamaño? (0 = desconocido)
+        Is a file of this size worth hashing? (0 = unknown)
+        """
+        return self.enabled and (size == 0 or size >= CAS_MIN_BYTES)
+
+    def adopt(self, path: pathlib.Path, digest: str, size: int) -> int:
+        """
+        Mete en el almacén el fichero recién escrito en `path`. Si ya había
+        uno igual, `path` pasa a compartirlo. Devuelve los bytes ahorrados.
+
+        Put the file just written at `path` into the store. If an equal one
+        was already there, `path` starts sharing it. Returns the bytes saved.
+        """
+        if not self.enabled or size < CAS_MIN_BYTES:
+            return 0
+        blob = self._blob(digest)
+        try:
+            with self._lock:
+                if blob.exists():
+                    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+                    self._share(blob, tmp)
+                    os.replace(tmp, path)
+                    saved = size
+                else:
+                    blob.parent.mkdir(exist_ok=True)
+                    self._share(path, blob)
+                    saved = 0
+                self._conn.execute(
+                    "INSERT INTO blobs (digest, size, refs) VALUES (?, ?, 1) "
+                    "ON CONFLICT(digest) DO UPDATE SET refs = refs + 1",
+                    (digest, size),
+                )
+        except OSError as exc:
+            # Demasiados enlaces, otro disco...: el fichero se queda como está
+            # Too many links, another disk...: the file stays as it is
+            if exc.errno not in (errno.EMLINK, errno.EXDEV, errno.EOPNOTSUPP):
+                print(f"[Docker] No se pudo deduplicar {path}: {exc}")
+            return 0
+        return saved
+
+    def adopt_tree(self, folder: pathlib.Path) -> Dict[str, str]:
+        """
+        Igual que adopt para todos los ficheros de una carpeta ya escrita.
+        Devuelve el sha256 de cada uno, por su ruta relativa.
+
+        Same as adopt for every file of an already written folder. Returns
+        each one's sha256, by its relative path.
+        """
+        digests: Dict[str, str] = {}
+        if not self.enabled:
+            return digests
+        for root, _, files in os.walk(folder):
+            for name in files:
+                path = pathlib.Path(root) / name
+                size = path.stat().st_size
+                if size < CAS_MIN_BYTES or path.is_symlink():
+                    continue
+                digest = hashlib.sha256()
+                with open(path, "rb") as fp:
+                    while chunk := fp.read(1024 * 1024):
+                        digest.update(chunk)
+                relative = path.relative_to(folder).as_posix()
+                digests[relative] = digest.hexdigest()
+                self.adopt(path, digests[relative], size)
+        return digests
+
+    def recount(self, references: Dict[str, int]):
+        """
+        Pone en cada blob cuántos ficheros lo usan ahora (`references`,
+        sacado de los manifiestos); los que no salen se quedan a 0.
+
+        Set on every blob how many files use it now (`references`, taken
+        from the manifests); the ones not listed are left at 0.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("UPDATE blobs SET refs = 0")
+                self._conn.executemany(
+                    "UPDATE blobs SET refs = ? WHERE digest = ?",
+                    [(count, digest) for digest, count in references.items()],
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # ¿Queda algún proyecto enlazado al blob? Con reflinks cada copia es su
+    # propio inodo y solo cuenta el índice
+    # Is any project still linked to the blob? With reflinks every copy is
+    # its own inode and only the index counts
+    def _linked(self, st: Optional[os.stat_result]) -> bool:
+        return self.mode == "hardlink" and st is not None and st.st_nlink > 1
+
+    def orphans(self) -> List[str]:
+        """
+        Blobs que ya no usa ningún proyecto según el último recount (y,
+        con hard links, que solo tienen el enlace del almacén).
+
+        Blobs no project uses any more according to the last recount (and,
+        with hard links, left with only the store's link).
+        """
+        if not self.enabled:
+            return []
+        with self._lock:
+            digests = [row[0] for row in self._conn.execute("SELECT digest FROM blobs WHERE refs = 0")]
+        found = []
+        for digest in digests:
+            try:
+                st = self._blob(digest).stat()
+            except FileNotFoundError:
+                st = None
+            if not self._linked(st):
+                found.append(digest)
+        return found
+
+    def forget(self, digest: str) -> int:
+        """
+        Borra un blob huérfano y su fila del índice, salvo que un proyecto
+        lo haya vuelto a usar entretanto. Devuelve los bytes liberados.
+
+        Delete an orphaned blob and its index row, unless a project used it
+        again meanwhile. Returns the bytes freed.
+        """
+        blob = self._blob(digest)
+        with self._lock:
+            row = self._conn.execute("SELECT refs FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            try:
+                st = blob.stat()
+            except FileNotFoundError:
+                st = None
+            if (row is not None and row[0] > 0) or self._linked(st):
+                return 0
+            blob.unlink(missing_ok=True)
+            self._conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        return st.st_size if st else 0
+
+    def usage(self) -> Dict[str, Any]:
+        """
+        Informe de uso: bytes guardados una vez frente a los que ocuparían
+        todas las copias, según el último recount.
+
+        Usage report: bytes stored once against what every copy would take,
+        as of the last recount.
+        """
+        if not self.enabled:
+            return {"mode": self.mode, "requested": self.requested, "enabled": False, "reason": self.reason}
+        with self._lock:
+            blobs, stored, referenced, refs = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(size * refs), 0), "
+                "COALESCE(SUM(refs), 0) FROM blobs"
+            ).fetchone()
+        return {
+            "mode": self.mode,
+            "enabled": True,
+            "min_bytes": CAS_MIN_BYTES,
+            "blobs": blobs,
+            "files": refs,
+            "stored_bytes": stored,
+            "logical_bytes": referenced,
+            "saved_bytes": referenced - stored,
+            "dedup_ratio": round(referenced / stored, 2) if stored else None,
+        }
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
@@ -0,0 +1,287 @@
+# docker_hosts.py
+import os
+import asyncio
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import docker
+
+from async_docker import DOCKER_HOST, AsyncDockerClient
+
+# Hosts Docker además del local (donde corre Caddy), separados por comas:
+#   DOCKER_HOSTS="sv2=tcp://10.0.0.12:2375,sv3=tcp://10.0.0.13:2375"
+# Todos tienen que ver BASE_PATH en la misma ruta (NFS o similar), porque
+# los servicios montan las carpetas de los usuarios
+# Docker hosts besides the local one (where Caddy runs), comma separated.
+# All of them must see BASE_PATH at the same path (NFS or similar), because
+# the services mount the users' folders
+DOCKER_HOSTS = os.getenv("DOCKER_HOSTS", "")
+LOCAL_HOST_NAME = "local"
+# Segundos que vale el inventario de los hosts antes de volver a pedirlo
+# Seconds the hosts' inventory is valid before asking again
+DOCKER_INVENTORY_TTL = float(os.getenv("DOCKER_INVENTORY_TTL", "30"))
+# Reservas de stacks recién colocados que aún no salen en el inventario
+# Reservations of just placed stacks that are not in the inventory yet
+PENDING_TTL = 300
+# Puertos (incluidos) que se publican en los hosts remotos para que Caddy
+# llegue a los servicios, ya que no comparte su red
+# Ports (inclusive) published on the remote hosts so Caddy can reach the
+# services, since it does not share their network
+DOCKER_PUBLISH_PORTS = tuple(int(p) for p in os.getenv("DOCKER_PUBLISH_PORTS", "20000-29999").split("-"))
+
+# Etiquetas que llevan todos los contenedores creados por DockerManager
+# Labels carried by every container DockerManager creates
+MANAGED_LABEL = "iapi.config-hash"
+PROJECT_LABEL = "com.docker.compose.project"
+CPUS_LABEL = "iapi.cpus"
+MEMORY_LABEL = "iapi.memory"
+# Dueño del contenedor: el par exacto usuario/proyecto, sin normalizar
+# Container owner: the exact user/project pair, not normalised
+USER_LABEL = "iapi.user"
+WEBNAME_LABEL = "iapi.project"
+
+
+class DockerHost:
+    """
+    Un daemon Docker donde se pueden colocar stacks, con su cliente
+    asyncio, su cliente del SDK (perezoso) y el último inventario: CPUs,
+    memoria y lo que tienen reservado los contenedores que creamos.
+
+    A Docker daemon stacks can be placed on, with its asyncio client, its
+    (lazy) SDK client and the last inventory: CPUs, memory and what the
+    containers we created have reserved.
+    """
+
+    def __init__(self, name: str, url: str, local: bool = False):
+        self.name = name
+        self.url = url
+        self.local = local
+        # Dirección con la que Caddy llega a los puertos publicados
+        # Address Caddy uses to reach the published ports
+        self.address = None if local else urlparse(url).hostname or name
+        self.aio = AsyncDockerClient(url)
+        self._client: Optional[docker.DockerClient] = None
+        self._lock = threading.Lock()
+        self.network_ready = False
+        # Inventario | Inventory
+        self.ncpu = 0
+        self.memory = 0
+        self.running = 0
+        # contenedor -> {"stack", "cpus", "memory", "ports"}
+        # container -> {"stack", "cpus", "memory", "ports"}
+        self.containers: Dict[str, dict] = {}
+        self.refreshed_at: Optional[float] = None
+        self.error: Optional[str] = None
+        # stack -> (demanda, cuándo) y contenedor -> (puerto, cuándo)
+        # stack -> (demand, when) and container -> (port, when)
+        self.pending: Dict[str, Tuple[Dict[str, float], float]] = {}
+        self.pending_ports: Dict[str, Tuple[int, float]] = {}
+
+    @property
+    def client(self) -> docker.DockerClient:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # El local respeta DOCKER_HOST/DOCKER_TLS_* como siempre
+                    # The local one honours DOCKER_HOST/DOCKER_TLS_* as always
+                    self._client = (
+                        docker.from_env() if self.local else docker.DockerClient(base_url=self.url)
+                    )
+        return self._client
+
+    def stacks(self) -> set:
+        with self._lock:
+            return {c["stack"] for c in self.containers.values()} | set(self.pending)
+
+    def reserved(self) -> Tuple[float, int]:
+        with self._lock:
+            demands = [c for c in self.containers.values()] + [d for d, _ in self.pending.values()]
+        return sum(d["cpus"] for d in demands), sum(d["memory"] for d in demands)
+
+    def load(self, demand: Dict[str, float]) -> float:
+        """
+        Fracción de CPU o memoria (la mayor) que quedaría reservada.
+        Fraction of CPU or memory (the larger one) that would be reserved.
+        """
+        cpus, memory = self.reserved()
+        return max(
+            (cpus + demand["cpus"]) / (self.ncpu or 1),
+            (memory + demand["memory"]) / (self.memory or 1),
+        )
+
+    def reserve(self, stack: str, demand: Dict[str, float]):
+        with self._lock:
+            self.pending[stack] = (demand, time.monotonic())
+
+    def publish_port(self, container: str) -> int:
+        """
+        Puerto del host para el servicio: el que ya tiene el contenedor (así
+        un redespliegue no cambia su configuración) o el primero libre.
+
+        Host port for the service: the one the container already has (so a
+        redeploy does not change its configuration) or the first free one.
+        """
+        with self._lock:
+            current = self.containers.get(container, {}).get("ports")
+            if current:
+                return min(current)
+            if container in self.pending_ports:
+                return self.pending_ports[container][0]
+            used = {port for port, _ in self.pending_ports.values()}
+            for entry in self.containers.values():
+                used |= entry["ports"]
+            first, last = DOCKER_PUBLISH_PORTS
+            for port in range(first, last + 1):
+                if port not in used:
+                    self.pending_ports[container] = (port, time.monotonic())
+                    return port
+        raise RuntimeError(f"No quedan puertos libres en {self.name}")
+
+    async def refresh(self):
+        try:
+            info, listed = await asyncio.gather(
+                self.aio.info(),
+                self.aio.containers(all=True, filters={"label": [MANAGED_LABEL]}),
+            )
+        except Exception as exc:
+            self.error = str(exc) or type(exc).__name__
+            self.refreshed_at = time.time()
+            return
+        containers = {}
+        for container in listed:
+            labels = container.get("Labels") or {}
+            containers[container["Names"][0].lstrip("/")] = {
+                "stack": labels.get(PROJECT_LABEL),
+                "cpus": float(labels.get(CPUS_LABEL) or 0),
+                "memory": int(labels.get(MEMORY_LABEL) or 0),
+                "ports": {p["PublicPort"] for p in container.get("Ports") or [] if p.get("PublicPort")},
+            }
+        now = time.monotonic()
+        with self._lock:
+            self.ncpu = info.get("NCPU") or 0
+            self.memory = info.get("MemTotal") or 0
+            self.running = info.get("ContainersRunning", 0)
+            self.containers = containers
+            # Lo que ya sale en el inventario (o lleva demasiado) deja de estar pendiente
+            # What already shows in the inventory (or is too old) is no longer pending
+            stacks = {c["stack"] for c in containers.values()}
+            self.pending = {
+                stack: entry for stack, entry in self.pending.items()
+                if stack not in stacks and now - entry[1] < PENDING_TTL
+            }
+            self.pending_ports = {
+                name: entry for name, entry in self.pending_ports.items()
+                if name not in containers and now - entry[1] < PENDING_TTL
+            }
+        self.error = None
+        self.refreshed_at = time.time()
+
+    def status(self) -> Dict[str, Any]:
+        cpus, memory = self.reserved()
+        return {
+            "name": self.name,
+            "url": self.url,
+            "local": self.local,
+            "address": self.address,
+            "ncpu": self.ncpu,
+            "memory": self.memory,
+            "running": self.running,
+            "containers": len(self.containers),
+            "stacks": len(self.stacks()),
+            "reserved_cpus": round(cpus, 2),
+            "reserved_memory": memory,
+            "load": round(self.load({"cpus": 0, "memory": 0}), 3) if self.ncpu else None,
+            "refreshed_at": self.refreshed_at,
+            "error": self.error,
+        }
+
+
+class HostScheduler:
+    """
+    Reparte los stacks entre los hosts Docker. Un stack que ya existe se
+    queda donde está; uno nuevo va al host con menos carga (CPU o memoria
+    reservada por los límites de cada Webtype). El inventario se cachea
+    DOCKER_INVENTORY_TTL segundos y lo recién colocado cuenta como reserva
+    mientras tanto, para que una ráfaga no caiga entera en el mismo host.
+
+    Spreads the stacks over the Docker hosts. A stack that already exists
+    stays where it is; a new one goes to the least loaded host (CPU or
+    memory reserved by each Webtype's limits). The inventory is cached for
+    DOCKER_INVENTORY_TTL seconds and what was just placed counts as a
+    reservation meanwhile, so a burst does not all land on one host.
+    """
+
+    def __init__(self, hosts: List[DockerHost]):
+        self.hosts = {host.name: host for host in hosts}
+        self.local = hosts[0]
+        self.refreshed_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    @classmethod
+    def from_env(cls) -> "HostScheduler":
+        hosts = [DockerHost(LOCAL_HOST_NAME, DOCKER_HOST, local=True)]
+        for item in DOCKER_HOSTS.split(","):
+            name, _, url = item.strip().partition("=")
+            if url:
+                hosts.append(DockerHost(name, url))
+        return cls(hosts)
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    def all(self) -> List[DockerHost]:
+        return list(self.hosts.values())
+
+    def remote(self) -> List[DockerHost]:
+        return [host for host in self.hosts.values() if not host.local]
+
+    def get(self, name: Optional[str]) -> DockerHost:
+        if name is None:
+            return self.local
+        if name not in self.hosts:
+            raise ValueError(f"Host Docker desconocido: {name}")
+        return self.hosts[name]
+
+    def locate(self, stack: str) -> Optional[DockerHost]:
+        """
+        Host donde está el stack según el último inventario.
+        Host holding the stack according to the last inventory.
+        """
+        for host in self.hosts.values():
+            if stack in host.stacks():
+                return host
+        return None
+
+    async def refresh(self, force: bool = False):
+        if not force and time.monotonic() - self.refreshed_at < DOCKER_INVENTORY_TTL:
+            return
+        await asyncio.gather(*(host.refresh() for host in self.hosts.values()))
+        self.refreshed_at = time.monotonic()
+
+    async def place(self, stack: str, demand: Dict[str, float]) -> DockerHost:
+        """
+        Elige el host del stack y le apunta la reserva.
+        Choose the stack's host and book the reservation on it.
+        """
+        if len(self.hosts) == 1:
+            return self.local
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await self.refresh()
+            current = self.locate(stack)
+            if current is not None:
+                return current
+            candidates = [h for h in self.hosts.values() if h.error is None and h.ncpu] or [self.local]
+            host = min(candidates, key=lambda h: (h.load(demand), len(h.containers)))
+            host.reserve(stack, demand)
+            print(f"[Docker] {stack} → {host.name} (carga {host.load({'cpus': 0, 'memory': 0}):.2f})")
+            return host
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "inventory_ttl": DOCKER_INVENTORY_TTL,
+            "hosts": [host.status() for host in self.hosts.values()],
+        }
@@ -1,14 +1,145 @@
 # docker_manager.py
 import os
-import subprocess
 import pathlib
-from typing import Dict
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import docker
-import zipfile, os, pathlib, shutil, textwrap
+import zipfile, os, pathlib, shutil
+import asyncio, contextvars, hashlib, json, re, tempfile, threading, time, uuid
+import urllib.error, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from async_docker import AsyncDockerClient, DockerNotFound
+from docker_hosts import (
+    CPUS_LABEL, MANAGED_LABEL, MEMORY_LABEL, USER_LABEL, WEBNAME_LABEL, DockerHost, HostScheduler
+)
+from content_store import CAS_DIR, ContentStore
+from site_manifest import SiteManifest, load_members, members_path, with_digests
+from tracing import traced, tracer
+from zip_preflight import plan, summarize
+from metrics import DEPLOY_PHASE_SECONDS, FILEBROWSER_POOL
 
 # Cambiar este path a la ruta donde se guardarán los servicios de los usuarios
 # Change this path to the path where the user's services will be saved
-BASE_PATH = pathlib.Path("/home/christian/Proyectos/ProyectoClase/apiProyecto/IntermediateAPI_PROYECTO_ASIR/API_Intermediate/srv")  # cámbialo si necesitas otra raíz
+BASE_PATH = pathlib.Path(os.getenv("BASE_PATH", "/home/christian/Proyectos/ProyectoClase/apiProyecto/IntermediateAPI_PROYECTO_ASIR/API_Intermediate/srv"))  # cámbialo si necesitas otra raíz
+
+HTTPD_IMAGE = "httpd:latest"
+FILEBROWSER_IMAGE = "filebrowser/filebrowser:latest"
+SHARED_STATIC_IMAGE = "caddy:2-alpine"
+
+# Cómo se sirven los proyectos "Estatico":
+#   dedicated  un httpd y un filebrowser por proyecto (como siempre)
+#   shared     unos pocos servidores compartidos sirven todos los proyectos
+#              por virtual host y un filebrowser compartido con un usuario
+#              por alumno; un proyecto nuevo no arranca ningún contenedor
+# How "Estatico" projects are served:
+#   dedicated  one httpd and one filebrowser per project (as always)
+#   shared     a few shared servers serve every project by virtual host and
+#              one shared filebrowser has a user per student; a new project
+#              starts no containers at all
+STATIC_MODE = os.getenv("STATIC_MODE", "dedicated")
+SHARED_STATIC_REPLICAS = int(os.getenv("SHARED_STATIC_REPLICAS", "2"))
+SHARED_STACK = "iapi-shared"
+SHARED_DIR = ".shared"
+# Enlaces <proyecto> -> ../<usuario>/<proyecto>/data que usan los
+# servidores compartidos para encontrar cada web
+# <project> -> ../<user>/<project>/data links the shared servers use to
+# find each site
+SITES_DIR = ".sites"
+# Puerto local del filebrowser compartido, para darle de alta usuarios
+# Local port of the shared filebrowser, used to add users to it
+SHARED_FILEBROWSER_PORT = int(os.getenv("SHARED_FILEBROWSER_PORT", "8081"))
+# Bytes (descomprimidos) que pueden ocupar los zips desplegados de un
+# usuario entre todos sus proyectos (0 = sin límite)
+# Bytes (uncompressed) a user's deployed zips may take across all their
+# projects (0 = unlimited)
+USER_QUOTA_BYTES = int(os.getenv("USER_QUOTA_BYTES", str(5 * 1024 * 1024 * 1024)))
+
+# Imágenes que necesita cada Webtype, se descargan antes de desplegar
+# Images each Webtype needs, pulled ahead of any deploy
+WEBTYPE_IMAGES = {
+    "Estatico": [HTTPD_IMAGE, FILEBROWSER_IMAGE]
+    if STATIC_MODE == "dedicated" else [SHARED_STATIC_IMAGE, FILEBROWSER_IMAGE],
+}
+# Límites de cada servicio según el Webtype. Son también lo que reserva el
+# stack al elegir host (memoria en bytes)
+# Limits of each service by Webtype. They are also what the stack reserves
+# when choosing a host (memory in bytes)
+WEBTYPE_LIMITS = {
+    "Estatico": {
+        "httpd": {"cpus": 0.5, "memory": 256 * 1024 ** 2},
+        "filebrowser": {"cpus": 0.25, "memory": 128 * 1024 ** 2},
+    },
+}
+# Cada cuánto se vuelven a descargar (segundos)
+# How often they are pulled again (seconds)
+IMAGE_REFRESH_INTERVAL = int(os.getenv("IMAGE_REFRESH_INTERVAL", "21600"))
+DEFAULT_ADMIN_PASS = "admin123"
+SHARED_FILEBROWSER_ADMIN_PASS = os.getenv("SHARED_FILEBROWSER_ADMIN_PASS", DEFAULT_ADMIN_PASS)
+# Bases de datos de filebrowser preparadas de antemano (dentro de BASE_PATH
+# para que moverlas a un proyecto sea un simple rename)
+# filebrowser databases prepared in advance (inside BASE_PATH so moving
+# one into a project is a plain rename)
+FILEBROWSER_POOL_DIR = ".filebrowser_pool"
+# Zips de partida de los lotes de alumnos, extraídos una sola vez
+# Starter zips of the student batches, extracted only once
+BATCHES_DIR = ".batches"
+# Proyectos borrados a la espera del recolector (dentro de BASE_PATH para
+# que quitarlos de en medio sea un simple rename)
+# Deleted projects waiting for the collector (inside BASE_PATH so moving
+# them out of the way is a plain rename)
+TRASH_DIR = ".trash"
+# Forma válida de un userid o un Webname: cada uno acaba siendo una carpeta
+# bajo BASE_PATH (sin punto inicial no puede caer en .cas, .sites...) y el
+# Webname además un subdominio
+# Valid shape of a userid or a Webname: each ends up as a folder under
+# BASE_PATH (without a leading dot it cannot land on .cas, .sites...) and
+# the Webname also as a subdomain
+NAME_PATTERN = r"^[A-Za-z0-9][A-Za-z0-9_-]{0,62}$"
+FILEBROWSER_POOL_SIZE = int(os.getenv("FILEBROWSER_POOL_SIZE", "4"))
+
+CADDY_NETWORK = "caddy_net"
+
+# Servidor estático compartido: la web sale del primer label del host
+# (<proyecto>.quiere.cafe), así que no hay forma de salirse de .sites
+# Shared static server: the site comes from the host's first label
+# (<project>.quiere.cafe), so there is no way out of .sites
+SHARED_CADDYFILE = f"""{{
+	admin off
+	auto_https off
+}}
+
+:80 {{
+	root * /srv/{SITES_DIR}/{{labels.2}}
+	file_server
+}}
+"""
+# Los contenedores de un stack se crean en paralelo en este pool
+# The containers of a stack are created in parallel on this pool
+_stack_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="stack")
+
+# Quién escucha las fases del despliegue que corre en este hilo
+# Who listens to the phases of the deploy running on this thread
+_phase_listener = threading.local()
+
+
+def _notify_phase(name: str):
+    callback = getattr(_phase_listener, "callback", None)
+    if callback:
+        callback(name, {})
+
+
+@contextmanager
+def deploy_phase(name: str):
+    """
+    Mide una fase del despliegue (métrica y span) y se la anuncia a quien
+    escuche.
+    Time a deploy phase (metric and span) and announce it to whoever is
+    listening.
+    """
+    _notify_phase(name)
+    with tracer.span(name), DEPLOY_PHASE_SECONDS.labels(name).time():
+        yield
+
 
 class DockerManager:
     """
@@ -20,11 +151,58 @@ class DockerManager:
     """
 
     def __init__(self):
-        # Cliente docker api de alto nivel
-        # high level docker api client
-        self.client = docker.from_env()
-        self.low_level = docker.APIClient()
-        self._ensure_network()
+        # Hosts Docker donde colocar los stacks; el primero es el local
+        # Docker hosts to place stacks on; the first one is the local one
+        self.hosts = HostScheduler.from_env()
+        # Cliente asyncio con pool de conexiones del host local, para el
+        # event loop
+        # asyncio client with a connection pool of the local host, for the
+        # event loop
+        self.aio: AsyncDockerClient = self.hosts.local.aio
+        self._pool_lock = threading.Lock()
+        self._pool_refilling = False
+        self._images_lock = threading.Lock()
+        self.image_cache: Dict[str, dict] = {}
+        self._shared_lock = threading.Lock()
+        self._shared_ready = False
+        self._shared_users: set = set()
+        # Almacén de ficheros deduplicados: se abre al usarlo (ver store)
+        # Deduplicated file store: opened on first use (see store)
+        self._store: Optional[ContentStore] = None
+        self._store_lock = threading.Lock()
+
+    # Cliente docker api de alto nivel del host local. Los clientes del SDK
+    # se crean la primera vez que se usan: crearlos ya habla con el daemon,
+    # y la API tiene que arrancar aunque no esté
+    # High level docker api client of the local host. The SDK clients are
+    # created the first time they are used: creating them already talks to
+    # the daemon, and the API must start without it
+    @property
+    def client(self) -> docker.DockerClient:
+        return self.hosts.local.client
+
+    @property
+    def low_level(self) -> docker.APIClient:
+        return self.client.api
+
+    # El almacén crea BASE_PATH/.cas, prueba los reflinks y abre su SQLite:
+    # nada de eso al importar, para que la API arranque aunque BASE_PATH no
+    # exista o no se pueda escribir. Si falla se reintenta en el siguiente uso
+    # The store creates BASE_PATH/.cas, probes reflinks and opens its
+    # SQLite: none of that at import, so the API starts even when BASE_PATH
+    # is missing or read-only. If it fails it is retried on the next use
+    @property
+    def store(self) -> ContentStore:
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = ContentStore(BASE_PATH / CAS_DIR)
+        return self._store
+
+    def close_store(self):
+        with self._store_lock:
+            if self._store is not None:
+                self._store.close()
 
     # ---------- utilidades internas ----------
     # ---------- internal utilities ----------
@@ -38,6 +216,7 @@ class DockerManager:
         (target / "filebrowser_data").mkdir(exist_ok=True)
         return target
 
+    @traced("run_once_container", "image")
     def _run_once_container(
         self, image: str, cmd: str | list[str], volumes: Dict[str, dict]
     ):
@@ -55,109 +234,979 @@ class DockerManager:
             volumes=volumes,
         )
 
-    # Creamos la red si no existe
-    # Create the network if it doesn't exist
-    def _ensure_network(self):
-        if not any(n.name == "caddy_net" for n in self.client.networks.list()):
-            self.client.networks.create("caddy_net", driver="bridge")
+    # Crea una base de datos de filebrowser con su usuario admin
+    # (los dos `docker run --rm` de siempre)
+    # Create a filebrowser database with its admin user
+    # (the usual two `docker run --rm`)
+    # Con `timed` cada paso cuenta como fase del despliegue
+    # With `timed` each step counts as a deploy phase
+    def _build_filebrowser_db(self, dest: pathlib.Path, admin_pass: str, timed: bool = False):
+        def phase(name: str):
+            return deploy_phase(name) if timed else nullcontext()
+
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=dest.parent) as work:
+            volumes = {work: {"bind": "/srv", "mode": "rw"}}
+            with phase("filebrowser_db"):
+                self._run_once_container(
+                    FILEBROWSER_IMAGE,
+                    ["config", "init", "--database", "/srv/filebrowser.db"],
+                    volumes,
+                )
+            with phase("admin_user"):
+                self._run_once_container(
+                    FILEBROWSER_IMAGE,
+                    [
+                        "users",
+                        "add",
+                        "admin",
+                        admin_pass,
+                        "--database",
+                        "/srv/filebrowser.db",
+                        "--perm.admin",
+                    ],
+                    volumes,
+                )
+            os.replace(pathlib.Path(work) / "filebrowser.db", dest)
+
+    def _pool_path(self, admin_pass: str) -> pathlib.Path:
+        key = hashlib.sha256(admin_pass.encode()).hexdigest()[:16]
+        return BASE_PATH / FILEBROWSER_POOL_DIR / key
+
+    # Saca una base de datos ya preparada del pool, si la hay
+    # Take an already prepared database from the pool, if any
+    def _take_pooled_db(self, admin_pass: str, dest: pathlib.Path) -> bool:
+        pool = self._pool_path(admin_pass)
+        with self._pool_lock:
+            for db in sorted(pool.glob("*.db")) if pool.exists() else []:
+                os.replace(db, dest)
+                return True
+        return False
+
+    @traced("refill_filebrowser_pool")
+    def _refill_worker(self):
+        pool = self._pool_path(DEFAULT_ADMIN_PASS)
+        try:
+            pool.mkdir(parents=True, exist_ok=True)
+            while len(list(pool.glob("*.db"))) < FILEBROWSER_POOL_SIZE:
+                self._build_filebrowser_db(
+                    pool / f"{os.urandom(8).hex()}.db", DEFAULT_ADMIN_PASS
+                )
+        except Exception as exc:
+            print(f"[Docker] No se pudo rellenar el pool de filebrowser: {exc}")
+        finally:
+            with self._pool_lock:
+                self._pool_refilling = False
+
+    def refill_filebrowser_pool(self):
+        """
+        Rellena en segundo plano el pool de bases de datos de filebrowser
+        con la contraseña por defecto. Cada base de datos se usa una sola
+        vez porque `config init` genera una clave de firma propia.
+
+        Refill in the background the pool of filebrowser databases with the
+        default password. Each database is used only once because
+        `config init` generates its own signing key.
+        """
+        with self._pool_lock:
+            if self._pool_refilling:
+                return
+            self._pool_refilling = True
+        threading.Thread(target=self._refill_worker, daemon=True).start()
+
+    # Deja la base de datos de filebrowser del proyecto lista
+    # Get the project's filebrowser database ready
+    def _seed_filebrowser_db(self, target: pathlib.Path, admin_pass: str):
+        dest = target / "filebrowser_data" / "filebrowser.db"
+        if dest.exists():
+            # Redespliegue: se conserva la base de datos existente
+            # Redeploy: keep the existing database
+            return
+        start = time.perf_counter()
+        if self._take_pooled_db(admin_pass, dest):
+            _notify_phase("filebrowser_db")
+            FILEBROWSER_POOL.labels("hit").inc()
+            DEPLOY_PHASE_SECONDS.labels("filebrowser_db").observe(time.perf_counter() - start)
+        else:
+            FILEBROWSER_POOL.labels("miss").inc()
+            self._build_filebrowser_db(dest, admin_pass, timed=True)
+        if admin_pass == DEFAULT_ADMIN_PASS:
+            self.refill_filebrowser_pool()
+
+    # Descarga una imagen y apunta su id y su digest
+    # Pull an image and record its id and digest
+    def _pull_image(self, ref: str):
+        repo, _, tag = ref.rpartition(":")
+        started = time.time()
+        try:
+            image = self.client.images.pull(repo, tag=tag)
+        except Exception as exc:
+            with self._images_lock:
+                entry = self.image_cache.setdefault(ref, {"image": ref})
+                entry["error"] = str(exc)
+                entry["last_checked"] = started
+            print(f"[Docker] No se pudo descargar {ref}: {exc}")
+            return
+        digests = image.attrs.get("RepoDigests") or []
+        with self._images_lock:
+            previous = self.image_cache.get(ref, {})
+            self.image_cache[ref] = {
+                "image": ref,
+                "id": image.id,
+                "digest": digests[0] if digests else None,
+                "previous_id": previous.get("id"),
+                "updated": bool(previous.get("id")) and previous.get("id") != image.id,
+                "pulled_at": time.time(),
+                "last_checked": started,
+                "pull_seconds": round(time.time() - started, 3),
+                "error": None,
+            }
+
+    # Creamos la red si no existe (en el host local o en el indicado)
+    # Create the network if it doesn't exist (on the local host or the given one)
+    def _ensure_network(self, host: DockerHost | None = None):
+        host = host or self.hosts.local
+        if host.network_ready:
+            return
+        if not any(n.name == CADDY_NETWORK for n in host.client.networks.list()):
+            host.client.networks.create(CADDY_NETWORK, driver="bridge")
+        host.network_ready = True
+
+    # Nombre del proyecto compose: lo legible con los caracteres que acepta
+    # compose más un hash corto del par exacto, porque al normalizar
+    # "a-b"/"c" y "a"/"b-c" (o "Ana.B" y "ana b") darían el mismo nombre
+    # Compose project name: the readable part with the characters compose
+    # accepts plus a short hash of the exact pair, because once normalised
+    # "a-b"/"c" and "a"/"b-c" (or "Ana.B" and "ana b") would share a name
+    @classmethod
+    def _stack_name(cls, user: str, project: str) -> str:
+        pair = hashlib.sha256(f"{user}\0{project}".encode()).hexdigest()[:8]
+        return f"{cls._legacy_stack_name(user, project)}-{pair}"
+
+    # El nombre de antes, solo para retirar los contenedores que lo llevan
+    # The former name, only to retire the containers that carry it
+    @staticmethod
+    def _legacy_stack_name(user: str, project: str) -> str:
+        return re.sub(r"[^a-z0-9_-]", "-", f"{user}-{project}".lower())
+
+    # ¿Es del proyecto de `target` el contenedor con estas etiquetas? Los
+    # anteriores a las etiquetas de dueño se reconocen por su carpeta
+    # Does the container with these labels belong to `target`'s project? The
+    # ones older than the owner labels are recognised by their folder
+    @staticmethod
+    def _owns(labels: Dict[str, str], target: pathlib.Path) -> bool:
+        if USER_LABEL in labels or WEBNAME_LABEL in labels:
+            return (labels.get(USER_LABEL), labels.get(WEBNAME_LABEL)) == (target.parent.name, target.name)
+        return labels.get("com.docker.compose.project.working_dir") == str(target)
+
+    # Escribe un docker-compose.yml equivalente a los servicios, solo para
+    # poder gestionar el stack a mano con `docker compose`
+    # Write a docker-compose.yml equivalent to the services, only so the
+    # stack can be handled by hand with `docker compose`
+    def _write_compose(self, target: pathlib.Path, stack: str, services: Dict[str, dict]):
+        lines = [f"name: {stack}", "services:"]
+        for service, spec in services.items():
+            lines += [f"  {service}:", f"    image: {spec['image']}"]
+            lines += ["    networks:", f"      - {CADDY_NETWORK}"]
+            lines.append("    volumes:")
+            for host, mount in spec["volumes"].items():
+                volume = f"./{os.path.relpath(host, target)}:{mount['bind']}"
+                if mount.get("mode") == "ro":
+                    volume += ":ro"
+                lines.append(f"      - {json.dumps(volume)}")
+            lines.append("    labels:")
+            for key, value in spec["labels"].items():
+                lines.append(f"      {key}: {json.dumps(value)}")
+            if spec.get("command"):
+                lines.append(f"    command: {json.dumps(spec['command'])}")
+            if spec.get("ports"):
+                lines.append("    ports:")
+                for port, (host_ip, host_port) in spec["ports"].items():
+                    lines.append(f"      - {json.dumps(f'{host_ip}:{host_port}:{port}')}")
+            if spec.get("cpus"):
+                lines.append(f"    cpus: {spec['cpus']}")
+            if spec.get("memory"):
+                lines.append(f"    mem_limit: {spec['memory']}")
+            lines.append("    restart: unless-stopped")
+        lines += ["networks:", f"  {CADDY_NETWORK}:", "    external: true", ""]
+        text = "\n".join(lines)
+        path = target / "docker-compose.yml"
+        # Sin cambios no se reescribe | Not rewritten when unchanged
+        if path.exists() and path.read_text() == text:
+            return False
+        path.write_text(text)
+        return True
+
+    # Nombre, etiquetas y hash de configuración del contenedor de un servicio
+    # Name, labels and config hash of a service's container
+    @staticmethod
+    def _container_name(stack: str, service: str) -> str:
+        return f"{stack}-{service}-1"
+
+    def _service_identity(self, target: pathlib.Path, stack: str, service: str, spec: dict):
+        name = self._container_name(stack, service)
+        config_hash = hashlib.sha256(
+            json.dumps(spec, sort_keys=True).encode()
+        ).hexdigest()
+        labels = {
+            **spec["labels"],
+            # Mismas etiquetas que pone compose, para que `docker compose`
+            # reconozca el stack
+            # Same labels compose sets, so `docker compose` recognises the stack
+            "com.docker.compose.project": stack,
+            "com.docker.compose.service": service,
+            "com.docker.compose.container-number": "1",
+            "com.docker.compose.oneoff": "False",
+            "com.docker.compose.project.working_dir": str(target),
+            "com.docker.compose.project.config_files": str(target / "docker-compose.yml"),
+            MANAGED_LABEL: config_hash,
+            USER_LABEL: target.parent.name,
+            WEBNAME_LABEL: target.name,
+            # Lo que reserva, para el inventario de los hosts
+            # What it reserves, for the hosts' inventory
+            CPUS_LABEL: str(spec.get("cpus", 0)),
+            MEMORY_LABEL: str(spec.get("memory", 0)),
+        }
+        return name, labels, config_hash
+
+    # Quita el contenedor que el servicio tenía con el nombre de stack
+    # anterior, si es de este proyecto (si no, es de otro y se deja)
+    # Remove the container the service had under the former stack name, if
+    # it belongs to this project (otherwise it is someone else's and stays)
+    def _retire_legacy(self, client, target: pathlib.Path, service: str):
+        name = self._container_name(self._legacy_stack_name(target.parent.name, target.name), service)
+        try:
+            legacy = client.containers.get(name)
+        except docker.errors.NotFound:
+            return
+        if self._owns(legacy.labels, target):
+            legacy.remove(v=True, force=True)
+            print(f"[Docker] {name} retirado: el stack ahora se llama de otra forma")
+
+    # Crea (o deja como está) el contenedor de un servicio del stack
+    # Create (or leave as is) the container of one stack service
+    @traced("up_service", "service")
+    def _up_service(
+        self, target: pathlib.Path, stack: str, service: str, spec: dict, host: DockerHost | None = None
+    ) -> str:
+        client = (host or self.hosts.local).client
+        name, labels, config_hash = self._service_identity(target, stack, service, spec)
+        try:
+            current = client.containers.get(name)
+        except docker.errors.NotFound:
+            current = None
+            self._retire_legacy(client, target, service)
+        if current is not None:
+            if not self._owns(current.labels, target):
+                raise RuntimeError(f"El contenedor {name} es de otro proyecto")
+            if current.labels.get(MANAGED_LABEL) == config_hash:
+                if current.status != "running":
+                    current.start()
+                return "unchanged"
+            # Con sus volúmenes anónimos: que no queden sueltos en el host
+            # With its anonymous volumes: none are left loose on the host
+            current.remove(v=True, force=True)
+        limits = {}
+        if spec.get("cpus"):
+            limits["nano_cpus"] = int(spec["cpus"] * 1e9)
+        if spec.get("memory"):
+            limits["mem_limit"] = spec["memory"]
+        client.containers.run(
+            image=spec["image"],
+            command=spec.get("command"),
+            name=name,
+            detach=True,
+            labels=labels,
+            volumes=spec["volumes"],
+            ports={port: tuple(binding) for port, binding in spec.get("ports", {}).items()},
+            network=CADDY_NETWORK,
+            restart_policy={"Name": "unless-stopped"},
+            **limits,
+        )
+        return "recreated" if current is not None else "created"
+
+    def _up_stack(
+        self, target: pathlib.Path, stack: str, services: Dict[str, dict], host: DockerHost | None = None
+    ) -> Dict[str, str]:
+        """
+        Levanta los servicios con el SDK (en paralelo) en vez de con
+        `docker compose up -d`.
+
+        Bring the services up through the SDK (in parallel) instead of with
+        `docker compose up -d`.
+        """
+        with deploy_phase("stack_up"):
+            futures = {
+                service: _stack_pool.submit(
+                    contextvars.copy_context().run, self._up_service, target, stack, service, spec, host
+                )
+                for service, spec in services.items()
+            }
+            return {service: future.result() for service, future in futures.items()}
+
+    # Igual que _up_service pero con el cliente asyncio
+    # Same as _up_service but with the asyncio client
+    @traced("up_service", "service")
+    async def _up_service_async(
+        self, target: pathlib.Path, stack: str, service: str, spec: dict, host: DockerHost | None = None
+    ) -> str:
+        aio = (host or self.hosts.local).aio
+        name, labels, config_hash = self._service_identity(target, stack, service, spec)
+        try:
+            current = await aio.inspect_container(name)
+        except DockerNotFound:
+            current = None
+            legacy = self._container_name(self._legacy_stack_name(target.parent.name, target.name), service)
+            try:
+                found = await aio.inspect_container(legacy)
+            except DockerNotFound:
+                found = None
+            if found is not None and self._owns(found["Config"]["Labels"] or {}, target):
+                await aio.remove_container(found["Id"], force=True, volumes=True)
+                print(f"[Docker] {legacy} retirado: el stack ahora se llama de otra forma")
+        if current is not None:
+            if not self._owns(current["Config"]["Labels"] or {}, target):
+                raise RuntimeError(f"El contenedor {name} es de otro proyecto")
+            if current["Config"]["Labels"].get(MANAGED_LABEL) == config_hash:
+                if not current["State"]["Running"]:
+                    await aio.start_container(current["Id"])
+                return "unchanged"
+            await aio.remove_container(current["Id"], force=True, volumes=True)
+        config = {
+            "Image": spec["image"],
+            "Cmd": spec.get("command"),
+            "Labels": labels,
+            "HostConfig": {
+                "Binds": [
+                    f"{path}:{mount['bind']}:{mount.get('mode', 'rw')}"
+                    for path, mount in spec["volumes"].items()
+                ],
+                "NetworkMode": CADDY_NETWORK,
+                "RestartPolicy": {"Name": "unless-stopped"},
+                "PortBindings": {
+                    port: [{"HostIp": host_ip, "HostPort": str(host_port)}]
+                    for port, (host_ip, host_port) in (spec.get("ports") or {}).items()
+                },
+                "NanoCpus": int(spec.get("cpus", 0) * 1e9),
+                "Memory": spec.get("memory", 0),
+            },
+            "ExposedPorts": {port: {} for port in spec.get("ports") or {}},
+        }
+        try:
+            ident = await aio.create_container(name, config)
+        except DockerNotFound:
+            # La imagen no estaba en caché | The image was not cached
+            await aio.pull_image(spec["image"])
+            ident = await aio.create_container(name, config)
+        await aio.start_container(ident)
+        return "recreated" if current is not None else "created"
+
+    async def up_stack_async(
+        self, target: pathlib.Path, stack: str, services: Dict[str, dict], host: DockerHost | None = None
+    ) -> Dict[str, str]:
+        """
+        Levanta los servicios de un stack a la vez sobre el event loop.
+        Bring a stack's services up at the same time on the event loop.
+        """
+        with tracer.span("stack_up", host=(host or self.hosts.local).name), \
+                DEPLOY_PHASE_SECONDS.labels("stack_up").time():
+            results = await asyncio.gather(*(
+                self._up_service_async(target, stack, service, spec, host)
+                for service, spec in services.items()
+            ))
+        return dict(zip(services, results))
+
+    # Mueve lo extraído en staging a la carpeta data (renames, sin copias).
+    # Se mueve fichero a fichero porque `data` está montada en los
+    # contenedores y cambiar la carpeta entera rompería el bind mount.
+    # Move what was extracted in staging into the data folder (renames, no
+    # copies). Files are moved one by one because `data` is mounted in the
+    # containers and swapping the whole folder would break the bind mount.
+    # Devuelve los nombres movidos | Returns the moved names
+    def _merge_staged(self, staged: pathlib.Path, data: pathlib.Path) -> List[str]:
+        moved = []
+        for root, dirs, files in os.walk(staged):
+            rel = pathlib.Path(root).relative_to(staged)
+            folder = data / rel
+            # Un fichero del zip anterior donde ahora viene una carpeta
+            # (os.walk va de arriba abajo: los padres ya son carpetas)
+            # A file of the previous zip where a folder now arrives
+            # (os.walk goes top-down: the parents are already folders)
+            if folder.is_symlink() or (folder.exists() and not folder.is_dir()):
+                folder.unlink()
+            folder.mkdir(parents=True, exist_ok=True)
+            for name in files:
+                dest = data / rel / name
+                if dest.is_dir():
+                    shutil.rmtree(dest)
+                os.replace(pathlib.Path(root) / name, dest)
+                moved.append((rel / name).as_posix())
+        shutil.rmtree(staged, ignore_errors=True)
+        return moved
 
-    # Descomprime el zip de manera segura
-    # Safely extract the zip
-    def _safe_extract(self, zf: zipfile.ZipFile, dest: pathlib.Path):
+    # Descomprime el zip de manera segura, saltando lo que el manifiesto
+    # da por igual. Devuelve {nombre: (crc, tamaño)} de todos los ficheros
+    # Safely extract the zip, skipping what the manifest says is the same.
+    # Returns {name: (crc, size)} of every file
+    @traced("safe_extract")
+    def _safe_extract(
+        self, zf: zipfile.ZipFile, dest: pathlib.Path, manifest: SiteManifest | None = None,
+        quota_left: Optional[int] = None
+    ) -> Dict[str, Tuple[int, int]]:
+        members = {}
+        extract = []
+        # Antes de escribir nada: zip bombs, límites y cuota
+        # Before writing anything: zip bombs, limits and quota
+        plan(summarize(zf.infolist()), quota_left)
         for member in zf.infolist():
             member_path = dest / member.filename
             if not str(member_path.resolve()).startswith(str(dest.resolve())):
                 raise RuntimeError("Zip traversal detected!")
-        zf.extractall(dest)
+            if member.is_dir():
+                continue
+            members[member.filename] = (member.CRC, member.file_size)
+            if manifest is None or not manifest.unchanged(member.filename, member.CRC, member.file_size):
+                extract.append(member)
+        zf.extractall(dest, extract)
+        return members
+
+    # Paso 0 de los stacks estáticos: dejar la web del alumno en data
+    # Step 0 of the static stacks: put the student's site into data
+    # Con el manifiesto solo se tocan los ficheros añadidos, cambiados o
+    # quitados respecto al zip anterior
+    # With the manifest only the files added, changed or removed since the
+    # previous zip are touched
+    def _fill_data(self, target: pathlib.Path, zip_path: str | None, staged_path: str | None):
+        manifest = SiteManifest(target)
+        members = None
+        # Descomprimir el zip (a un staging, como las subidas en streaming)
+        # Extract the zip (into a staging, like the streamed uploads)
+        if zip_path:
+            staged = target / f".incoming-{uuid.uuid4().hex}"
+            print(f"Extracting {zip_path} → {target/'data'}")
+            with deploy_phase("extract"), zipfile.ZipFile(zip_path) as zf:
+                members = self._safe_extract(
+                    zf, staged, manifest, self.quota_left(target.parent.name, target.name)
+                )
+                members = with_digests(members, self.store.adopt_tree(staged))
+            os.remove(zip_path)  # limpia tmp | Clear tmp
+            staged_path = str(staged)
+        # Zip ya extraído durante la subida | Zip already extracted while uploading
+        elif staged_path:
+            members = load_members(pathlib.Path(staged_path))
+        if not staged_path:
+            return
+        with deploy_phase("merge_staged"):
+            moved = self._merge_staged(pathlib.Path(staged_path), target / "data")
+            members_path(pathlib.Path(staged_path)).unlink(missing_ok=True)
+            if members is not None:
+                report = manifest.apply(members, moved)
+                print(
+                    f"[Docker] {target.parent.name}/{target.name}: {report['written']} escritos, "
+                    f"{report['unchanged']} sin cambios, {report['removed']} borrados"
+                )
+
+    # Quita los contenedores de un proyecto y sus volúmenes anónimos (p. ej.
+    # el httpd/filebrowser dedicado de un proyecto que pasa al modo
+    # compartido, o un proyecto borrado). Se buscan por su carpeta y las
+    # etiquetas de dueño, no por el nombre del stack
+    # Remove a project's containers and their anonymous volumes (e.g. the
+    # dedicated httpd/filebrowser of a project moving to the shared mode,
+    # or a deleted project). They are found by their folder and owner
+    # labels, not by the stack name
+    def _down_stack(self, user: str, project: str) -> int:
+        target = BASE_PATH / user / project
+        removed = 0
+        for host in self.hosts.all():
+            try:
+                containers = host.client.containers.list(
+                    all=True, filters={"label": f"com.docker.compose.project.working_dir={target}"}
+                )
+            except docker.errors.DockerException as exc:
+                if host.local:
+                    raise
+                print(f"[Docker] No se pudo revisar {user}/{project} en {host.name}: {exc}")
+                continue
+            for container in containers:
+                if self._owns(container.labels, target):
+                    container.remove(v=True, force=True)
+                    removed += 1
+        return removed
+
+    # Límites de CPU y memoria de WEBTYPE_LIMITS en cada servicio
+    # WEBTYPE_LIMITS CPU and memory limits on every service
+    @staticmethod
+    def _apply_limits(wtype: str, services: Dict[str, dict]):
+        for service, spec in services.items():
+            spec.update(WEBTYPE_LIMITS.get(wtype, {}).get(service, {}))
+
+    # En un host remoto Caddy no ve la red del contenedor: el puerto se
+    # publica en el host y la etiqueta apunta a esa dirección
+    # On a remote host Caddy cannot see the container's network: the port is
+    # published on the host and the label points at that address
+    def _route_to_host(self, host: DockerHost, stack: str, services: Dict[str, dict]):
+        if host.local:
+            return
+        for service, spec in services.items():
+            upstream = spec["labels"].get("caddy.reverse_proxy", "")
+            match = re.fullmatch(r"\{\{upstreams (\d+)\}\}", upstream)
+            if not match:
+                continue
+            public = host.publish_port(self._container_name(stack, service))
+            spec["ports"] = {f"{match.group(1)}/tcp": ("0.0.0.0", public)}
+            spec["labels"]["caddy.reverse_proxy"] = f"{host.address}:{public}"
+
+    # Servicios del stack compartido: N servidores estáticos idénticos (Caddy
+    # los junta como upstreams del comodín) y un filebrowser para todos
+    # Services of the shared stack: N identical static servers (Caddy merges
+    # them as upstreams of the wildcard) and one filebrowser for everybody
+    def _shared_services(self, shared: pathlib.Path) -> Dict[str, dict]:
+        services = {
+            f"static-{i}": {
+                "image": SHARED_STATIC_IMAGE,
+                "volumes": {
+                    str(BASE_PATH): {"bind": "/srv", "mode": "ro"},
+                    str(shared / "Caddyfile"): {"bind": "/etc/caddy/Caddyfile", "mode": "ro"},
+                },
+                "labels": {
+                    "caddy": "*.quiere.cafe",
+                    # Sin reto DNS no hay certificado comodín: cada web
+                    # pide el suyo al entrar, si /caddy/ask la reconoce
+                    # (ver Caddy/docker-compose.yml)
+                    # Without a DNS challenge there is no wildcard
+                    # certificate: each site requests its own on arrival, if
+                    # /caddy/ask knows it (see Caddy/docker-compose.yml)
+                    "caddy.tls.on_demand": "",
+                    "caddy.reverse_proxy": "{{upstreams 80}}",
+                },
+            }
+            for i in range(SHARED_STATIC_REPLICAS)
+        }
+        services["filebrowser"] = {
+            "image": FILEBROWSER_IMAGE,
+            "volumes": {
+                str(shared / "filebrowser_data" / "filebrowser.db"): {"bind": "/database.db", "mode": "rw"},
+                str(BASE_PATH): {"bind": "/srv", "mode": "rw"},
+            },
+            "labels": {
+                "caddy": "files.quiere.cafe",
+                "caddy.reverse_proxy": "{{upstreams 80}}",
+            },
+            "command": ["--database", "/database.db"],
+            "ports": {"80/tcp": ["127.0.0.1", SHARED_FILEBROWSER_PORT]},
+        }
+        return services
+
+    # Levanta (una vez por proceso) el stack compartido
+    # Bring up the shared stack (once per process)
+    def _ensure_shared_stack(self):
+        with self._shared_lock:
+            if self._shared_ready:
+                return
+            shared = BASE_PATH / SHARED_DIR
+            (shared / "filebrowser_data").mkdir(parents=True, exist_ok=True)
+            (BASE_PATH / SITES_DIR).mkdir(exist_ok=True)
+            (shared / "Caddyfile").write_text(SHARED_CADDYFILE)
+            self._seed_filebrowser_db(shared, SHARED_FILEBROWSER_ADMIN_PASS)
+            services = self._shared_services(shared)
+            self._write_compose(shared, SHARED_STACK, services)
+            self._up_stack(shared, SHARED_STACK, services)
+            self._shared_ready = True
+
+    def _filebrowser_call(self, method: str, path: str, body=None, token: str | None = None) -> bytes:
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{SHARED_FILEBROWSER_PORT}{path}",
+            data=json.dumps(body).encode() if body is not None else None,
+            method=method,
+            headers={"Content-Type": "application/json", **({"X-Auth": token} if token else {})},
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.read()
+
+    # Da de alta al alumno en el filebrowser compartido, limitado a su carpeta
+    # Add the student to the shared filebrowser, scoped to their folder
+    def _ensure_filebrowser_user(self, user: str, password: str):
+        if user in self._shared_users:
+            return
+        for attempt in range(20):
+            try:
+                token = self._filebrowser_call(
+                    "POST", "/api/login",
+                    {"username": "admin", "password": SHARED_FILEBROWSER_ADMIN_PASS},
+                ).decode()
+                break
+            except urllib.error.HTTPError:
+                raise
+            except (urllib.error.URLError, ConnectionError):
+                # Recién arrancado, aún no escucha | Just started, not listening yet
+                time.sleep(0.5)
+        else:
+            raise RuntimeError("El filebrowser compartido no responde")
+        existing = json.loads(self._filebrowser_call("GET", "/api/users", token=token))
+        if not any(u.get("username") == user for u in existing):
+            self._filebrowser_call("POST", "/api/users", {
+                "what": "user",
+                "which": [],
+                "data": {
+                    "username": user,
+                    "password": password,
+                    "scope": f"/{user}",
+                    "locale": "es",
+                    "perm": {
+                        "admin": False, "execute": False, "create": True, "rename": True,
+                        "modify": True, "delete": True, "share": True, "download": True,
+                    },
+                },
+            }, token=token)
+        self._shared_users.add(user)
+
+    # Publica la web: <proyecto>.quiere.cafe -> BASE_PATH/<usuario>/<proyecto>/data
+    # Publish the site: <project>.quiere.cafe -> BASE_PATH/<user>/<project>/data
+    def _link_site(self, user: str, project: str):
+        link = BASE_PATH / SITES_DIR / project
+        dest = pathlib.Path("..") / user / project / "data"
+        if link.is_symlink():
+            if pathlib.Path(os.readlink(link)) == dest:
+                return
+            raise RuntimeError(f"El dominio {project}.quiere.cafe ya lo usa otro usuario")
+        tmp = link.with_name(f".{project}.{uuid.uuid4().hex}")
+        tmp.symlink_to(dest)
+        os.replace(tmp, link)
 
     # ---------- casos públicos ----------
     # ---------- public cases ----------
 
+    def startup(self):
+        """
+        Lo que antes se hacía al importar: conectar con el daemon, crear la
+        red de Caddy y rellenar el pool de filebrowser. Bloqueante: la API
+        la llama en segundo plano, sin esperarla para arrancar.
+
+        What used to happen at import time: connect to the daemon, create
+        Caddy's network and refill the filebrowser pool. Blocking: the API
+        calls it in the background, without waiting for it to start.
+        """
+        self._ensure_network()
+        self.refill_filebrowser_pool()
+
+    def site_manifest(self, user: str, project: str) -> SiteManifest:
+        """
+        Manifiesto del último zip desplegado en el proyecto.
+        Manifest of the last zip deployed in the project.
+        """
+        return SiteManifest(BASE_PATH / user / project)
+
+    def has_site(self, project: str) -> bool:
+        """
+        ¿Hay algún proyecto `project` (sin distinguir mayúsculas, como los
+        dominios)? Es lo que pregunta Caddy antes de pedir un certificado.
+
+        Is there any project `project` (case-insensitive, like domains)?
+        It is what Caddy asks before requesting a certificate.
+        """
+        project = project.lower()
+        if not BASE_PATH.is_dir():
+            return False
+        for user in BASE_PATH.iterdir():
+            if user.name.startswith(".") or not user.is_dir():
+                continue
+            if any(entry.name.lower() == project and entry.is_dir() for entry in user.iterdir()):
+                return True
+        return False
+
+    def quota_left(self, user: str, project: str) -> Optional[int]:
+        """
+        Bytes que le quedan al usuario para el zip de `project` (que
+        sustituye al que ya tenga), según los manifiestos de sus
+        proyectos. None si no hay cuota.
+
+        Bytes the user has left for `project`'s zip (which replaces the
+        one it already has), according to their projects' manifests.
+        None when there is no quota.
+        """
+        if USER_QUOTA_BYTES <= 0:
+            return None
+        used = 0
+        root = BASE_PATH / user
+        if root.is_dir():
+            for entry in root.iterdir():
+                if entry.name != project and not entry.name.startswith(".") and entry.is_dir():
+                    used += SiteManifest(entry).size()
+        return USER_QUOTA_BYTES - used
+
+    def store_references(self) -> Dict[str, int]:
+        """
+        Cuántos ficheros usan cada blob del almacén: los de los manifiestos
+        de los proyectos (no los de TRASH_DIR) y los de las subidas y lotes
+        aún sin desplegar.
+
+        How many files use each blob of the store: those in the projects'
+        manifests (not the ones in TRASH_DIR) and those of the uploads and
+        batches not deployed yet.
+        """
+        counts: Dict[str, int] = {}
+
+        def count(digests):
+            for digest in digests:
+                counts[digest] = counts.get(digest, 0) + 1
+
+        def count_members(paths):
+            for path in paths:
+                members = load_members(path.with_name(path.name[: -len(".members.json")])) or {}
+                count(value[2] for value in members.values() if len(value) > 2)
+
+        if not BASE_PATH.is_dir():
+            return counts
+        for user in BASE_PATH.iterdir():
+            if user.name.startswith(".") or not user.is_dir():
+                continue
+            for project in user.iterdir():
+                if project.is_dir():
+                    count(SiteManifest(project).digests())
+                    count_members(project.glob(".incoming-*.members.json"))
+        count_members((BASE_PATH / BATCHES_DIR).glob("*/*.members.json"))
+        return counts
+
+    def store_usage(self) -> Dict[str, Any]:
+        """
+        Informe del almacén con las referencias recontadas. Bloqueante.
+        Store report with the references recounted. Blocking.
+        """
+        self.store.recount(self.store_references())
+        return self.store.usage()
+
+    def staging_path(self, user: str, project: str) -> pathlib.Path:
+        """
+        Carpeta temporal donde se extrae un zip mientras se sube.
+        Temporary folder where a zip is extracted while it is uploaded.
+        """
+        return self._ensure_path(user, project) / f".incoming-{uuid.uuid4().hex}"
+
+    def batch_staging_path(self, batch_id: str) -> pathlib.Path:
+        """
+        Dónde se extrae el zip de partida de un lote, común a sus alumnos.
+        Where a batch's starter zip is extracted, shared by its students.
+        """
+        path = BASE_PATH / BATCHES_DIR / batch_id
+        path.mkdir(parents=True, exist_ok=True)
+        return path / "starter"
+
+    @traced("copy_staged", "user", "project")
+    def copy_staged(self, source: pathlib.Path, user: str, project: str) -> pathlib.Path:
+        """
+        Copia el zip ya extraído de un lote como staging de un proyecto;
+        los ficheros grandes acaban compartidos en el almacén.
+
+        Copy a batch's already extracted zip as a project's staging; the
+        large files end up shared in the store.
+        """
+        staged = self.staging_path(user, project)
+        shutil.copytree(source, staged)
+        shutil.copyfile(members_path(source), members_path(staged))
+        self.store.adopt_tree(staged)
+        return staged
+
+    @traced("prepare_batch")
+    async def prepare_batch(self, payloads: List[Dict], run_blocking=asyncio.to_thread) -> Dict[str, int]:
+        """
+        Lo común a todos los despliegues de un lote, hecho una vez por host
+        y no una por alumno: colocar los stacks, la red de Caddy, el stack
+        compartido y descargar las imágenes que falten (si no, cada alumno
+        haría su propio pull de la misma imagen).
+
+        What every deploy of a batch has in common, done once per host
+        instead of once per student: placing the stacks, Caddy's network,
+        the shared stack and pulling the missing images (otherwise every
+        student would run their own pull of the same image).
+        """
+        needed: Dict[str, Tuple[DockerHost, set]] = {}
+        for payload in payloads:
+            host = await self.place_request(payload)
+            needed.setdefault(host.name, (host, set()))[1].update(WEBTYPE_IMAGES.get(payload["Webtype"], ()))
+        if STATIC_MODE == "shared" and any(p["Webtype"] == "Estatico" for p in payloads):
+            await run_blocking(self._ensure_shared_stack)
+
+        async def ensure_image(host: DockerHost, ref: str) -> int:
+            try:
+                await host.aio.inspect_image(ref)
+                return 0
+            except DockerNotFound:
+                await host.aio.pull_image(ref)
+                return 1
+
+        pulled = 0
+        for host, refs in needed.values():
+            await run_blocking(self._ensure_network, host)
+            pulled += sum(await asyncio.gather(*(ensure_image(host, ref) for ref in sorted(refs))))
+        return {"hosts": len(needed), "pulled": pulled}
+
+    @traced("delete_project", "user", "project")
+    def delete_project(self, user: str, project: str) -> Dict[str, Any]:
+        """
+        Quita un proyecto: sus contenedores en todos los hosts, su web en el
+        servidor compartido y su carpeta, que se aparta a TRASH_DIR con un
+        rename para que el recolector la borre sin prisa.
+
+        Remove a project: its containers on every host, its site on the
+        shared server and its folder, moved aside into TRASH_DIR with a
+        rename so the collector deletes it at its own pace.
+        """
+        target = BASE_PATH / user / project
+        # Nombres de registros viejos sin validar: nada fuera de BASE_PATH/<u>/<p>
+        # ni las carpetas internas (.cas, .sites...)
+        # Old unvalidated record names: nothing outside BASE_PATH/<u>/<p>
+        # nor the internal folders (.cas, .sites...)
+        if (target.resolve().parent.parent != BASE_PATH.resolve()
+                or user.startswith(".") or project.startswith(".")):
+            raise ValueError(f"{user}/{project} no es una carpeta de proyecto")
+        stack = self._stack_name(user, project)
+        removed = self._down_stack(user, project)
+        link = BASE_PATH / SITES_DIR / project
+        if link.is_symlink() and pathlib.Path(os.readlink(link)) == pathlib.Path("..") / user / project / "data":
+            link.unlink()
+        trashed = None
+        if target.exists():
+            trash = BASE_PATH / TRASH_DIR
+            trash.mkdir(exist_ok=True)
+            trashed = trash / f"{stack}-{uuid.uuid4().hex[:8]}"
+            os.replace(target, trashed)
+        print(f"[Docker] Proyecto {project} de {user} borrado ({removed} contenedores)")
+        return {"stack": stack, "containers": removed, "trashed": str(trashed) if trashed else None}
+
+    def warm_images(self):
+        """
+        Descarga (o actualiza) todas las imágenes de WEBTYPE_IMAGES para que
+        ningún despliegue tenga que esperar a un pull. Bloqueante: llamar
+        desde un hilo.
+
+        Pull (or refresh) every image in WEBTYPE_IMAGES so no deploy ever
+        waits for a pull. Blocking: call it from a thread.
+        """
+        for ref in sorted({i for images in WEBTYPE_IMAGES.values() for i in images}):
+            self._pull_image(ref)
+
+    def image_cache_status(self) -> Dict:
+        now = time.time()
+        with self._images_lock:
+            images = [dict(e) for e in self.image_cache.values()]
+        for entry in images:
+            pulled = entry.get("pulled_at")
+            entry["age_seconds"] = round(now - pulled) if pulled else None
+            entry["stale"] = pulled is None or now - pulled > IMAGE_REFRESH_INTERVAL
+        return {
+            "refresh_interval": IMAGE_REFRESH_INTERVAL,
+            "webtypes": {
+                wtype: all(
+                    self.image_cache.get(ref, {}).get("id") for ref in refs
+                )
+                for wtype, refs in WEBTYPE_IMAGES.items()
+            },
+            "images": images,
+        }
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # Stack estático con filebrowser
     # Static stack with filebrowser
-    def deploy_static_with_filebrowser(
+    def prepare_static_with_filebrowser(
         # TODO: Generar contraseña aleatoria o usar la que el usuario elija
         # TODO: Generate a random password or use the one the user chooses
-        self, user: str, project: str, zip_path: str | None, admin_pass: str = "admin123"
+        self, user: str, project: str, zip_path: str | None, admin_pass: str = DEFAULT_ADMIN_PASS,
+        staged_path: str | None = None, host: DockerHost | None = None
     ):
         """
-        Crea el stack en la carpeta del usuario.
-        Creates the stack in the user's folder.
+        Prepara en la carpeta del usuario todo lo que el stack necesita y
+        devuelve (carpeta, nombre del stack, servicios) para levantarlo en
+        `host` (el local si no se indica).
+
+        Prepare in the user's folder everything the stack needs and return
+        (folder, stack name, services) to bring it up on `host` (the local
+        one if not given).
         """
         target = self._ensure_path(user, project)
 
         # 0) Descomprimir el zip
-        if zip_path:
-            print(f"Extracting {zip_path} → {target/'data'}")
-            with zipfile.ZipFile(zip_path) as zf:
-                self._safe_extract(zf, target / "data")
-            os.remove(zip_path)  # limpia tmp | Clear tmp
+        self._fill_data(target, zip_path, staged_path)
 
-        # 1) Inicializar DB
-        # Initialize DB
-        self._run_once_container(
-            "filebrowser/filebrowser",
-            ["config", "init", "--database", "/srv/filebrowser.db"],
-            {str(target / "filebrowser_data"): {"bind": "/srv", "mode": "rw"}},
-        )
+        # 1) y 2) DB de filebrowser con usuario admin, sacada del pool
+        # 1) and 2) filebrowser DB with the admin user, taken from the pool
+        self._seed_filebrowser_db(target, admin_pass)
 
-        # 2) Crear usuario admin
-        # Create admin user
-        self._run_once_container(
-            "filebrowser/filebrowser",
-            [
-                "users",
-                "add",
-                "admin",
-                admin_pass,
-                "--database",
-                "/srv/filebrowser.db",
-                "--perm.admin",
-            ],
-            {str(target / "filebrowser_data"): {"bind": "/srv", "mode": "rw"}},
-        )
-
-        # 3) Escribir docker-compose.yml
+        # 3) Definir los servicios y escribir docker-compose.yml
         # Puse el dominio mio personal, cambiar al dominio de clase cloudfaster.com
-        # Write docker-compose.yml
+        # Define the services and write docker-compose.yml
         # I used my personal domain, change to cloudfaster.com
-        compose_text = textwrap.dedent(f"""
-        services:
-          httpd:
-            image: httpd:latest
-            networks:
-              - caddy_net
-            volumes:
-              - "./data:/usr/local/apache2/htdocs/"
-            labels:
-              caddy: "{project}.quiere.cafe"
-              caddy.reverse_proxy: "{{{{upstreams 80}}}}"
-            restart: always
-
-          filebrowser:
-            image: filebrowser/filebrowser:latest
-            networks:
-              - caddy_net
-            labels:
-              caddy: "fb-{project}.quiere.cafe"
-              caddy.reverse_proxy: "{{{{upstreams 80}}}}"
-            volumes:
-              - "./filebrowser_data/filebrowser.db:/database.db"
-              - "./data:/srv"
-            command: --database /database.db
-            restart: always
-
-        networks:
-          caddy_net:
-            external: true
-        """)
-        (target / "docker-compose.yml").write_text(compose_text)
-
-        # 4) Levantar servicios con docker compose v2
-        subprocess.run(
-            ["docker", "compose", "up", "-d"], cwd=target, check=True
+        services = {
+            "httpd": {
+                "image": HTTPD_IMAGE,
+                "volumes": {
+                    str(target / "data"): {"bind": "/usr/local/apache2/htdocs/", "mode": "rw"},
+                },
+                "labels": {
+                    "caddy": f"{project}.quiere.cafe",
+                    "caddy.reverse_proxy": "{{upstreams 80}}",
+                },
+            },
+            "filebrowser": {
+                "image": FILEBROWSER_IMAGE,
+                "volumes": {
+                    str(target / "filebrowser_data" / "filebrowser.db"): {"bind": "/database.db", "mode": "rw"},
+                    str(target / "data"): {"bind": "/srv", "mode": "rw"},
+                },
+                "labels": {
+                    "caddy": f"fb-{project}.quiere.cafe",
+                    "caddy.reverse_proxy": "{{upstreams 80}}",
+                },
+                "command": ["--database", "/database.db"],
+            },
+        }
+        stack = self._stack_name(user, project)
+        self._apply_limits("Estatico", services)
+        self._route_to_host(host or self.hosts.local, stack, services)
+        with deploy_phase("compose_write"):
+            self._write_compose(target, stack, services)
+        return target, stack, services
+
+    def deploy_static_with_filebrowser(
+        self, user: str, project: str, zip_path: str | None, admin_pass: str = DEFAULT_ADMIN_PASS,
+        staged_path: str | None = None
+    ):
+        """
+        Crea el stack en la carpeta del usuario.
+        Creates the stack in the user's folder.
+        """
+        host = self.hosts.locate(self._stack_name(user, project)) or self.hosts.local
+        target, stack, services = self.prepare_static_with_filebrowser(
+            user, project, zip_path, admin_pass, staged_path, host
         )
+        # 4) Levantar servicios con el SDK, sin lanzar `docker compose`
+        # Bring the services up with the SDK, without running `docker compose`
+        return self._up_stack(target, stack, services, host)
+
+    # Web estática en el modo compartido
+    # Static site in the shared mode
+    def prepare_static_shared(
+        self, user: str, project: str, zip_path: str | None, admin_pass: str = DEFAULT_ADMIN_PASS,
+        staged_path: str | None = None
+    ):
+        """
+        Deja la web en la carpeta del usuario y la publica en los servidores
+        compartidos: un enlace y, la primera vez, un usuario de filebrowser.
+        No hay contenedores por proyecto, así que devuelve servicios vacíos.
+
+        Put the site in the user's folder and publish it on the shared
+        servers: a link and, the first time, a filebrowser user. There are
+        no per-project containers, so it returns no services.
+        """
+        self._ensure_shared_stack()
+        target = self._ensure_path(user, project)
+        self._link_site(user, project)
+        self._fill_data(target, zip_path, staged_path)
+        self._ensure_filebrowser_user(user, admin_pass)
+        # Si el proyecto tenía contenedores dedicados, sobran
+        # If the project had dedicated containers, they are no longer needed
+        if self._down_stack(user, project):
+            print(f"[Docker] {user}/{project} pasa al modo compartido")
+        return target, SHARED_STACK, {}
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # Aquí empieza el siguiente stack
@@ -167,27 +1216,101 @@ class DockerManager:
 
     # ---------- punto de entrada principal ----------
     # ---------- main entry point ----------
-    def handle_request(self, payload: Dict):
+    def prepare_request(self, payload: Dict, host: DockerHost | None = None):
         """
         Decide qué hacer según el `Webtype` recibido desde FastAPI.
-        Lanza la rutina adecuada.
+        Prepara el stack adecuado para `host` y devuelve (carpeta, stack,
+        servicios).
 
         Decides what to do according to the `Webtype` received from FastAPI.
-        Launches the appropriate routine.
+        Prepares the appropriate stack for `host` and returns (folder,
+        stack, services).
         """
         wtype = payload["Webtype"]
         user = payload["userid"]
         pname = payload["Webname"]
+        # Por si el arranque en segundo plano aún no la ha creado
+        # In case the background startup has not created it yet
+        self._ensure_network(host)
 
+        if wtype == "Estatico" and STATIC_MODE == "shared":
+            return self.prepare_static_shared(
+                user, pname, payload.get("zip_path"), staged_path=payload.get("staged_path")
+            )
         if wtype == "Estatico":
-            self.deploy_static_with_filebrowser(user, pname, payload.get("zip_path"))
+            return self.prepare_static_with_filebrowser(
+                user, pname, payload.get("zip_path"), staged_path=payload.get("staged_path"), host=host
+            )
         #elif wtype == "PHP":
-            #self.deploy_php_with_caddy(user, pname, payload.get("zip_path"))
+            #return self.prepare_php_with_caddy(user, pname, payload.get("zip_path"))
         else:
             # Esqueleto para futuros tipos
             # Skeleton for future types
             raise NotImplementedError(f"Webtype {wtype} aún no soportado")
 
+    @traced("place_request")
+    async def place_request(self, payload: Dict) -> DockerHost:
+        """
+        Host donde va el stack de la petición. Los stacks compartidos
+        viven siempre en el host local, junto a Caddy.
+
+        Host the request's stack goes to. Shared stacks always live on the
+        local host, next to Caddy.
+        """
+        wtype = payload["Webtype"]
+        if wtype == "Estatico" and STATIC_MODE == "shared":
+            return self.hosts.local
+        demand = {"cpus": 0.0, "memory": 0}
+        for limits in WEBTYPE_LIMITS.get(wtype, {}).values():
+            demand["cpus"] += limits.get("cpus", 0)
+            demand["memory"] += limits.get("memory", 0)
+        stack = self._stack_name(payload["userid"], payload["Webname"])
+        return await self.hosts.place(stack, demand)
+
+    @traced("handle_request")
+    def handle_request(self, payload: Dict):
+        """
+        Prepara y levanta el stack desde un hilo (cliente síncrono). Sin
+        event loop no se consulta el inventario: el stack va a donde ya
+        estaba o al host local.
+
+        Prepare and bring up the stack from a thread (sync client). Without
+        an event loop the inventory is not queried: the stack goes where it
+        already was or to the local host.
+        """
+        host = self.hosts.locate(self._stack_name(payload["userid"], payload["Webname"]))
+        return self._up_stack(*self.prepare_request(payload, host), host)
+
+    @traced("handle_request")
+    async def handle_request_async(
+        self, payload: Dict, run_blocking=asyncio.to_thread,
+        on_phase: Optional[Callable[[str, Dict], None]] = None
+    ):
+        """
+        Prepara el stack en un hilo (disco) y lo levanta en el event loop
+        con el cliente asyncio, sin ocupar un hilo por contenedor.
+        `on_phase(fase, info)` se llama al empezar cada fase, también
+        desde el hilo.
+
+        Prepare the stack on a thread (disk work) and bring it up on the
+        event loop with the asyncio client, without a thread per container.
+        `on_phase(phase, info)` is called as each phase starts, also from
+        the thread.
+        """
+        def prepare(host: DockerHost):
+            _phase_listener.callback = on_phase
+            try:
+                return self.prepare_request(payload, host)
+            finally:
+                _phase_listener.callback = None
+
+        host = await self.place_request(payload)
+        tracer.annotate(host=host.name)
+        target, stack, services = await run_blocking(prepare, host)
+        if on_phase:
+            on_phase("stack_up", {"host": host.name})
+        return await self.up_stack_async(target, stack, services, host)
+
 # Helper singleton para no re-crear cliente cada vez
 # Helper singleton to avoid re-creating the client each time
 docker_manager = DockerManager()
@@ -0,0 +1,359 @@
+# garbage.py
+import os
+import asyncio
+import re
+import shutil
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from docker_hosts import MANAGED_LABEL, PROJECT_LABEL, DockerHost, HostScheduler
+from docker_manager import BASE_PATH, BATCHES_DIR, SHARED_STACK, SITES_DIR, TRASH_DIR, docker_manager
+from job_queue import job_queue
+from job_store import job_store
+from metrics import GC_ERRORS, GC_RECLAIMED
+from uploads import uploads
+
+# Cada cuánto pasa el recolector (0 = solo cuando se le pide)
+# How often the collector runs (0 = only when asked)
+GC_INTERVAL = int(os.getenv("GC_INTERVAL", "3600"))
+# Borrados por segundo como mucho, para no saturar disco ni daemon
+# Deletions per second at most, so neither disk nor daemon gets swamped
+GC_RATE = float(os.getenv("GC_RATE", "5"))
+# Segundos que un staging o un lote tiene que llevar sin tocarse para
+# darlo por abandonado
+# Seconds a staging or a batch has to be untouched to count as abandoned
+GC_STALE_SECONDS = int(os.getenv("GC_STALE_SECONDS", "86400"))
+# Lo máximo que espera cada borrado mientras la cola tiene despliegues en
+# marcha; pasado esto sigue, al ritmo de GC_RATE
+# The longest each deletion waits while the queue has deploys running;
+# after that it goes on, at GC_RATE
+GC_MAX_DEFER = float(os.getenv("GC_MAX_DEFER", "300"))
+GC_BUSY_POLL = 1.0
+# Volúmenes anónimos sueltos e imágenes sin etiqueta son de todo el host,
+# no solo de la API (que ya borra los volúmenes de sus contenedores con
+# ellos): solo se limpian si el host es exclusivo para la API
+# Loose anonymous volumes and untagged images belong to the whole host, not
+# only to the API (which already removes its containers' volumes with
+# them): they are only cleaned when the host is dedicated to the API
+GC_PRUNE_HOST = os.getenv("GC_PRUNE_HOST", "0") == "1"
+
+# Volúmenes anónimos: los que crea docker para el VOLUME de una imagen
+# Anonymous volumes: the ones docker creates for an image's VOLUME
+_ANONYMOUS_VOLUME = re.compile(r"[0-9a-f]{64}")
+_WORKING_DIR_LABEL = "com.docker.compose.project.working_dir"
+
+# Un resto encontrado: su nombre y cómo borrarlo
+# A leftover found: its name and how to delete it
+Leftover = Tuple[str, Callable[[], Any]]
+
+
+class GarbageCollector:
+    """
+    Borra lo que los despliegues van dejando atrás: proyectos borrados que
+    esperan en TRASH_DIR, stagings de subidas abandonadas, lotes a medias,
+    enlaces de webs sin proyecto, contenedores cuyo proyecto ya no existe,
+    con GC_PRUNE_HOST volúmenes anónimos e imágenes sin etiqueta de cada
+    host y, con el almacén activo, los blobs que ya no cita ningún
+    manifiesto (ver DockerManager.store_references).
+
+    Cada borrado espera su turno (GC_RATE por segundo) y, mientras la cola
+    tiene despliegues en marcha, se aparta hasta GC_MAX_DEFER: limpiar
+    nunca le quita disco ni daemon a un despliegue. Los borrados van al
+    pool de hilos por defecto, no al executor de la cola.
+
+    Deletes what deploys leave behind: deleted projects waiting in
+    TRASH_DIR, stagings of abandoned uploads, half-done batches, site
+    links without a project, containers whose project no longer exists,
+    with GC_PRUNE_HOST anonymous volumes and untagged images of every host
+    and, with the store enabled, the blobs no manifest mentions any more
+    (see DockerManager.store_references).
+
+    Every deletion waits its turn (GC_RATE per second) and, while the queue
+    has deploys running, steps aside for up to GC_MAX_DEFER: cleaning never
+    takes disk or daemon away from a deploy. Deletions go to the default
+    thread pool, not to the queue's executor.
+    """
+
+    def __init__(self, hosts: HostScheduler, interval: int = GC_INTERVAL, rate: float = GC_RATE):
+        self.hosts = hosts
+        self.interval = interval
+        self.rate = rate
+        self.running = False
+        self.last: Optional[Dict[str, Any]] = None
+        self._next = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    # Espera hasta poder borrar: primero los despliegues, luego el ritmo
+    # Wait until a deletion may go: deploys first, then the rate
+    async def _pace(self):
+        deadline = time.monotonic() + GC_MAX_DEFER
+        while job_queue.stats()["running"] and time.monotonic() < deadline:
+            await asyncio.sleep(GC_BUSY_POLL)
+        if self.rate > 0:
+            wait = self._next - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next = max(self._next, time.monotonic()) + 1 / self.rate
+
+    @staticmethod
+    def _stale(path) -> bool:
+        try:
+            return os.lstat(path).st_mtime < time.time() - GC_STALE_SECONDS
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _rmtree(path) -> Callable[[], Any]:
+        return lambda: shutil.rmtree(path)
+
+    # Resultado de `fetch` en cada host; un host remoto caído se salta
+    # `fetch`'s result on every host; a remote host that is down is skipped
+    def _on_hosts(self, what: str, fetch: Callable[[DockerHost], List]) -> List[Tuple[DockerHost, Any]]:
+        found = []
+        for host in self.hosts.all():
+            try:
+                items = fetch(host)
+            except Exception as exc:
+                if host.local:
+                    raise
+                print(f"[Docker] No se pudieron revisar {what} en {host.name}: {exc}")
+                continue
+            found.extend((host, item) for item in items)
+        return found
+
+    def _trash(self) -> List[Leftover]:
+        trash = BASE_PATH / TRASH_DIR
+        if not trash.is_dir():
+            return []
+        return [(entry.name, self._rmtree(entry)) for entry in sorted(trash.iterdir())]
+
+    async def _staging(self) -> List[Leftover]:
+        # Las subidas viven en el event loop: aquí caducan las abandonadas
+        # (sus carpetas se borran al ritmo de lo demás) y se miran las vivas
+        # Uploads live on the event loop: abandoned ones expire here (their
+        # folders are deleted at the pace of everything else) and the live
+        # ones are looked at
+        expired = uploads.expired()
+        found: List[Leftover] = [
+            (str(upload.staged), lambda upload=upload: uploads.discard(upload)) for upload in expired
+        ]
+        # Los que aún usa una subida (abierta o recién caducada) o un despliegue pendiente
+        # The ones still used by an upload (open or just expired) or a pending deploy
+        busy = {str(upload.staged) for upload in [*uploads.uploads.values(), *expired]}
+        busy |= {r["staged_path"] for r in await job_store.aio.active("docker") if r["staged_path"]}
+        return found + await asyncio.to_thread(self._stale_staging, busy)
+
+    def _stale_staging(self, busy: set) -> List[Leftover]:
+        found = []
+        if not BASE_PATH.is_dir():
+            return found
+        for user in BASE_PATH.iterdir():
+            if user.name.startswith(".") or not user.is_dir():
+                continue
+            for project in user.iterdir():
+                if not project.is_dir():
+                    continue
+                for entry in project.glob(".incoming-*"):
+                    staged = entry.with_name(entry.name.split(".members.json")[0])
+                    if str(staged) in busy or not self._stale(entry):
+                        continue
+                    if entry.is_dir():
+                        found.append((str(entry), self._rmtree(entry)))
+                    else:
+                        found.append((str(entry), lambda entry=entry: entry.unlink(missing_ok=True)))
+        return found
+
+    def _batches(self) -> List[Leftover]:
+        batches = BASE_PATH / BATCHES_DIR
+        if not batches.is_dir():
+            return []
+        return [
+            (entry.name, self._rmtree(entry))
+            for entry in batches.iterdir()
+            if self._stale(entry) and not job_store.active("docker", batch_id=entry.name)
+        ]
+
+    def _sites(self) -> List[Leftover]:
+        sites = BASE_PATH / SITES_DIR
+        if not sites.is_dir():
+            return []
+        return [
+            (link.name, link.unlink)
+            for link in sites.iterdir()
+            if link.is_symlink() and not link.exists()
+        ]
+
+    def _containers(self) -> List[Leftover]:
+        listed = self._on_hosts(
+            "los contenedores",
+            lambda host: host.client.api.containers(all=True, filters={"label": MANAGED_LABEL}),
+        )
+        found = []
+        for host, container in listed:
+            labels = container.get("Labels") or {}
+            working_dir = labels.get(_WORKING_DIR_LABEL)
+            if labels.get(PROJECT_LABEL) == SHARED_STACK or not working_dir or os.path.isdir(working_dir):
+                continue
+            found.append((
+                f"{container['Names'][0].lstrip('/')}@{host.name}",
+                lambda host=host, cid=container["Id"]: host.client.api.remove_container(cid, v=True, force=True),
+            ))
+        return found
+
+    def _volumes(self) -> List[Leftover]:
+        if not GC_PRUNE_HOST:
+            return []
+        listed = self._on_hosts(
+            "los volúmenes",
+            lambda host: host.client.api.volumes(filters={"dangling": True}).get("Volumes") or [],
+        )
+        return [
+            (f"{volume['Name'][:12]}@{host.name}",
+             lambda host=host, name=volume["Name"]: host.client.api.remove_volume(name))
+            for host, volume in listed
+            if _ANONYMOUS_VOLUME.fullmatch(volume["Name"])
+        ]
+
+    def _images(self) -> List[Leftover]:
+        if not GC_PRUNE_HOST:
+            return []
+        listed = self._on_hosts(
+            "las imágenes",
+            lambda host: host.client.api.images(filters={"dangling": True}),
+        )
+        return [
+            (f"{image['Id'][7:19]}@{host.name}",
+             lambda host=host, image_id=image["Id"]: host.client.api.remove_image(image_id))
+            for host, image in listed
+        ]
+
+    def _blobs(self) -> List[Leftover]:
+        store = docker_manager.store
+        if not store.enabled:
+            return []
+        store.recount(docker_manager.store_references())
+        return [(digest[:12], lambda digest=digest: store.forget(digest)) for digest in store.orphans()]
+
+    # En este orden: los contenedores antes que sus volúmenes y la papelera
+    # antes que los blobs que deja sin enlaces
+    # In this order: containers before their volumes and the trash before
+    # the blobs it leaves without links
+    # (los asíncronos corren en el event loop, los demás en un hilo)
+    # (the async ones run on the event loop, the rest in a thread)
+    def _steps(self) -> List[Tuple[str, Callable[[], Any]]]:
+        return [
+            ("containers", self._containers),
+            ("trash", self._trash),
+            ("staging", self._staging),
+            ("batches", self._batches),
+            ("sites", self._sites),
+            ("volumes", self._volumes),
+            ("images", self._images),
+            ("blobs", self._blobs),
+        ]
+
+    async def _collect_logged(self):
+        try:
+            await self.collect()
+        except Exception as exc:
+            print(f"[Docker] Fallo recogiendo restos: {exc}")
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    async def collect(self) -> Dict[str, Any]:
+        """
+        Una pasada: busca cada tipo de resto y lo borra al ritmo permitido.
+        Devuelve cuántos borró y cuántos fallaron de cada tipo.
+
+        One pass: look for every kind of leftover and delete it at the
+        allowed pace. Returns how many of each kind were deleted and failed.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self.running = True
+            started = time.time()
+            reclaimed: Dict[str, int] = {}
+            errors: Dict[str, int] = {}
+            try:
+                for kind, find in self._steps():
+                    try:
+                        if asyncio.iscoroutinefunction(find):
+                            found = await find()
+                        else:
+                            found = await asyncio.to_thread(find)
+                    except Exception as exc:
+                        print(f"[Docker] No se pudieron revisar los restos ({kind}): {exc}")
+                        errors[kind] = errors.get(kind, 0) + 1
+                        GC_ERRORS.labels(kind).inc()
+                        continue
+                    for name, remove in found:
+                        await self._pace()
+                        try:
+                            await asyncio.to_thread(remove)
+                        except Exception as exc:
+                            print(f"[Docker] No se pudo borrar {name} ({kind}): {exc}")
+                            errors[kind] = errors.get(kind, 0) + 1
+                            GC_ERRORS.labels(kind).inc()
+                            continue
+                        reclaimed[kind] = reclaimed.get(kind, 0) + 1
+                        GC_RECLAIMED.labels(kind).inc()
+            finally:
+                self.running = False
+            self.last = {
+                "started_at": started,
+                "duration": round(time.time() - started, 3),
+                "reclaimed": reclaimed,
+                "errors": errors,
+            }
+            if reclaimed:
+                summary = ", ".join(f"{n} {kind}" for kind, n in reclaimed.items())
+                print(f"[Docker] Restos borrados: {summary}")
+            return self.last
+
+    def trigger(self) -> bool:
+        """
+        Lanza una pasada en segundo plano si no hay otra en marcha.
+        Start a pass in the background unless another one is running.
+        """
+        if self.running or (self._task is not None and not self._task.done()):
+            return False
+        self._task = asyncio.create_task(self._collect_logged())
+        return True
+
+    async def run(self):
+        """
+        Bucle de fondo para el lifespan de la API.
+        Background loop for the API's lifespan.
+        """
+        if not self.interval:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._collect_logged()
+
+    def status(self) -> Dict[str, Any]:
+        trash = BASE_PATH / TRASH_DIR
+        return {
+            "interval": self.interval,
+            "rate": self.rate,
+            "stale_seconds": GC_STALE_SECONDS,
+            "max_defer": GC_MAX_DEFER,
+            "prune_host": GC_PRUNE_HOST,
+            "running": self.running,
+            # Si hay blobs que recoger: sin almacén no los hay
+            # Whether there are blobs to collect: without a store there are none
+            "blobs": docker_manager.store.enabled,
+            "trash": sum(1 for _ in trash.iterdir()) if trash.is_dir() else 0,
+            "last": self.last,
+        }
+
+
+# Helper singleton que comparte los hosts de DockerManager
+# Helper singleton sharing DockerManager's hosts
+collector = GarbageCollector(docker_manager.hosts)
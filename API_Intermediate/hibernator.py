@@ -0,0 +1,201 @@
+# hibernator.py
+import os
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from async_docker import AsyncDockerClient, DockerAPIError
+from docker_hosts import MANAGED_LABEL, PROJECT_LABEL, HostScheduler
+from docker_manager import SHARED_STACK, docker_manager
+from metrics import STACKS_HIBERNATED, STACK_WAKES
+
+# Segundos sin tráfico tras los que se para un stack (0 = nunca)
+# Seconds without traffic after which a stack is stopped (0 = never)
+HIBERNATE_IDLE_SECONDS = int(os.getenv("HIBERNATE_IDLE_SECONDS", "3600"))
+# Cada cuánto se mira el tráfico de los stacks
+# How often the stacks' traffic is checked
+HIBERNATE_CHECK_INTERVAL = int(os.getenv("HIBERNATE_CHECK_INTERVAL", "60"))
+# Stacks que nunca se hibernan (el compartido sirve a todos)
+# Stacks that are never hibernated (the shared one serves everybody)
+HIBERNATE_EXCLUDE = {SHARED_STACK}
+
+
+class Hibernator:
+    """
+    Para los stacks que llevan HIBERNATE_IDLE_SECONDS sin tráfico y los
+    vuelve a arrancar con la primera petición. El tráfico se mide con los
+    contadores de red de `docker stats`: si no se mueven, nadie ha entrado.
+    Con el stack parado Caddy deja de tener su host y la petición cae en
+    la ruta comodín que apunta a /wake.
+
+    Stops the stacks that have had no traffic for HIBERNATE_IDLE_SECONDS
+    and starts them again on the first request. Traffic is measured with
+    the network counters of `docker stats`: if they do not move, nobody
+    visited. With the stack stopped Caddy no longer has its host and the
+    request falls through to the wildcard route pointing at /wake.
+
+    Revisa todos los hosts Docker del scheduler.
+    It checks every Docker host of the scheduler.
+    """
+
+    def __init__(self, hosts: HostScheduler, idle_seconds: int = HIBERNATE_IDLE_SECONDS):
+        self.hosts = hosts
+        self.idle_seconds = idle_seconds
+        # stack -> {"bytes", "last_active", "hibernated_at"}
+        self.stacks: Dict[str, Dict[str, Any]] = {}
+        self._waking: Dict[str, asyncio.Task] = {}
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    @staticmethod
+    async def _stack_containers(aio: AsyncDockerClient, stack: str) -> List[dict]:
+        return await aio.containers(
+            all=True, filters={"label": [f"{PROJECT_LABEL}={stack}"]}
+        )
+
+    @staticmethod
+    async def _traffic(aio: AsyncDockerClient, container: dict) -> int:
+        try:
+            stats = await aio.container_stats(container["Id"])
+        except DockerAPIError:
+            return 0
+        return sum(
+            net.get("rx_bytes", 0) + net.get("tx_bytes", 0)
+            for net in (stats.get("networks") or {}).values()
+        )
+
+    async def _hibernate(self, aio: AsyncDockerClient, stack: str, containers: List[dict]):
+        await asyncio.gather(*(aio.stop_container(c["Id"]) for c in containers))
+        self.stacks[stack]["hibernated_at"] = time.time()
+        STACKS_HIBERNATED.inc()
+        print(f"[Docker] {stack} hibernado tras {self.idle_seconds}s sin tráfico")
+
+    async def _start_stack(self, aio: AsyncDockerClient, stack: str):
+        stopped = [c for c in await self._stack_containers(aio, stack) if c["State"] != "running"]
+        await asyncio.gather(*(aio.start_container(c["Id"]) for c in stopped))
+        entry = self.stacks.setdefault(stack, {"bytes": None})
+        entry.update(last_active=time.time(), hibernated_at=None)
+        if stopped:
+            STACK_WAKES.inc()
+            print(f"[Docker] {stack} despertado")
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    async def check(self):
+        """
+        Una pasada: mide el tráfico de cada stack en marcha e hiberna los
+        que llevan demasiado tiempo quietos.
+
+        One pass: measure every running stack's traffic and hibernate the
+        ones that have been still for too long.
+        """
+        now = time.time()
+        by_stack: Dict[str, Tuple[AsyncDockerClient, List[dict]]] = {}
+        for host in self.hosts.all():
+            try:
+                running = await host.aio.containers(filters={"label": [MANAGED_LABEL]})
+            except Exception as exc:
+                if host.local:
+                    raise
+                print(f"[Docker] No se pudo revisar {host.name}: {exc}")
+                continue
+            for container in running:
+                stack = container["Labels"].get(PROJECT_LABEL)
+                if stack and stack not in HIBERNATE_EXCLUDE:
+                    by_stack.setdefault(stack, (host.aio, []))[1].append(container)
+
+        for stack, (aio, containers) in by_stack.items():
+            total = sum(await asyncio.gather(*(self._traffic(aio, c) for c in containers)))
+            entry = self.stacks.setdefault(stack, {"bytes": None, "last_active": now})
+            # Contadores distintos (o reiniciados) = ha habido tráfico
+            # Different (or reset) counters = there was traffic
+            if entry["bytes"] != total:
+                entry["bytes"] = total
+                entry["last_active"] = now
+            entry["hibernated_at"] = None
+            if self.idle_seconds and now - entry["last_active"] >= self.idle_seconds:
+                await self._hibernate(aio, stack, containers)
+
+    async def run(self):
+        """
+        Bucle de fondo para el lifespan de la API.
+        Background loop for the API's lifespan.
+        """
+        if not self.idle_seconds:
+            return
+        while True:
+            try:
+                await self.check()
+            except Exception as exc:
+                print(f"[Docker] Fallo revisando stacks inactivos: {exc}")
+            await asyncio.sleep(HIBERNATE_CHECK_INTERVAL)
+
+    async def stack_for_host(self, host: str) -> Optional[Tuple[AsyncDockerClient, str]]:
+        """
+        Stack cuyo contenedor tiene la etiqueta `caddy=<host>`, con el
+        cliente del host Docker donde vive.
+
+        Stack whose container carries the `caddy=<host>` label, with the
+        client of the Docker host it lives on.
+        """
+        host = host.split(":")[0].lower()
+        for docker_host in self.hosts.all():
+            try:
+                found = await docker_host.aio.containers(all=True, filters={"label": [f"caddy={host}"]})
+            except Exception:
+                if docker_host.local:
+                    raise
+                continue
+            for container in found:
+                if MANAGED_LABEL in container["Labels"]:
+                    return docker_host.aio, container["Labels"].get(PROJECT_LABEL)
+        return None
+
+    async def wake(self, host: str) -> Optional[str]:
+        """
+        Arranca el stack que sirve `host`. Las peticiones que llegan a la
+        vez comparten el mismo arranque. Devuelve el stack o None.
+
+        Start the stack serving `host`. Requests arriving at the same time
+        share one start. Returns the stack or None.
+        """
+        found = await self.stack_for_host(host)
+        if found is None:
+            return None
+        aio, stack = found
+        task = self._waking.get(stack)
+        if task is None:
+            task = asyncio.create_task(self._start_stack(aio, stack))
+            self._waking[stack] = task
+            task.add_done_callback(lambda _: self._waking.pop(stack, None))
+        await asyncio.shield(task)
+        return stack
+
+    def forget(self, stack: str):
+        """
+        Deja de seguir un stack que ya no existe (proyecto borrado).
+        Stop tracking a stack that no longer exists (deleted project).
+        """
+        self.stacks.pop(stack, None)
+
+    def status(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "idle_seconds": self.idle_seconds,
+            "check_interval": HIBERNATE_CHECK_INTERVAL,
+            "stacks": {
+                stack: {
+                    "idle_for": round(now - entry["last_active"]) if entry.get("last_active") else None,
+                    "hibernated": bool(entry.get("hibernated_at")),
+                    "hibernated_at": entry.get("hibernated_at"),
+                }
+                for stack, entry in sorted(self.stacks.items())
+            },
+        }
+
+
+# Helper singleton que comparte los hosts de DockerManager
+# Helper singleton sharing DockerManager's hosts
+hibernator = Hibernator(docker_manager.hosts)
@@ -0,0 +1,233 @@
+# job_queue.py
+import os
+import asyncio
+import contextvars
+import heapq
+import itertools
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Tamaño del pool de workers (= despliegues simultáneos como máximo)
+# Worker pool size (= maximum simultaneous deploys)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Trabajos simultáneos permitidos por usuario
+# Simultaneous jobs allowed per user
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "1"))
+# Despliegues de un mismo lote (clase) que avanzan a la vez
+# Deploys of the same batch (class) that run at the same time
+JOB_BATCH_PARALLEL = int(os.getenv("JOB_BATCH_PARALLEL", str(JOB_WORKERS)))
+# Trabajos en espera antes de rechazar nuevas peticiones
+# Waiting jobs before new requests are rejected
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "500"))
+# Trabajos terminados que se recuerdan para consultar su estado
+# Finished jobs kept around so their status can be queried
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "1000"))
+
+# Prioridades (menor = antes) | Priorities (lower = sooner)
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+
+class QueueFullError(RuntimeError):
+    """La cola ha llegado a JOB_QUEUE_MAX | The queue reached JOB_QUEUE_MAX"""
+
+
+class Job:
+    """
+    Un trabajo pendiente o en curso dentro de la cola.
+    A pending or running job inside the queue.
+    """
+
+    def __init__(
+        self,
+        user: str,
+        handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+        payload: Dict[str, Any],
+        priority: int,
+        kind: str,
+    ):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        self.handler = handler
+        self.payload = payload
+        self.priority = priority
+        self.kind = kind
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.done = asyncio.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "user": self.user,
+            "priority": self.priority,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class JobQueue:
+    """
+    Cola de trabajos con prioridades, un pool fijo de workers y un límite
+    de trabajos simultáneos por usuario. Los trabajos bloqueantes usan un
+    executor propio para no agotar el executor por defecto del event loop.
+
+    Priority job queue with a fixed worker pool and a per-user limit of
+    simultaneous jobs. Blocking work runs on a dedicated executor so the
+    event loop's default executor is never exhausted.
+    """
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        max_per_user: int = JOB_MAX_PER_USER,
+        maxsize: int = JOB_QUEUE_MAX,
+    ):
+        self.workers = workers
+        self.max_per_user = max_per_user
+        self.maxsize = maxsize
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="job-worker"
+        )
+        self._pending: List[tuple] = []
+        self._seq = itertools.count()
+        self._running: Dict[str, int] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._cond: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    # Olvida los trabajos terminados más antiguos
+    # Forget the oldest finished jobs
+    def _prune_history(self):
+        excess = len(self._jobs) - JOB_HISTORY
+        if excess <= 0:
+            return
+        for job_id in [j.id for j in self._jobs.values() if j.done.is_set()][:excess]:
+            del self._jobs[job_id]
+
+    # Saca el trabajo más prioritario cuyo usuario no esté al límite
+    # Pop the highest-priority job whose user is not at the limit
+    def _pop_eligible(self) -> Optional[Job]:
+        for entry in sorted(self._pending):
+            job = entry[2]
+            if self._running.get(job.user, 0) < self.max_per_user:
+                self._pending.remove(entry)
+                heapq.heapify(self._pending)
+                return job
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self._cond:
+                job = self._pop_eligible()
+                while job is None:
+                    await self._cond.wait()
+                    job = self._pop_eligible()
+                self._running[job.user] = self._running.get(job.user, 0) + 1
+
+            job.status = "running"
+            job.started_at = datetime.now()
+            try:
+                await job.handler(job.payload)
+                job.status = "done"
+            except Exception as exc:
+                job.status = "error"
+                job.error = str(exc)
+                print(f"[Queue] ERROR en {job.kind} {job.id}: {exc}")
+            finally:
+                job.finished_at = datetime.now()
+                # El payload puede llevar credenciales; no se conserva
+                # The payload may carry credentials; do not keep it
+                job.payload = {}
+                job.done.set()
+                async with self._cond:
+                    self._running[job.user] -= 1
+                    if not self._running[job.user]:
+                        del self._running[job.user]
+                    self._cond.notify_all()
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    async def start(self):
+        self._cond = asyncio.Condition()
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(
+        self,
+        user: str,
+        handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+        payload: Dict[str, Any],
+        priority: int = PRIORITY_NORMAL,
+        kind: str = "docker",
+    ) -> Job:
+        """
+        Encola un trabajo. Lanza QueueFullError si la cola está llena.
+        Enqueue a job. Raises QueueFullError if the queue is full.
+        """
+        if len(self._pending) >= self.maxsize:
+            raise QueueFullError(f"Cola llena ({self.maxsize} trabajos en espera)")
+        job = Job(user, handler, payload, priority, kind)
+        self._prune_history()
+        self._jobs[job.id] = job
+        async with self._cond:
+            heapq.heappush(self._pending, (priority, next(self._seq), job))
+            self._cond.notify_all()
+        return job
+
+    async def run_blocking(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Ejecuta una función bloqueante en el executor de la cola, con el
+        contexto (la traza en curso) de quien la llama.
+        Run a blocking function on the queue's executor, with the caller's
+        context (the current trace).
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, context.run, func, *args)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def position(self, job_id: str) -> Optional[int]:
+        for pos, entry in enumerate(sorted(self._pending)):
+            if entry[2].id == job_id:
+                return pos
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_per_user": self.max_per_user,
+            "max_queued": self.maxsize,
+            "queued": len(self._pending),
+            "running": sum(self._running.values()),
+            "running_per_user": dict(self._running),
+        }
+
+
+# Helper singleton compartido por los endpoints
+# Helper singleton shared by the endpoints
+job_queue = JobQueue()
@@ -0,0 +1,420 @@
+# job_store.py
+import asyncio
+import functools
+import os
+import pathlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+# Ruta de la base de datos de trabajos (SQLite en modo WAL)
+# Path of the jobs database (SQLite in WAL mode)
+JOB_DB_PATH = pathlib.Path(
+    os.getenv("JOB_DB_PATH", pathlib.Path(__file__).parent / "jobs.db")
+)
+# Tamaño de página por defecto y máximo de los listados
+# Default and maximum page size for the listings
+PAGE_DEFAULT = 50
+PAGE_MAX = 500
+# Segundos durante los que una Idempotency-Key identifica su petición
+# Seconds during which an Idempotency-Key identifies its request
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+
+# Estados en los que un trabajo ya no va a cambiar
+# Statuses in which a job will not change any more
+FINAL_STATUSES = ("done", "error", "rejected", "interrupted", "deleted")
+
+# Columnas de cada tabla que se pueden filtrar desde la API
+# Columns of each table that can be filtered from the API
+TABLES = {
+    "docker": {
+        "table": "docker_jobs",
+        "columns": ["job_id", "userid", "Webtype", "Webname", "zip_path", "staged_path", "content_hash", "idempotency_key", "batch_id", "status", "error"],
+        "filters": ["job_id", "batch_id", "userid", "Webname", "Webtype", "status"],
+    },
+    "proxmox": {
+        "table": "proxmox_jobs",
+        "columns": ["job_id", "userid", "os", "disksize", "cores", "memory", "sshpb", "node", "vmid", "batch_id", "status", "error"],
+        "filters": ["job_id", "batch_id", "userid", "os", "status"],
+    },
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docker_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT,
+    userid TEXT NOT NULL,
+    Webtype TEXT NOT NULL,
+    Webname TEXT NOT NULL,
+    zip_path TEXT,
+    staged_path TEXT,
+    content_hash TEXT,
+    idempotency_key TEXT,
+    batch_id TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_docker_userid ON docker_jobs (userid, id);
+CREATE INDEX IF NOT EXISTS ix_docker_webname ON docker_jobs (Webname, id);
+CREATE INDEX IF NOT EXISTS ix_docker_webtype ON docker_jobs (Webtype, id);
+CREATE INDEX IF NOT EXISTS ix_docker_status ON docker_jobs (status, id);
+CREATE INDEX IF NOT EXISTS ix_docker_created ON docker_jobs (created_at);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_docker_job ON docker_jobs (job_id);
+CREATE INDEX IF NOT EXISTS ix_docker_project ON docker_jobs (userid, Webname, id);
+CREATE INDEX IF NOT EXISTS ix_docker_idempotency ON docker_jobs (userid, idempotency_key);
+CREATE INDEX IF NOT EXISTS ix_docker_batch ON docker_jobs (batch_id, id);
+
+-- La contraseña del usuario nunca se guarda aquí
+-- The user's password is never stored here
+CREATE TABLE IF NOT EXISTS proxmox_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT,
+    userid TEXT NOT NULL,
+    os TEXT NOT NULL,
+    disksize INTEGER NOT NULL,
+    cores INTEGER NOT NULL,
+    memory INTEGER NOT NULL,
+    sshpb TEXT,
+    node TEXT,
+    vmid INTEGER,
+    batch_id TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_proxmox_userid ON proxmox_jobs (userid, id);
+CREATE INDEX IF NOT EXISTS ix_proxmox_os ON proxmox_jobs (os, id);
+CREATE INDEX IF NOT EXISTS ix_proxmox_status ON proxmox_jobs (status, id);
+CREATE INDEX IF NOT EXISTS ix_proxmox_created ON proxmox_jobs (created_at);
+CREATE INDEX IF NOT EXISTS ix_proxmox_batch ON proxmox_jobs (batch_id, id);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_proxmox_job ON proxmox_jobs (job_id);
+"""
+
+# Columnas añadidas después de crear la tabla: (tabla, columna, tipo)
+# Columns added after the table was created: (table, column, type)
+MIGRATIONS = [
+    ("docker_jobs", "staged_path", "TEXT"),
+    ("docker_jobs", "content_hash", "TEXT"),
+    ("docker_jobs", "idempotency_key", "TEXT"),
+    ("docker_jobs", "batch_id", "TEXT"),
+    ("proxmox_jobs", "node", "TEXT"),
+    ("proxmox_jobs", "vmid", "INTEGER"),
+    ("proxmox_jobs", "batch_id", "TEXT"),
+]
+
+
+class JobStore:
+    """
+    Guarda de forma persistente los despliegues Docker y Proxmox en SQLite
+    con índices por usuario, nombre, estado y fecha de creación. Los
+    listados usan paginación por cursor (el id de la última fila devuelta),
+    así que cada página cuesta O(log n) sin importar cuántos haya.
+
+    Persistently stores Docker and Proxmox deployments in SQLite with
+    indexes on user, name, status and creation time. Listings use cursor
+    pagination (the id of the last row returned), so every page costs
+    O(log n) however many deployments exist.
+    """
+
+    def __init__(self, path: pathlib.Path = JOB_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(path), check_same_thread=False, isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self._conn.executescript(SCHEMA)
+        self._mark_interrupted()
+        self.aio = AsyncJobStore(self)
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    # Añade a una base de datos antigua las columnas que le falten
+    # Add the missing columns to an older database
+    def _migrate(self):
+        for table, column, ctype in MIGRATIONS:
+            existing = [r[1] for r in self._conn.execute(f"PRAGMA table_info({table})")]
+            if existing and column not in existing:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ctype}")
+
+    # Los trabajos que estaban en cola o en curso al apagar ya no existen
+    # Jobs that were queued or running at shutdown no longer exist
+    def _mark_interrupted(self):
+        now = datetime.now().isoformat()
+        final = ", ".join(f"'{s}'" for s in FINAL_STATUSES)
+        for spec in TABLES.values():
+            self._conn.execute(
+                f"UPDATE {spec['table']} SET status = 'interrupted', updated_at = ? "
+                f"WHERE status NOT IN ({final})",
+                (now,),
+            )
+
+    def _execute(self, sql: str, params: Tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    # Las filas se leen sin soltar el candado: la conexión es compartida
+    # Rows are read without letting go of the lock: the connection is shared
+    def _fetchall(self, sql: str, params: Tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _fetchone(self, sql: str, params: Tuple = ()) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    def insert(self, kind: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Inserta un registro y lo devuelve con su `id`.
+        Insert a record and return it with its `id`.
+        """
+        spec = TABLES[kind]
+        now = datetime.now().isoformat()
+        row = {c: record.get(c) for c in spec["columns"]}
+        row["status"] = row["status"] or "queued"
+        cols = list(row) + ["created_at", "updated_at"]
+        values = tuple(row.values()) + (now, now)
+        cur = self._execute(
+            f"INSERT INTO {spec['table']} ({', '.join(cols)}) "
+            f"VALUES ({', '.join('?' for _ in cols)})",
+            values,
+        )
+        return {"id": cur.lastrowid, **row, "created_at": now, "updated_at": now}
+
+    def update(self, kind: str, item_id: int, **fields: Any):
+        spec = TABLES[kind]
+        fields = {k: v for k, v in fields.items() if k in spec["columns"]}
+        if not fields:
+            return
+        sets = ", ".join(f"{k} = ?" for k in fields)
+        self._execute(
+            f"UPDATE {spec['table']} SET {sets}, updated_at = ? WHERE id = ?",
+            tuple(fields.values()) + (datetime.now().isoformat(), item_id),
+        )
+
+    def get(self, kind: str, item_id: int) -> Optional[Dict[str, Any]]:
+        row = self._fetchone(
+            f"SELECT * FROM {TABLES[kind]['table']} WHERE id = ?", (item_id,)
+        )
+        return dict(row) if row else None
+
+    def latest(self, kind: str, **where: Any) -> Optional[Dict[str, Any]]:
+        """
+        El registro más reciente con esos valores exactos en sus columnas.
+        The most recent record with those exact values in its columns.
+        """
+        spec = TABLES[kind]
+        unknown = set(where) - set(spec["columns"])
+        if unknown:
+            raise ValueError(f"Columnas no soportadas: {', '.join(sorted(unknown))}")
+        conditions = " AND ".join(f"{key} = ?" for key in where) or "1"
+        row = self._fetchone(
+            f"SELECT * FROM {spec['table']} WHERE {conditions} ORDER BY id DESC LIMIT 1",
+            tuple(where.values()),
+        )
+        return dict(row) if row else None
+
+    def active(self, kind: str, **where: Any) -> List[Dict[str, Any]]:
+        """
+        Registros con esos valores que siguen en cola o en curso.
+        Records with those values that are still queued or running.
+        """
+        spec = TABLES[kind]
+        unknown = set(where) - set(spec["columns"])
+        if unknown:
+            raise ValueError(f"Columnas no soportadas: {', '.join(sorted(unknown))}")
+        final = ", ".join("?" for _ in FINAL_STATUSES)
+        conditions = "".join(f" AND {key} = ?" for key in where)
+        rows = self._fetchall(
+            f"SELECT * FROM {spec['table']} WHERE status NOT IN ({final}){conditions} ORDER BY id",
+            FINAL_STATUSES + tuple(where.values()),
+        )
+        return [dict(r) for r in rows]
+
+    def update_where(self, kind: str, where: Dict[str, Any], up_to: int, **fields: Any) -> int:
+        """
+        Actualiza de una vez los registros con los valores de `where` cuyo
+        id no pasa de `up_to` (los posteriores no se tocan). Devuelve
+        cuántos cambió.
+
+        Update at once the records with the values of `where` whose id is
+        not above `up_to` (later ones are left alone). Returns how many
+        changed.
+        """
+        spec = TABLES[kind]
+        unknown = set(where) - set(spec["columns"])
+        if unknown:
+            raise ValueError(f"Columnas no soportadas: {', '.join(sorted(unknown))}")
+        fields = {k: v for k, v in fields.items() if k in spec["columns"]}
+        if not fields:
+            return 0
+        sets = ", ".join(f"{k} = ?" for k in fields)
+        conditions = "".join(f" AND {key} = ?" for key in where)
+        cur = self._execute(
+            f"UPDATE {spec['table']} SET {sets}, updated_at = ? WHERE id <= ?{conditions}",
+            tuple(fields.values()) + (datetime.now().isoformat(), up_to) + tuple(where.values()),
+        )
+        return cur.rowcount
+
+    def find_idempotent(self, kind: str, userid: str, key: str) -> Optional[Dict[str, Any]]:
+        """
+        La petición de `userid` con esa Idempotency-Key, si no ha caducado
+        (IDEMPOTENCY_TTL) y no se rechazó (rechazada no hizo nada: se
+        puede reintentar con la misma clave).
+
+        The request of `userid` with that Idempotency-Key, unless it
+        expired (IDEMPOTENCY_TTL) or was rejected (a rejected one did
+        nothing: it may be retried with the same key).
+        """
+        record = self.latest(kind, userid=userid, idempotency_key=key)
+        if record is None or record["status"] == "rejected":
+            return None
+        expires = datetime.fromisoformat(record["created_at"]) + timedelta(seconds=IDEMPOTENCY_TTL)
+        return record if expires > datetime.now() else None
+
+    def batch(self, kind: str, batch_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Resumen de un lote: cuántos hay en cada estado y cada fila.
+        Summary of a batch: how many are in each status and every row.
+        """
+        spec = TABLES[kind]
+        rows = [
+            dict(r) for r in self._fetchall(
+                f"SELECT * FROM {spec['table']} WHERE batch_id = ? ORDER BY id", (batch_id,)
+            )
+        ]
+        if not rows:
+            return None
+        counts: Dict[str, int] = {}
+        for row in rows:
+            counts[row["status"]] = counts.get(row["status"], 0) + 1
+        return {
+            "batch_id": batch_id,
+            "total": len(rows),
+            "finished": sum(n for status, n in counts.items() if status in FINAL_STATUSES),
+            "counts": counts,
+            "items": rows,
+        }
+
+    def list(
+        self,
+        kind: str,
+        cursor: Optional[int] = None,
+        limit: int = PAGE_DEFAULT,
+        created_after: Optional[str] = None,
+        created_before: Optional[str] = None,
+        **filters: Any,
+    ) -> Dict[str, Any]:
+        """
+        Devuelve una página de registros en orden de creación y el cursor
+        para pedir la siguiente (`None` si no hay más).
+
+        Return one page of records in creation order and the cursor to ask
+        for the next one (`None` when there are no more).
+        """
+        spec = TABLES[kind]
+        limit = max(1, min(limit, PAGE_MAX))
+        where: List[str] = []
+        params: List[Any] = []
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key not in spec["filters"]:
+                raise ValueError(f"Filtro no soportado: {key}")
+            where.append(f"{key} = ?")
+            params.append(value)
+        if cursor is not None:
+            where.append("id > ?")
+            params.append(cursor)
+        if created_after:
+            where.append("created_at >= ?")
+            params.append(created_after)
+        if created_before:
+            where.append("created_at < ?")
+            params.append(created_before)
+        sql = f"SELECT * FROM {spec['table']}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id LIMIT ?"
+        params.append(limit + 1)
+
+        rows = [dict(r) for r in self._fetchall(sql, tuple(params))]
+        next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+        return {"items": rows[:limit], "next_cursor": next_cursor}
+
+    def close(self):
+        self.aio.close()
+        with self._lock:
+            self._conn.close()
+
+
+class AsyncJobStore:
+    """
+    Las mismas llamadas de JobStore para el event loop: cada una va al hilo
+    de la base de datos y devuelve un future. Ese hilo es uno solo, así que
+    se ejecutan en el orden en que se piden, aunque no se esperen (una
+    escritura sin await ya está hecha para la siguiente lectura).
+
+    The same calls as JobStore for the event loop: each one goes to the
+    database thread and returns a future. There is a single such thread,
+    so they run in the order they are made, even when not awaited (a write
+    without await is already done for the next read).
+    """
+
+    def __init__(self, store: JobStore):
+        self._store = store
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+
+    def _run(self, method, *args: Any, **kwargs: Any) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(method, *args, **kwargs)
+        )
+
+    def insert(self, kind: str, record: Dict[str, Any]) -> asyncio.Future:
+        return self._run(self._store.insert, kind, record)
+
+    def update(self, kind: str, item_id: int, **fields: Any) -> asyncio.Future:
+        return self._run(self._store.update, kind, item_id, **fields)
+
+    def get(self, kind: str, item_id: int) -> asyncio.Future:
+        return self._run(self._store.get, kind, item_id)
+
+    def latest(self, kind: str, **where: Any) -> asyncio.Future:
+        return self._run(self._store.latest, kind, **where)
+
+    def active(self, kind: str, **where: Any) -> asyncio.Future:
+        return self._run(self._store.active, kind, **where)
+
+    def update_where(self, kind: str, where: Dict[str, Any], up_to: int, **fields: Any) -> asyncio.Future:
+        return self._run(self._store.update_where, kind, where, up_to, **fields)
+
+    def find_idempotent(self, kind: str, userid: str, key: str) -> asyncio.Future:
+        return self._run(self._store.find_idempotent, kind, userid, key)
+
+    def batch(self, kind: str, batch_id: str) -> asyncio.Future:
+        return self._run(self._store.batch, kind, batch_id)
+
+    def list(self, kind: str, **kwargs: Any) -> asyncio.Future:
+        return self._run(self._store.list, kind, **kwargs)
+
+    def close(self):
+        # Espera a las escrituras pendientes antes de cerrar la conexión
+        # Waits for pending writes before the connection is closed
+        self._executor.shutdown(wait=True)
+
+
+# Helper singleton para compartir la conexión
+# Helper singleton to share the connection
+job_store = JobStore()
@@ -1,186 +1,1218 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query, BackgroundTasks
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
-from enum import Enum
-import uvicorn
-import asyncio
-from datetime import datetime
-import shutil, tempfile, os, zipfile, pathlib, aiofiles
-from docker_manager import docker_manager
-
-
-app = FastAPI(title="Intermediate API for Proxmox and Docker")
-
-class ProxmoxTemplate(str, Enum):
-    WINDOWS_11 = "Windows 11"
-    WINDOWS_SERVER_2025 = "Windows Server 2025"
-    WINDOWS_SERVER_2022 = "Windows Server 2022"
-    UBUNTU24C = "Ubuntu 24 Client LTS"
-    UBUNTU24S = "Ubuntu 24 Server LTS"
-    FEDORA = "Fedora"
-    REDHAT = "RedHat"
-
-class DockerWebtype(str, Enum):
-    ESTATICO = "Estatico"
-    PHP = "PHP"
-    LARAVEL = "Laravel"
-    REACT_VITE = "React/Vite"
-    NODE = "Node"
-    NEXT = "Next"
-    VITE = "Vite"
-    WORDPRESS = "WordPress"
-    MYSQL = "MySQL"
-    MARIADB = "MariaDB"
-    POSTGRES = "Postgress"
-    REDIS = "Redis"
-    MONGODB = "MongoDB"
-    VSCODE_SERVER = "VSCode Server"
-
-class Proxmox(BaseModel):
-    userid: str
-    upassword: str
-    os: ProxmoxTemplate
-    disksize: int
-    cores: int = Field(default=1)
-    memory: int
-    sshpb: Optional[str] = None
-
-class Docker(BaseModel):
-    userid: str
-    Webtype: DockerWebtype
-    Webname: str
-
-class HeartbeatResponse(BaseModel):
-    status: str
-    timestamp: str
-    uptime: float
-    version: str
-
-proxmox_items = []
-docker_items = []
-start_time = datetime.now()
-api_version = "1.2.0"
-async def process_proxmox_request(proxmox_item: Dict[str, Any]):
-    """Simulate an asynchronous processing of the Proxmox request"""
-    await asyncio.sleep(2)
-    print(f"Proxmox VM created for user: {proxmox_item['userid']}")
-
-async def process_docker_request(docker_item: Dict[str, Any]):
-    """Create folders and execute docker commands without blocking the main thread"""
-    try:
-        await asyncio.to_thread(docker_manager.handle_request, docker_item)
-        print(f"[Docker] Deploy completado para {docker_item['Webname']}")
-    except Exception as exc:
-        print(f"[Docker] ERROR: {exc}")
-
-@app.get("/heartbeat", response_model=HeartbeatResponse)
-async def heartbeat():
-    """Heartbeat endpoint to verify that the API is functioning"""
-    uptime = (datetime.now() - start_time).total_seconds()
-    return {
-        "status": "running",
-        "timestamp": datetime.now().isoformat(),
-        "uptime": uptime,
-        "version": api_version
-    }
-
-@app.post("/proxmox/")
-async def create_proxmox(
-    background_tasks: BackgroundTasks,
-    userid: str = Form(...),
-    upassword: str = Form(...),
-    os: ProxmoxTemplate = Form(...),
-    disksize: int = Form(...),
-    cores: int = Form(1),
-    memory: int = Form(...),
-    sshpb: Optional[str] = Form(None)
-):
-    proxmox_item = Proxmox(
-        userid=userid,
-        upassword=upassword,
-        os=os,
-        disksize=disksize,
-        cores=cores,
-        memory=memory,
-        sshpb=sshpb
-    )
-    proxmox_items.append(proxmox_item)
-    background_tasks.add_task(process_proxmox_request, proxmox_item.dict())
-    
-    return {
-        "status": "processing",
-        "message": "Proxmox VM creation started",
-        "vm_details": proxmox_item
-    }
-
-@app.get("/proxmox/", response_model=List[Proxmox])
-async def read_proxmox():
-    return proxmox_items
-
-@app.get("/proxmox/{item_id}", response_model=Proxmox)
-async def read_proxmox_item(item_id: int):
-    if item_id < 0 or item_id >= len(proxmox_items):
-        raise HTTPException(status_code=404, detail="Item not found")
-    return proxmox_items[item_id]
-
-@app.post("/docker/")
-async def create_docker(
-    background_tasks: BackgroundTasks,
-    userid: str = Form(...),
-    Webtype: DockerWebtype = Form(...),
-    Webname: str = Form(...),
-    userfile: Optional[UploadFile] = File(None)
-):
-    file_info = None
-    zip_path: str | None = None
-
-    if userfile:
-        # guarda el contenido en un tmp seguro
-        suffix = pathlib.Path(userfile.filename).suffix.lower()
-        if suffix != ".zip":
-            raise HTTPException(400, "Solo se aceptan archivos .zip")
-
-        fd, zip_path = tempfile.mkstemp(suffix=".zip")
-        async with aiofiles.open(fd, "wb") as out_fp:
-            while chunk := await userfile.read(1024 * 1024):
-                await out_fp.write(chunk)
-        file_info = {"filename": userfile.filename, "stored_as": zip_path}
-
-    
-    docker_item = {
-        "userid": userid,
-        "Webtype": Webtype,
-        "Webname": Webname,
-        "zip_path": zip_path
-    }
-    
-    docker_items.append(docker_item)
-    background_tasks.add_task(process_docker_request, docker_item)
-    
-    return {
-        "status": "processing",
-        "message": "Docker container creation started",
-        "container_details": docker_item
-    }
-
-@app.get("/docker/")
-async def read_docker():
-    return docker_items
-
-@app.get("/docker/{item_id}")
-async def read_docker_item(item_id: int):
-    if item_id < 0 or item_id >= len(docker_items):
-        raise HTTPException(status_code=404, detail="Item not found")
-    return docker_items[item_id]
-
-@app.get("/")
-async def read_root():
-    return {
-        "mensaje": "Intermediate API for Proxmox and Docker",
-        "proxmox_templates": [template.value for template in ProxmoxTemplate],
-        "docker_webtypes": [webtype.value for webtype in DockerWebtype],
-        "health_check": "/heartbeat"
-    }
-
-if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Query, Request, Response
+from fastapi.responses import HTMLResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, List, Dict, Any
+from enum import Enum
+import uvicorn
+import asyncio
+from datetime import datetime
+import shutil, os, re, zipfile, pathlib, uuid, hashlib, html, urllib.parse
+from typing import AsyncIterator
+from contextlib import asynccontextmanager, contextmanager
+from readiness import readiness
+from docker_manager import docker_manager, IMAGE_REFRESH_INTERVAL, NAME_PATTERN
+from proxmox_manager import proxmox_manager, PROXMOX_NODE, TEMPLATE_IDS
+from job_queue import job_queue, QueueFullError, JOB_BATCH_PARALLEL, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from job_store import job_store, FINAL_STATUSES, PAGE_DEFAULT, PAGE_MAX
+from hibernator import hibernator
+from garbage import collector
+from progress import progress, sse
+from tracing import traced, tracer
+from roster import RosterError, parse_roster
+from uploads import TUS_VERSION, UploadConflict, UploadError, UploadLocked, parse_metadata, uploads
+from zip_preflight import QuotaExceeded, analyze, plan, stream_limit
+from zip_stream import ZIP_MAX_TOTAL_BYTES, StreamingZipExtractor, ZipStreamError
+from site_manifest import members_path, save_members
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from metrics import DEPLOY_ERRORS, DEPLOY_PHASE_SECONDS, DEPLOY_SECONDS, DEPLOYS_DEDUPLICATED, ZIP_PREFLIGHT, track_hosts, track_runtime
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    readiness.since_created("app_import")
+    with readiness.step("lifespan"):
+        # Arranca el pool de workers de la cola de despliegues
+        # Start the deploy queue's worker pool
+        await job_queue.start()
+        # Docker y Proxmox se conectan en segundo plano: la API arranca
+        # aunque alguno esté caído o vaya lento
+        # Docker and Proxmox connect in the background: the API starts even
+        # if one of them is down or slow
+        background = [
+            asyncio.create_task(open_store()),
+            asyncio.create_task(connect_docker()),
+            asyncio.create_task(connect_proxmox()),
+            asyncio.create_task(readiness.run()),
+            # Para los stacks sin tráfico | Stop the stacks without traffic
+            asyncio.create_task(hibernator.run()),
+            # Borra lo que dejan atrás los despliegues | Delete what deploys leave behind
+            asyncio.create_task(collector.run()),
+        ]
+    yield
+    for task in background:
+        task.cancel()
+    await job_queue.stop()
+    await docker_manager.aio.close()
+    docker_manager.close_store()
+    job_store.close()
+
+async def connect_docker():
+    """Connect to the daemon (retrying while it is down), then keep the deploy images fresh"""
+    delay = 1
+    while True:
+        try:
+            with readiness.step("docker_init"):
+                await asyncio.to_thread(docker_manager.startup)
+            break
+        except Exception as exc:
+            print(f"[Docker] No se pudo preparar el daemon, reintento en {delay}s: {exc}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+    await refresh_images()
+
+async def open_store():
+    """Open the content store off the event loop; on failure it is retried on first use and /ready shows why"""
+    try:
+        with readiness.step("store_init"):
+            await asyncio.to_thread(lambda: docker_manager.store)
+    except Exception as exc:
+        print(f"[Docker] No se pudo abrir el almacén de ficheros: {exc}")
+
+async def check_store():
+    """The content store is open (opening it now if it was not)"""
+    return await asyncio.to_thread(lambda: docker_manager.store is not None)
+
+async def connect_proxmox():
+    """Log in to Proxmox ahead of the first request"""
+    try:
+        with readiness.step("proxmox_login"):
+            await proxmox_manager.connect()
+    except Exception as exc:
+        print(f"[Proxmox] No se pudo iniciar sesión: {exc}")
+
+async def refresh_images():
+    """Pre-pull the deploy images at startup and then on a schedule"""
+    while True:
+        await asyncio.to_thread(docker_manager.warm_images)
+        await asyncio.sleep(IMAGE_REFRESH_INTERVAL)
+
+app = FastAPI(title="Intermediate API for Proxmox and Docker", lifespan=lifespan)
+track_runtime(job_queue, proxmox_manager)
+track_hosts(docker_manager.hosts)
+readiness.add_check("docker", docker_manager.aio.ping)
+for docker_host in docker_manager.hosts.remote():
+    readiness.add_check(f"docker:{docker_host.name}", docker_host.aio.ping)
+readiness.add_check("proxmox", proxmox_manager.ping)
+readiness.add_check("store", check_store)
+
+class JobPriority(str, Enum):
+    HIGH = "high"
+    NORMAL = "normal"
+    LOW = "low"
+
+PRIORITY_VALUES = {
+    JobPriority.HIGH: PRIORITY_HIGH,
+    JobPriority.NORMAL: PRIORITY_NORMAL,
+    JobPriority.LOW: PRIORITY_LOW,
+}
+
+class ProxmoxTemplate(str, Enum):
+    WINDOWS_11 = "Windows 11"
+    WINDOWS_SERVER_2025 = "Windows Server 2025"
+    WINDOWS_SERVER_2022 = "Windows Server 2022"
+    UBUNTU24C = "Ubuntu 24 Client LTS"
+    UBUNTU24S = "Ubuntu 24 Server LTS"
+    FEDORA = "Fedora"
+    REDHAT = "RedHat"
+
+class DockerWebtype(str, Enum):
+    ESTATICO = "Estatico"
+    PHP = "PHP"
+    LARAVEL = "Laravel"
+    REACT_VITE = "React/Vite"
+    NODE = "Node"
+    NEXT = "Next"
+    VITE = "Vite"
+    WORDPRESS = "WordPress"
+    MYSQL = "MySQL"
+    MARIADB = "MariaDB"
+    POSTGRES = "Postgress"
+    REDIS = "Redis"
+    MONGODB = "MongoDB"
+    VSCODE_SERVER = "VSCode Server"
+
+class Proxmox(BaseModel):
+    userid: str
+    upassword: str
+    os: ProxmoxTemplate
+    disksize: int
+    cores: int = Field(default=1)
+    memory: int
+    sshpb: Optional[str] = None
+
+class ProxmoxStudent(BaseModel):
+    userid: str
+    upassword: str
+    sshpb: Optional[str] = None
+
+class ProxmoxBatch(BaseModel):
+    """Same VM for a whole class: one entry per student"""
+    os: ProxmoxTemplate
+    disksize: int
+    cores: int = Field(default=1)
+    memory: int
+    linked: bool = True
+    students: List[ProxmoxStudent] = Field(..., min_length=1)
+
+class Docker(BaseModel):
+    userid: str = Field(..., pattern=NAME_PATTERN)
+    Webtype: DockerWebtype
+    Webname: str = Field(..., pattern=NAME_PATTERN)
+
+class ProxmoxRecord(BaseModel):
+    """Stored Proxmox request, without the user's password"""
+    id: int
+    job_id: Optional[str] = None
+    userid: str
+    os: ProxmoxTemplate
+    disksize: int
+    cores: int
+    memory: int
+    sshpb: Optional[str] = None
+    node: Optional[str] = None
+    vmid: Optional[int] = None
+    batch_id: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
+
+class ProxmoxPage(BaseModel):
+    items: List[ProxmoxRecord]
+    next_cursor: Optional[int] = None
+
+class HeartbeatResponse(BaseModel):
+    status: str
+    timestamp: str
+    uptime: float
+    version: str
+
+start_time = datetime.now()
+api_version = "1.2.0"
+# Lo que se decide leyendo la base de datos y se escribe en ella después
+# (repetidos, borrados): una petición a la vez, para que dos simultáneas no
+# decidan las dos sobre lo mismo
+# What is decided by reading the database and then written to it
+# (repeats, deletions): one request at a time, so two simultaneous ones do
+# not both decide on the same thing
+job_decisions = asyncio.Lock()
+
+def set_status(kind: str, item_id: int, status: str, **fields: Any) -> asyncio.Future:
+    """Store a job's new status (in order, off the event loop) and announce it to whoever follows its events"""
+    written = job_store.aio.update(kind, item_id, status=status, **fields)
+    progress.publish(kind, item_id, status, **fields)
+    return written
+
+def proxmox_phase(item_id: int, phase: str, info: Dict[str, Any]):
+    """Clone percentages only go to the event stream, not to the database"""
+    if "progress" in info:
+        progress.publish("proxmox", item_id, phase, **info)
+    else:
+        set_status("proxmox", item_id, phase, **info)
+
+async def process_proxmox_request(proxmox_item: Dict[str, Any]):
+    """Clone, configure and start the VM without blocking the event loop"""
+    with tracer.span("deploy_proxmox", item=("proxmox", proxmox_item["id"]), os=proxmox_item["os"]):
+        item_id = proxmox_item["id"]
+        set_status("proxmox", item_id, "running")
+
+        def on_phase(phase: str, info: Dict[str, Any]):
+            proxmox_phase(item_id, phase, info)
+
+        try:
+            info = await proxmox_manager.create_vm_and_start(proxmox_item, on_phase)
+            set_status("proxmox", item_id, "done", **info)
+            print(f"[Proxmox] VM {info['vmid']} lista para {proxmox_item['userid']}")
+        except Exception as exc:
+            set_status("proxmox", item_id, "error", error=str(exc))
+            print(f"[Proxmox] ERROR: {exc} (traza {tracer.current_trace()})")
+            raise
+
+async def process_proxmox_batch(batch: Dict[str, Any]):
+    """Clone every VM of a batch at once (linked clones unless told otherwise)"""
+    with tracer.span("proxmox_batch", item=("batch", batch["batch_id"]), vms=len(batch["items"])):
+        items = batch["items"]
+        for item in items:
+            set_status("proxmox", item["id"], "running")
+
+        def on_phase(index: int, phase: str, info: Dict[str, Any]):
+            proxmox_phase(items[index]["id"], phase, info)
+
+        results = await proxmox_manager.create_batch(items, on_phase, linked=batch["linked"])
+        failed = 0
+        for item, result in zip(items, results):
+            if isinstance(result, Exception):
+                failed += 1
+                set_status("proxmox", item["id"], "error", error=str(result))
+                print(f"[Proxmox] ERROR para {item['userid']}: {result}")
+            else:
+                set_status("proxmox", item["id"], "done", **result)
+        print(f"[Proxmox] Lote {batch['batch_id']}: {len(items) - failed}/{len(items)} VMs listas")
+        if failed:
+            raise RuntimeError(f"{failed} de {len(items)} VMs fallaron")
+
+async def process_docker_request(docker_item: Dict[str, Any]):
+    """Create folders and execute docker commands without blocking the main thread"""
+    with tracer.span(
+        "deploy_docker", item=("docker", docker_item["id"]),
+        userid=docker_item["userid"], Webname=docker_item["Webname"], Webtype=docker_item["Webtype"]
+    ):
+        set_status("docker", docker_item["id"], "running")
+        try:
+            with DEPLOY_SECONDS.labels(docker_item["Webtype"]).time():
+                await docker_manager.handle_request_async(
+                    docker_item, job_queue.run_blocking,
+                    lambda phase, info: progress.publish("docker", docker_item["id"], phase, **info)
+                )
+            set_status("docker", docker_item["id"], "done")
+            print(f"[Docker] Deploy completado para {docker_item['Webname']}")
+        except Exception as exc:
+            DEPLOY_ERRORS.labels(docker_item["Webtype"]).inc()
+            set_status("docker", docker_item["id"], "error", error=str(exc))
+            print(f"[Docker] ERROR: {exc} (traza {tracer.current_trace()})")
+            raise
+
+async def process_docker_batch(batch: Dict[str, Any]):
+    """Do a class's shared work once, then deploy every student with bounded parallelism"""
+    with tracer.span("docker_batch", item=("batch", batch["batch_id"]), projects=len(batch["items"])):
+        items, starter = batch["items"], batch["starter"]
+        try:
+            shared = await docker_manager.prepare_batch(items, job_queue.run_blocking)
+            print(
+                f"[Docker] Lote {batch['batch_id']}: {shared['hosts']} host(s) listos, "
+                f"{shared['pulled']} imágenes descargadas"
+            )
+        except Exception as exc:
+            for item in items:
+                set_status("docker", item["id"], "error", error=str(exc))
+            if starter:
+                shutil.rmtree(pathlib.Path(starter).parent, ignore_errors=True)
+            raise
+        gate = asyncio.Semaphore(JOB_BATCH_PARALLEL)
+
+        async def deploy(item: Dict[str, Any]):
+            async with gate:
+                if starter:
+                    try:
+                        staged = await job_queue.run_blocking(
+                            docker_manager.copy_staged, pathlib.Path(starter), item["userid"], item["Webname"]
+                        )
+                    except Exception as exc:
+                        set_status("docker", item["id"], "error", error=str(exc))
+                        raise
+                    item["staged_path"] = str(staged)
+                    job_store.aio.update("docker", item["id"], staged_path=str(staged))
+                await process_docker_request(item)
+
+        try:
+            results = await asyncio.gather(*(deploy(item) for item in items), return_exceptions=True)
+        finally:
+            if starter:
+                shutil.rmtree(pathlib.Path(starter).parent, ignore_errors=True)
+        failed = sum(isinstance(result, Exception) for result in results)
+        print(f"[Docker] Lote {batch['batch_id']}: {len(items) - failed}/{len(items)} despliegues listos")
+        if failed:
+            raise RuntimeError(f"{failed} de {len(items)} despliegues fallaron")
+
+async def process_docker_delete(docker_item: Dict[str, Any]):
+    """Take a project's stack down and move its folder aside for the garbage collector"""
+    with tracer.span(
+        "delete_docker", item=("docker_delete", docker_item["id"]),
+        userid=docker_item["userid"], Webname=docker_item["Webname"]
+    ):
+        project = {"userid": docker_item["userid"], "Webname": docker_item["Webname"]}
+        try:
+            result = await job_queue.run_blocking(
+                docker_manager.delete_project, docker_item["userid"], docker_item["Webname"]
+            )
+        except Exception as exc:
+            set_status("docker", docker_item["id"], "error", error=f"Borrado fallido: {exc}")
+            print(f"[Docker] ERROR borrando {docker_item['Webname']}: {exc} (traza {tracer.current_trace()})")
+            raise
+        hibernator.forget(result["stack"])
+        # Todos los despliegues del proyecto hasta el borrado, no los posteriores
+        # Every deploy of the project up to the deletion, not later ones
+        await job_store.aio.update_where("docker", project, docker_item["up_to"], status="deleted")
+        progress.publish("docker", docker_item["id"], "deleted", **result)
+        collector.trigger()
+
+async def process_proxmox_delete(proxmox_item: Dict[str, Any]):
+    """Stop the VM and destroy it with its disks"""
+    with tracer.span("delete_proxmox", item=("proxmox_delete", proxmox_item["id"]), vmid=proxmox_item["vmid"]):
+        try:
+            existed = await proxmox_manager.destroy_vm(
+                proxmox_item["node"] or PROXMOX_NODE, proxmox_item["vmid"]
+            )
+        except Exception as exc:
+            set_status("proxmox", proxmox_item["id"], "error", error=f"Borrado fallido: {exc}")
+            print(f"[Proxmox] ERROR borrando la VM {proxmox_item['vmid']}: {exc} (traza {tracer.current_trace()})")
+            raise
+        if not existed:
+            print(f"[Proxmox] La VM {proxmox_item['vmid']} ya no existía")
+        set_status("proxmox", proxmox_item["id"], "deleted")
+
+async def enqueue(user: str, handler, item: Dict[str, Any], priority: JobPriority, kind: str):
+    """Put a stored request on the job queue, answering 503 when the queue is full"""
+    tracer.bind(kind, item["id"])
+    try:
+        job = await job_queue.submit(
+            user, handler, item, priority=PRIORITY_VALUES[priority], kind=kind
+        )
+    except QueueFullError as exc:
+        set_status(kind, item["id"], "rejected", error=str(exc))
+        raise HTTPException(status_code=503, detail=str(exc))
+    job_store.aio.update(kind, item["id"], job_id=job.id)
+    progress.publish(kind, item["id"], "queued", job_id=job.id)
+    item["job_id"] = job.id
+    return job
+
+async def enqueue_delete(kind: str, handler, record: Dict[str, Any], **extra: Any):
+    """Queue a teardown behind the user's pending deploys, answering 503 when the queue is full"""
+    # Con job_decisions tomado: un segundo DELETE ya ve el borrado en curso
+    # With job_decisions held: a second DELETE already sees the deletion in progress
+    await set_status(kind, record["id"], "deleting")
+    tracer.bind(f"{kind}_delete", record["id"])
+    try:
+        return await job_queue.submit(
+            record["userid"], handler, {**record, **extra}, priority=PRIORITY_NORMAL, kind=f"{kind}_delete"
+        )
+    except QueueFullError as exc:
+        set_status(kind, record["id"], record["status"])
+        raise HTTPException(status_code=503, detail=str(exc))
+
+async def deletable(kind: str, item_id: int) -> Dict[str, Any]:
+    """The record to delete: 404 if missing, 410 if already deleted, 409 while it is still in progress"""
+    record = await job_store.aio.get(kind, item_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    if record["status"] == "deleted":
+        raise HTTPException(status_code=410, detail="Already deleted")
+    if record["status"] not in FINAL_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Item is {record['status']}")
+    return record
+
+async def ingest_zip(chunks: AsyncIterator[bytes], userid: str, Webname: str,
+                     parallel: bool = True) -> Dict[str, Any]:
+    """Extract a zip into a staging folder while its bytes arrive, skipping files the project already has"""
+    staged = await asyncio.to_thread(docker_manager.staging_path, userid, Webname)
+    manifest = await asyncio.to_thread(docker_manager.site_manifest, userid, Webname)
+    quota_left = await asyncio.to_thread(docker_manager.quota_left, userid, Webname)
+    return await extract_upload(chunks, staged, manifest.unchanged, stream_limit(quota_left), parallel)
+
+@traced("extract_upload")
+async def extract_upload(chunks: AsyncIterator[bytes], staged: pathlib.Path, skip=None,
+                         max_total_bytes: int = ZIP_MAX_TOTAL_BYTES, parallel: bool = True) -> Dict[str, Any]:
+    """Stream a zip into `staged` and leave its member list next to it"""
+    extractor = StreamingZipExtractor(
+        staged, max_total_bytes=max_total_bytes, parallel=parallel, store=docker_manager.store, skip=skip
+    )
+    digest = hashlib.sha256()
+
+    def feed(chunk: bytes):
+        digest.update(chunk)
+        extractor.feed(chunk)
+
+    try:
+        # Incluye el tiempo de subida: la extracción va al ritmo del cliente
+        # Includes upload time: extraction runs at the client's pace
+        with DEPLOY_PHASE_SECONDS.labels("extract").time():
+            async for chunk in chunks:
+                await asyncio.to_thread(feed, chunk)
+            stats = await asyncio.to_thread(extractor.close)
+        await asyncio.to_thread(save_members, staged, extractor.members, extractor.digests)
+    except ZipStreamError as exc:
+        await asyncio.to_thread(extractor.abort)
+        raise HTTPException(400, str(exc))
+    except BaseException:
+        await asyncio.to_thread(extractor.abort)
+        raise
+    return {"staged_path": str(staged), "sha256": digest.hexdigest(), **stats}
+
+@traced("preflight_zip")
+async def preflight_zip(userfile: UploadFile, quota_left: Optional[int] = None) -> Dict[str, Any]:
+    """Judge an uploaded zip by its central directory before extracting any of it"""
+    # El multipart ya está entero en un fichero temporal: se puede ir al final
+    # The multipart is already whole in a temporary file: it can seek to the end
+    try:
+        report = await asyncio.to_thread(analyze, userfile.file)
+        decision = plan(report, quota_left)
+    except QuotaExceeded as exc:
+        ZIP_PREFLIGHT.labels("quota").inc()
+        raise HTTPException(413, str(exc))
+    except ZipStreamError as exc:
+        ZIP_PREFLIGHT.labels("rejected").inc()
+        raise HTTPException(400, str(exc))
+    ZIP_PREFLIGHT.labels("low_priority" if decision["low_priority"] else "accepted").inc()
+    return {**report, **decision}
+
+async def upload_chunks(userfile: UploadFile) -> AsyncIterator[bytes]:
+    while chunk := await userfile.read(1024 * 1024):
+        yield chunk
+
+def discard_staged(staged: Optional[Dict[str, Any]]):
+    """Remove an uploaded zip's staging folder that will not be deployed"""
+    if staged:
+        shutil.rmtree(staged["staged_path"], ignore_errors=True)
+        members_path(pathlib.Path(staged["staged_path"])).unlink(missing_ok=True)
+
+@contextmanager
+def upload_errors():
+    """Answer a resumable upload's errors with the status tus clients expect"""
+    try:
+        yield
+    except UploadLocked as exc:
+        raise HTTPException(423, str(exc))
+    except UploadConflict as exc:
+        raise HTTPException(409, str(exc))
+    except (UploadError, ZipStreamError) as exc:
+        raise HTTPException(400, str(exc))
+
+def find_upload(upload_id: str):
+    upload = uploads.get(upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+def docker_content_hash(userid: str, Webtype: DockerWebtype, Webname: str,
+                        staged: Optional[Dict[str, Any]]) -> str:
+    """Same hash = same deploy: the form fields plus the zip's SHA-256"""
+    parts = [userid, Webtype.value, Webname, staged["sha256"] if staged else ""]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+async def find_idempotent_docker(userid: str, Webtype: DockerWebtype, Webname: str,
+                                 idempotency_key: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Earlier request with the same Idempotency-Key (422 if it was for another project)"""
+    if not idempotency_key:
+        return None
+    previous = await job_store.aio.find_idempotent("docker", userid, idempotency_key)
+    if previous and (previous["Webtype"], previous["Webname"]) != (Webtype.value, Webname):
+        raise HTTPException(422, "Idempotency-Key ya usada para otra petición")
+    return previous
+
+def duplicated_docker(reason: str, previous: Dict[str, Any],
+                      staged: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Answer a repeated submission with the job it repeats, without queueing anything"""
+    discard_staged(staged)
+    DEPLOYS_DEDUPLICATED.labels(reason).inc()
+    print(f"[Docker] Petición repetida ({reason}) de {previous['Webname']}: se usa la {previous['id']}")
+    return {
+        "status": "unchanged" if reason == "unchanged" else "coalesced",
+        "reason": reason,
+        "message": "Identical Docker deploy already " + ("done" if reason == "unchanged" else "submitted"),
+        "job_id": previous["job_id"],
+        "container_details": previous,
+        "upload": None
+    }
+
+async def submit_docker(userid: str, Webtype: DockerWebtype, Webname: str,
+                        staged: Optional[Dict[str, Any]], priority: JobPriority,
+                        idempotency_key: Optional[str] = None, force: bool = False):
+    """Store and queue a Docker deploy whose zip (if any) is already staged, unless it repeats another one"""
+    content_hash = docker_content_hash(userid, Webtype, Webname, staged)
+    # Leer el manifiesto hace un lstat por fichero: va a un hilo y antes de
+    # tomar job_decisions, que solo lo usa si el último registro sigue
+    # siendo el mismo
+    # Reading the manifest lstats every file: it goes to a thread and before
+    # taking job_decisions, which only uses it if the latest record is
+    # still the same one
+    checked = None if force else await job_store.aio.latest("docker", userid=userid, Webname=Webname)
+    intact = False
+    if checked and checked["content_hash"] == content_hash and checked["status"] == "done":
+        manifest = await asyncio.to_thread(docker_manager.site_manifest, userid, Webname)
+        intact = await asyncio.to_thread(manifest.intact)
+    # Desde la comprobación hasta insertar: dos peticiones idénticas
+    # simultáneas no pueden colarse las dos
+    # From the check until the insert: two identical simultaneous requests
+    # cannot both get through
+    async with job_decisions:
+        previous = await find_idempotent_docker(userid, Webtype, Webname, idempotency_key)
+        if previous is not None:
+            if previous["content_hash"] != content_hash:
+                discard_staged(staged)
+                raise HTTPException(422, "Idempotency-Key ya usada con otro contenido")
+            return duplicated_docker("idempotency_key", previous, staged)
+        if not force:
+            previous = await job_store.aio.latest("docker", userid=userid, Webname=Webname)
+            if previous and previous["content_hash"] == content_hash:
+                if previous["status"] not in FINAL_STATUSES:
+                    return duplicated_docker("in_flight", previous, staged)
+                # Solo si nadie ha tocado los ficheros desde filebrowser
+                # Only if nobody touched the files from filebrowser
+                if previous["status"] == "done" and intact and previous["id"] == checked["id"]:
+                    return duplicated_docker("unchanged", previous, staged)
+
+        staged_path = staged["staged_path"] if staged else None
+        docker_item = await job_store.aio.insert("docker", {
+            "userid": userid,
+            "Webtype": Webtype.value,
+            "Webname": Webname,
+            "staged_path": staged_path,
+            "content_hash": content_hash,
+            "idempotency_key": idempotency_key
+        })
+    
+    try:
+        job = await enqueue(userid, process_docker_request, docker_item, priority, "docker")
+    except HTTPException:
+        discard_staged(staged)
+        raise
+    
+    return {
+        "status": "queued",
+        "message": "Docker container creation queued",
+        "job_id": job.id,
+        "trace_id": tracer.current_trace(),
+        "container_details": docker_item,
+        "upload": staged
+    }
+
+async def event_stream(kind: str, item_id: int, request: Request) -> StreamingResponse:
+    """SSE response with a job's events; Last-Event-ID resumes after a reconnect"""
+    record = await job_store.aio.get(kind, item_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    try:
+        after = int(request.headers.get("last-event-id", 0))
+    except ValueError:
+        after = 0
+
+    async def events():
+        # Sin historial (p. ej. tras reiniciar la API): solo el estado guardado
+        # No history (e.g. after the API restarted): only the stored status
+        if not progress.known(kind, item_id):
+            yield sse({"id": 0, "time": None, "phase": record["status"], "error": record["error"]})
+            if record["status"] in FINAL_STATUSES:
+                return
+        async for event in progress.follow(kind, item_id, after):
+            yield sse(event)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def read_roster(roster: UploadFile, model, defaults: Dict[str, Any]) -> List[Any]:
+    """Validate every row of an uploaded roster, answering 400 with the first bad row"""
+    try:
+        rows = parse_roster(await roster.read(), roster.filename)
+    except RosterError as exc:
+        raise HTTPException(400, str(exc))
+    parsed = []
+    for number, row in enumerate(rows, start=1):
+        try:
+            parsed.append(model(**{**defaults, **row}))
+        except ValidationError as exc:
+            fields = ", ".join(".".join(map(str, e["loc"])) for e in exc.errors())
+            raise HTTPException(400, f"Fila {number}: campos no válidos ({fields})")
+    return parsed
+
+def read_item_trace(kind: str, item_id: int):
+    trace_id = tracer.trace_of(kind, item_id)
+    trace = tracer.get(trace_id) if trace_id else None
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
+
+async def read_batch(kind: str, batch_id: str):
+    summary = await job_store.aio.batch(kind, batch_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return summary
+
+async def list_page(kind: str, **kwargs):
+    try:
+        return await job_store.aio.list(kind, **kwargs)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+@app.get("/heartbeat", response_model=HeartbeatResponse)
+async def heartbeat():
+    """Heartbeat endpoint to verify that the API is functioning"""
+    uptime = (datetime.now() - start_time).total_seconds()
+    return {
+        "status": "running",
+        "timestamp": datetime.now().isoformat(),
+        "uptime": uptime,
+        "version": api_version
+    }
+
+@app.get("/ready")
+async def ready(response: Response):
+    """Readiness probe: last cached health of Docker, Proxmox and the file store, 503 until the required ones answer"""
+    status = readiness.status()
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: deploy phase latencies, queue depth and errors"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/queue")
+async def read_queue():
+    """Queue depth and worker usage"""
+    return job_queue.stats()
+
+@app.get("/traces")
+async def read_traces(
+    limit: int = Query(50, ge=1, le=PAGE_MAX),
+    name: Optional[str] = None,
+    min_ms: Optional[float] = None,
+    status: Optional[str] = None
+):
+    """Most recent traces, newest first, each with its slowest phase"""
+    return tracer.recent(limit, name, min_ms, status)
+
+@app.get("/traces/{trace_id}")
+async def read_trace(trace_id: str):
+    """Every span of a trace in order, plus its slowest phases"""
+    trace = tracer.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
+
+@app.get("/jobs/{job_id}")
+async def read_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {**job.to_dict(), "position": job_queue.position(job_id)}
+
+@app.post("/proxmox/")
+@traced("create_proxmox", "userid", "os")
+async def create_proxmox(
+    userid: str = Form(...),
+    upassword: str = Form(...),
+    os: ProxmoxTemplate = Form(...),
+    disksize: int = Form(...),
+    cores: int = Form(1),
+    memory: int = Form(...),
+    sshpb: Optional[str] = Form(None),
+    priority: JobPriority = Form(JobPriority.NORMAL)
+):
+    if TEMPLATE_IDS.get(os.value) is None:
+        raise HTTPException(400, f"Plantilla {os.value} sin configurar")
+    proxmox_item = Proxmox(
+        userid=userid,
+        upassword=upassword,
+        os=os,
+        disksize=disksize,
+        cores=cores,
+        memory=memory,
+        sshpb=sshpb
+    )
+    # La contraseña solo viaja en el payload del trabajo, nunca se guarda
+    # The password only travels in the job payload, it is never stored
+    record = await job_store.aio.insert("proxmox", {**proxmox_item.dict(), "os": os.value})
+    job = await enqueue(
+        userid, process_proxmox_request,
+        {**proxmox_item.dict(), "os": os.value, "id": record["id"]}, priority, "proxmox"
+    )
+    
+    return {
+        "status": "queued",
+        "message": "Proxmox VM creation queued",
+        "job_id": job.id,
+        "trace_id": tracer.current_trace(),
+        "vm_details": await job_store.aio.get("proxmox", record["id"])
+    }
+
+@traced("create_proxmox_batch")
+async def submit_proxmox_batch(batch: ProxmoxBatch, priority: JobPriority):
+    """Store one VM per student and queue them all as a single job"""
+    if TEMPLATE_IDS.get(batch.os.value) is None:
+        raise HTTPException(400, f"Plantilla {batch.os.value} sin configurar")
+    batch_id = uuid.uuid4().hex
+    common = batch.dict(exclude={"students", "linked"})
+    items = []
+    for student in batch.students:
+        spec = {**common, **student.dict(), "os": batch.os.value, "batch_id": batch_id}
+        record = await job_store.aio.insert("proxmox", spec)
+        items.append({**spec, "id": record["id"]})
+
+    try:
+        job = await job_queue.submit(
+            f"batch:{batch_id}", process_proxmox_batch,
+            {"batch_id": batch_id, "linked": batch.linked, "items": items},
+            priority=PRIORITY_VALUES[priority], kind="proxmox-batch"
+        )
+    except QueueFullError as exc:
+        for item in items:
+            set_status("proxmox", item["id"], "rejected", error=str(exc))
+        raise HTTPException(status_code=503, detail=str(exc))
+    tracer.bind("batch", batch_id)
+    for item in items:
+        tracer.bind("proxmox", item["id"])
+        progress.publish("proxmox", item["id"], "queued", job_id=job.id)
+
+    return {
+        "status": "queued",
+        "message": f"{len(items)} Proxmox VMs queued",
+        "job_id": job.id,
+        "trace_id": tracer.current_trace(),
+        "batch_id": batch_id,
+        "vm_ids": [item["id"] for item in items]
+    }
+
+@app.post("/proxmox/batch")
+async def create_proxmox_batch(batch: ProxmoxBatch, priority: JobPriority = Query(JobPriority.NORMAL)):
+    """Queue one VM per student as a single job"""
+    return await submit_proxmox_batch(batch, priority)
+
+@app.post("/proxmox/batch/roster")
+async def create_proxmox_batch_roster(
+    roster: UploadFile = File(...),
+    os: ProxmoxTemplate = Form(...),
+    disksize: int = Form(...),
+    cores: int = Form(1),
+    memory: int = Form(...),
+    linked: bool = Form(True),
+    priority: JobPriority = Form(JobPriority.NORMAL)
+):
+    """Same as POST /proxmox/batch with the students in a CSV or JSON roster (userid, upassword, sshpb)"""
+    students = await read_roster(roster, ProxmoxStudent, {})
+    batch = ProxmoxBatch(
+        os=os, disksize=disksize, cores=cores, memory=memory, linked=linked, students=students
+    )
+    return await submit_proxmox_batch(batch, priority)
+
+@app.get("/proxmox/batch/{batch_id}")
+async def read_proxmox_batch(batch_id: str):
+    """Per-VM status of a batch, with how many are in each status"""
+    return await read_batch("proxmox", batch_id)
+
+@app.get("/proxmox/", response_model=ProxmoxPage)
+async def read_proxmox(
+    cursor: Optional[int] = None,
+    limit: int = Query(PAGE_DEFAULT, ge=1, le=PAGE_MAX),
+    userid: Optional[str] = None,
+    os: Optional[ProxmoxTemplate] = None,
+    batch_id: Optional[str] = None,
+    status: Optional[str] = None,
+    created_after: Optional[str] = None,
+    created_before: Optional[str] = None
+):
+    return await list_page(
+        "proxmox", cursor=cursor, limit=limit, userid=userid,
+        os=os.value if os else None, batch_id=batch_id, status=status,
+        created_after=created_after, created_before=created_before
+    )
+
+@app.get("/proxmox/nodes")
+async def read_proxmox_nodes():
+    """Proxmox nodes with their committed resources and pending placements"""
+    await proxmox_manager.nodes.refresh()
+    return proxmox_manager.nodes.status()
+
+@app.get("/proxmox/{item_id}/trace")
+async def read_proxmox_trace(item_id: int):
+    """Spans of a VM creation, with its slowest phases first"""
+    return read_item_trace("proxmox", item_id)
+
+@app.get("/proxmox/{item_id}/events")
+async def read_proxmox_events(item_id: int, request: Request):
+    """Live phases of a VM creation (with the clone percentage) as server-sent events"""
+    return await event_stream("proxmox", item_id, request)
+
+@app.delete("/proxmox/{item_id}", status_code=202)
+@traced("delete_proxmox_request")
+async def delete_proxmox(item_id: int):
+    """Stop and destroy the VM of a request, with its disks, in the background"""
+    async with job_decisions:
+        record = await deletable("proxmox", item_id)
+        # Sin VM (falló antes de clonar) o con su VMID ya en otra VM posterior
+        # No VM (it failed before cloning) or its VMID already on a later VM
+        latest = await job_store.aio.latest("proxmox", vmid=record["vmid"]) if record["vmid"] is not None else None
+        if latest is None or latest["id"] != item_id:
+            await set_status("proxmox", item_id, "deleted")
+            return {
+                "status": "deleted",
+                "message": "No Proxmox VM left to delete",
+                "job_id": None,
+                "trace_id": tracer.current_trace(),
+                "vm_details": await job_store.aio.get("proxmox", item_id)
+            }
+        job = await enqueue_delete("proxmox", process_proxmox_delete, record)
+    return {
+        "status": "deleting",
+        "message": "Proxmox VM deletion queued",
+        "job_id": job.id,
+        "trace_id": tracer.current_trace(),
+        "vm_details": await job_store.aio.get("proxmox", item_id)
+    }
+
+@app.get("/proxmox/{item_id}", response_model=ProxmoxRecord)
+async def read_proxmox_item(item_id: int):
+    record = await job_store.aio.get("proxmox", item_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return record
+
+@app.post("/docker/")
+@traced("create_docker", "userid", "Webtype", "Webname")
+async def create_docker(
+    userid: str = Form(..., pattern=NAME_PATTERN),
+    Webtype: DockerWebtype = Form(...),
+    Webname: str = Form(..., pattern=NAME_PATTERN),
+    userfile: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Form(None),
+    priority: JobPriority = Form(JobPriority.NORMAL),
+    force: bool = Form(False),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """
+    Queue a deploy. The zip comes in `userfile` or, already uploaded
+    through /uploads/, as its `upload_id`. A retry with the same
+    Idempotency-Key, or an identical deploy (same fields and zip) still
+    running or already done, gets the earlier job back instead of a new
+    one; `force` queues it anyway.
+    """
+    if userfile and upload_id:
+        raise HTTPException(400, "Usa userfile o upload_id, no los dos")
+    # Un reintento con la misma clave no vuelve a extraer el zip
+    # A retry with the same key does not extract the zip again
+    previous = await find_idempotent_docker(userid, Webtype, Webname, idempotency_key)
+    if previous is not None:
+        return duplicated_docker("idempotency_key", previous, None)
+    staged = None
+
+    if userfile:
+        # Starlette ya ha volcado el multipart a un fichero temporal: se
+        # revisa su directorio central (al final) y luego se extrae por trozos
+        # Starlette has already spooled the multipart into a temporary file:
+        # its central directory (at the end) is checked, then it is
+        # extracted in chunks
+        suffix = pathlib.Path(userfile.filename).suffix.lower()
+        if suffix != ".zip":
+            raise HTTPException(400, "Solo se aceptan archivos .zip")
+        quota_left = await asyncio.to_thread(docker_manager.quota_left, userid, Webname)
+        preflight = await preflight_zip(userfile, quota_left)
+        # Los zips enormes no adelantan a los de los demás
+        # Huge zips do not jump ahead of everybody else's
+        if preflight["low_priority"] and priority == JobPriority.NORMAL:
+            priority = JobPriority.LOW
+        staged = await ingest_zip(upload_chunks(userfile), userid, Webname, preflight["parallel"])
+        staged["filename"] = userfile.filename
+        staged["preflight"] = preflight
+    elif upload_id:
+        # Ya extraído mientras se subía: se pasa la carpeta tal cual
+        # Already extracted while it was uploaded: the folder is handed over as is
+        find_upload(upload_id)
+        with upload_errors():
+            staged = uploads.take(upload_id, userid, Webname)
+
+    return await submit_docker(userid, Webtype, Webname, staged, priority, idempotency_key, force)
+
+@app.post("/docker/stream")
+@traced("create_docker", "userid", "Webtype", "Webname")
+async def create_docker_stream(
+    request: Request,
+    userid: str = Query(..., pattern=NAME_PATTERN),
+    Webtype: DockerWebtype = Query(...),
+    Webname: str = Query(..., pattern=NAME_PATTERN),
+    priority: JobPriority = Query(JobPriority.NORMAL),
+    force: bool = Query(False),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Same as POST /docker/ but the request body is the raw zip, extracted as it arrives"""
+    previous = await find_idempotent_docker(userid, Webtype, Webname, idempotency_key)
+    if previous is not None:
+        return duplicated_docker("idempotency_key", previous, None)
+    staged = await ingest_zip(request.stream(), userid, Webname)
+    return await submit_docker(userid, Webtype, Webname, staged, priority, idempotency_key, force)
+
+@app.options("/uploads/")
+async def options_uploads():
+    """tus capabilities: protocol version, extensions and maximum size"""
+    return Response(status_code=204, headers=uploads.options())
+
+@app.post("/uploads/", status_code=201)
+async def create_upload(
+    upload_length: Optional[int] = Header(None),
+    upload_metadata: Optional[str] = Header(None)
+):
+    """Open a resumable (tus) upload; Upload-Metadata carries userid, Webname and filename"""
+    if upload_length is None:
+        raise HTTPException(400, "Falta Upload-Length")
+    with upload_errors():
+        metadata = parse_metadata(upload_metadata)
+        if not metadata.get("userid") or not metadata.get("Webname"):
+            raise UploadError("Upload-Metadata tiene que llevar userid y Webname")
+        if not all(re.fullmatch(NAME_PATTERN, metadata[key]) for key in ("userid", "Webname")):
+            raise UploadError("userid y Webname: letras, números, - y _, sin punto inicial")
+        upload = await uploads.create(
+            metadata["userid"], metadata["Webname"], upload_length, metadata.get("filename")
+        )
+    return Response(
+        status_code=201,
+        headers={**upload.headers(), "Location": f"/uploads/{upload.id}"}
+    )
+
+@app.head("/uploads/{upload_id}")
+async def head_upload(upload_id: str):
+    """Where a resumable upload was left (Upload-Offset)"""
+    return Response(status_code=200, headers=find_upload(upload_id).headers())
+
+@app.get("/uploads/{upload_id}")
+async def read_upload(upload_id: str):
+    """A resumable upload's progress and, once complete, its SHA-256"""
+    return find_upload(upload_id).status()
+
+@app.patch("/uploads/{upload_id}")
+async def patch_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: Optional[int] = Header(None),
+    content_type: Optional[str] = Header(None)
+):
+    """Append the request body to a resumable upload, extracting it as it arrives"""
+    upload = find_upload(upload_id)
+    if content_type != "application/offset+octet-stream":
+        raise HTTPException(415, "Content-Type tiene que ser application/offset+octet-stream")
+    if upload_offset is None:
+        raise HTTPException(400, "Falta Upload-Offset")
+    with upload_errors():
+        try:
+            await uploads.write(upload, upload_offset, request.stream())
+        except ClientDisconnect:
+            # Lo recibido ya cuenta; el cliente preguntará con HEAD
+            # What was received already counts; the client will ask with HEAD
+            pass
+    return Response(status_code=204, headers=upload.headers())
+
+@app.delete("/uploads/{upload_id}", status_code=204)
+async def delete_upload(upload_id: str):
+    """Drop a resumable upload and whatever it had extracted"""
+    with upload_errors():
+        found = await uploads.terminate(upload_id)
+    if not found:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return Response(status_code=204, headers={"Tus-Resumable": TUS_VERSION})
+
+@app.post("/docker/batch")
+@traced("create_docker_batch")
+async def create_docker_batch(
+    roster: UploadFile = File(...),
+    Webtype: Optional[DockerWebtype] = Form(None),
+    userfile: Optional[UploadFile] = File(None),
+    priority: JobPriority = Form(JobPriority.NORMAL)
+):
+    """
+    Deploy a whole class as a single job: one project per roster row (CSV or
+    JSON with userid, Webname and Webtype, which may come once as a form
+    field). The optional zip is extracted once and given to every student.
+    """
+    rows = await read_roster(roster, Docker, {"Webtype": Webtype.value} if Webtype else {})
+    projects = [(row.userid, row.Webname) for row in rows]
+    if len(set(projects)) != len(projects):
+        raise HTTPException(400, "Hay proyectos repetidos (mismo userid y Webname)")
+    batch_id = uuid.uuid4().hex
+    starter = None
+    if userfile:
+        if pathlib.Path(userfile.filename).suffix.lower() != ".zip":
+            raise HTTPException(400, "Solo se aceptan archivos .zip")
+        staged = await asyncio.to_thread(docker_manager.batch_staging_path, batch_id)
+        preflight = await preflight_zip(userfile)
+        starter = await extract_upload(upload_chunks(userfile), staged, parallel=preflight["parallel"])
+        starter["filename"] = userfile.filename
+
+    items = []
+    for row in rows:
+        record = await job_store.aio.insert("docker", {
+            "userid": row.userid,
+            "Webtype": row.Webtype.value,
+            "Webname": row.Webname,
+            "batch_id": batch_id,
+            "content_hash": docker_content_hash(row.userid, row.Webtype, row.Webname, starter)
+        })
+        items.append(record)
+
+    try:
+        job = await job_queue.submit(
+            f"batch:{batch_id}", process_docker_batch,
+            {"batch_id": batch_id, "starter": starter["staged_path"] if starter else None, "items": items},
+            priority=PRIORITY_VALUES[priority], kind="docker-batch"
+        )
+    except QueueFullError as exc:
+        for item in items:
+            set_status("docker", item["id"], "rejected", error=str(exc))
+        if starter:
+            shutil.rmtree(pathlib.Path(starter["staged_path"]).parent, ignore_errors=True)
+        raise HTTPException(status_code=503, detail=str(exc))
+    tracer.bind("batch", batch_id)
+    for item in items:
+        tracer.bind("docker", item["id"])
+        progress.publish("docker", item["id"], "queued", job_id=job.id)
+
+    return {
+        "status": "queued",
+        "message": f"{len(items)} Docker deploys queued",
+        "job_id": job.id,
+        "trace_id": tracer.current_trace(),
+        "batch_id": batch_id,
+        "docker_ids": [item["id"] for item in items],
+        "upload": starter
+    }
+
+@app.get("/docker/batch/{batch_id}")
+async def read_docker_batch(batch_id: str):
+    """Per-project status of a class deploy, with how many are in each status"""
+    return await read_batch("docker", batch_id)
+
+@app.get("/docker/")
+async def read_docker(
+    cursor: Optional[int] = None,
+    limit: int = Query(PAGE_DEFAULT, ge=1, le=PAGE_MAX),
+    userid: Optional[str] = None,
+    Webname: Optional[str] = None,
+    Webtype: Optional[DockerWebtype] = None,
+    batch_id: Optional[str] = None,
+    status: Optional[str] = None,
+    created_after: Optional[str] = None,
+    created_before: Optional[str] = None
+):
+    return await list_page(
+        "docker", cursor=cursor, limit=limit, userid=userid, Webname=Webname,
+        Webtype=Webtype.value if Webtype else None, batch_id=batch_id, status=status,
+        created_after=created_after, created_before=created_before
+    )
+
+@app.get("/docker/images")
+async def read_docker_images():
+    """Image warm cache: digests and how fresh each pull is"""
+    return docker_manager.image_cache_status()
+
+@app.get("/docker/storage")
+async def read_docker_storage():
+    """Content-addressed store: files kept once and the space that saves"""
+    return await asyncio.to_thread(docker_manager.store_usage)
+
+@app.get("/docker/hosts")
+async def read_docker_hosts():
+    """Docker hosts with their cached inventory and load"""
+    await docker_manager.hosts.refresh()
+    return docker_manager.hosts.status()
+
+@app.get("/docker/hibernation")
+async def read_docker_hibernation():
+    """Traffic tracking and hibernation state of every project stack"""
+    return hibernator.status()
+
+@app.get("/docker/{item_id}/trace")
+async def read_docker_trace(item_id: int):
+    """Spans of a deploy from the request to the stack being up, with its slowest phases first"""
+    return read_item_trace("docker", item_id)
+
+@app.get("/docker/{item_id}/events")
+async def read_docker_events(item_id: int, request: Request):
+    """Live phases of a deploy as server-sent events, until it is done or fails"""
+    return await event_stream("docker", item_id, request)
+
+@app.get("/docker/gc")
+async def read_docker_gc():
+    """Garbage collector settings, projects waiting in the trash and its last pass"""
+    return await asyncio.to_thread(collector.status)
+
+@app.post("/docker/gc", status_code=202)
+async def run_docker_gc():
+    """Start a garbage collection pass now, paced like the scheduled ones"""
+    started = collector.trigger()
+    return {"started": started, **await asyncio.to_thread(collector.status)}
+
+@app.delete("/docker/{item_id}", status_code=202)
+@traced("delete_docker_request")
+async def delete_docker(item_id: int):
+    """Remove a deploy's whole project (containers, site and files) in the background"""
+    async with job_decisions:
+        record = await deletable("docker", item_id)
+        project = {"userid": record["userid"], "Webname": record["Webname"]}
+        if await job_store.aio.active("docker", **project):
+            raise HTTPException(status_code=409, detail="The project has a deploy or deletion in progress")
+        latest = await job_store.aio.latest("docker", **project)
+        job = await enqueue_delete("docker", process_docker_delete, record, up_to=latest["id"])
+    return {
+        "status": "deleting",
+        "message": "Docker project deletion queued",
+        "job_id": job.id,
+        "trace_id": tracer.current_trace(),
+        "container_details": await job_store.aio.get("docker", item_id)
+    }
+
+@app.get("/docker/{item_id}")
+async def read_docker_item(item_id: int):
+    record = await job_store.aio.get("docker", item_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return record
+
+WAKE_PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><meta http-equiv="refresh" content="3;url={uri}">
+<title>Arrancando...</title></head>
+<body><p>Arrancando la web, un momento... / Starting the site, one moment...</p></body></html>"""
+
+def wake_target(uri: str) -> str:
+    """Path and query to reload after waking, never another site: `//host` or `/\\host` fall back to /"""
+    parts = urllib.parse.urlsplit(uri)
+    path = parts.path
+    if parts.scheme or parts.netloc or not path.startswith("/") or path.startswith("//") or "\\" in path:
+        return "/"
+    return urllib.parse.urlunsplit(("", "", path, parts.query, ""))
+
+@app.get("/caddy/ask")
+async def caddy_ask(domain: str = Query(...)):
+    """Caddy's on-demand TLS check: 200 only for <project>.quiere.cafe or fb-<project>.quiere.cafe of an existing project"""
+    name, _, zone = domain.lower().partition(".")
+    candidates = [name] + ([name[3:]] if name.startswith("fb-") else [])
+    for project in candidates:
+        if zone == "quiere.cafe" and re.fullmatch(NAME_PATTERN, project) \
+                and await asyncio.to_thread(docker_manager.has_site, project):
+            return Response(status_code=200)
+    raise HTTPException(status_code=404, detail=f"No site for {domain}")
+
+@app.get("/wake", response_class=HTMLResponse)
+async def wake(request: Request):
+    """
+    Caddy's wildcard fallback for hosts without a running container:
+    starts the hibernated stack and reloads the page once Caddy has it
+    """
+    host = request.headers.get("host", "")
+    stack = await hibernator.wake(host)
+    if stack is None:
+        raise HTTPException(status_code=404, detail=f"No site for {host}")
+    uri = wake_target(request.headers.get("x-original-uri", "/"))
+    return HTMLResponse(
+        WAKE_PAGE.replace("{uri}", html.escape(uri, quote=True)),
+        status_code=503,
+        headers={"Retry-After": "3", "Cache-Control": "no-store"}
+    )
+
+@app.get("/")
+async def read_root():
+    return {
+        "mensaje": "Intermediate API for Proxmox and Docker",
+        "proxmox_templates": [template.value for template in ProxmoxTemplate],
+        "docker_webtypes": [webtype.value for webtype in DockerWebtype],
+        "health_check": "/heartbeat",
+        "ready": "/ready",
+        "queue": "/queue",
+        "events": "/{docker|proxmox}/{item_id}/events",
+        "uploads": "/uploads/",
+        "traces": "/traces",
+        "gc": "/docker/gc",
+        "metrics": "/metrics"
+    }
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=8000)
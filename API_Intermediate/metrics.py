@@ -0,0 +1,150 @@
+# metrics.py
+from typing import Any
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Cubetas en segundos: de operaciones de milisegundos a clones de minutos
+# Buckets in seconds: from millisecond operations to minute-long clones
+PHASE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Fases de un despliegue Docker:
+#   extract        zip descomprimido (durante la subida o desde un zip temporal)
+#   merge_staged   staging movido a la carpeta data
+#   filebrowser_db `config init` (o sacar una DB del pool)
+#   admin_user     `users add admin`
+#   compose_write  docker-compose.yml escrito
+#   stack_up       contenedores creados y arrancados
+# Phases of a Docker deploy:
+#   extract        zip unpacked (while uploading or from a temporary zip)
+#   merge_staged   staging moved into the data folder
+#   filebrowser_db `config init` (or taking a DB from the pool)
+#   admin_user     `users add admin`
+#   compose_write  docker-compose.yml written
+#   stack_up       containers created and started
+DEPLOY_PHASE_SECONDS = Histogram(
+    "iapi_deploy_phase_seconds",
+    "Duration of each Docker deploy phase",
+    ["phase"],
+    buckets=PHASE_BUCKETS,
+)
+DEPLOY_SECONDS = Histogram(
+    "iapi_deploy_seconds",
+    "Duration of a whole Docker deploy job",
+    ["webtype"],
+    buckets=PHASE_BUCKETS,
+)
+DEPLOY_ERRORS = Counter(
+    "iapi_deploy_errors_total",
+    "Failed Docker deploys",
+    ["webtype"],
+)
+# Despliegues que no se encolan porque repiten otro: idempotency_key (misma
+# clave), in_flight (idéntico a uno en curso) o unchanged (idéntico al
+# último terminado)
+# Deploys not queued because they repeat another one: idempotency_key
+# (same key), in_flight (identical to a running one) or unchanged
+# (identical to the last finished one)
+DEPLOYS_DEDUPLICATED = Counter(
+    "iapi_deploys_deduplicated_total",
+    "Docker deploy submissions answered with an earlier job instead of a new one",
+    ["reason"],
+)
+# Decisión sobre cada zip subido leyendo su directorio central: accepted,
+# low_priority, rejected o quota
+# Decision on each uploaded zip after reading its central directory:
+# accepted, low_priority, rejected or quota
+ZIP_PREFLIGHT = Counter(
+    "iapi_zip_preflight_total",
+    "Uploaded zips checked before extraction, by decision",
+    ["decision"],
+)
+FILEBROWSER_POOL = Counter(
+    "iapi_filebrowser_pool_total",
+    "Filebrowser databases taken from the pool (hit) or built on demand (miss)",
+    ["result"],
+)
+
+# Fases de Proxmox: clone (petición), clone_wait (tarea de clonado),
+# vm_ready, configure y start; al borrar, stop y destroy
+# Proxmox phases: clone (request), clone_wait (clone task), vm_ready,
+# configure and start; when deleting, stop and destroy
+PROXMOX_PHASE_SECONDS = Histogram(
+    "iapi_proxmox_phase_seconds",
+    "Duration of each Proxmox provisioning phase",
+    ["phase"],
+    buckets=PHASE_BUCKETS,
+)
+PROXMOX_ERRORS = Counter(
+    "iapi_proxmox_errors_total",
+    "Failed Proxmox VM creations",
+    ["os"],
+)
+
+STACKS_HIBERNATED = Counter(
+    "iapi_stacks_hibernated_total",
+    "Project stacks stopped after being idle",
+)
+STACK_WAKES = Counter(
+    "iapi_stack_wakes_total",
+    "Hibernated project stacks started again by a request",
+)
+
+# Lo que borra el recolector: trash (proyectos borrados), staging (subidas
+# abandonadas), batches, sites (enlaces rotos), containers (sin proyecto),
+# volumes, images (sin etiqueta) y blobs (del almacén, sin usar)
+# What the collector deletes: trash (deleted projects), staging (abandoned
+# uploads), batches, sites (broken links), containers (without a project),
+# volumes, images (untagged) and blobs (from the store, unused)
+GC_RECLAIMED = Counter(
+    "iapi_gc_reclaimed_total",
+    "Leftovers deleted by the garbage collector, by kind",
+    ["kind"],
+)
+GC_ERRORS = Counter(
+    "iapi_gc_errors_total",
+    "Leftovers the garbage collector failed to delete, by kind",
+    ["kind"],
+)
+
+# Pasos del arranque: app_import, lifespan, docker_init, proxmox_login
+# Startup steps: app_import, lifespan, docker_init, proxmox_login
+STARTUP_SECONDS = Gauge(
+    "iapi_startup_seconds",
+    "Duration of each startup step",
+    ["step"],
+)
+DEPENDENCY_UP = Gauge(
+    "iapi_dependency_up",
+    "Result of the last health check of each dependency (1 = healthy)",
+    ["dependency"],
+)
+
+QUEUE_DEPTH = Gauge("iapi_queue_depth", "Jobs waiting in the queue")
+JOBS_IN_FLIGHT = Gauge("iapi_jobs_in_flight", "Jobs being run by the queue workers")
+PROXMOX_IN_FLIGHT = Gauge("iapi_proxmox_in_flight", "VMs being cloned or started")
+DOCKER_HOST_LOAD = Gauge(
+    "iapi_docker_host_load",
+    "Share of CPU or memory (the larger) reserved on each Docker host, from the cached inventory",
+    ["host"],
+)
+
+
+def track_runtime(job_queue: Any, proxmox_manager: Any):
+    """
+    Hace que los gauges lean la cola y Proxmox en cada scrape.
+    Make the gauges read the queue and Proxmox on every scrape.
+    """
+    QUEUE_DEPTH.set_function(lambda: job_queue.stats()["queued"])
+    JOBS_IN_FLIGHT.set_function(lambda: job_queue.stats()["running"])
+    PROXMOX_IN_FLIGHT.set_function(lambda: proxmox_manager.in_flight)
+
+
+def track_hosts(hosts: Any):
+    """
+    Carga de cada host Docker según el último inventario.
+    Load of every Docker host according to the last inventory.
+    """
+    for host in hosts.all():
+        DOCKER_HOST_LOAD.labels(host.name).set_function(
+            lambda host=host: host.load({"cpus": 0, "memory": 0}) if host.ncpu else 0
+        )
@@ -0,0 +1,128 @@
+# progress.py
+import os
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from job_store import FINAL_STATUSES
+
+# Trabajos cuyos eventos se recuerdan (los más recientes)
+# Jobs whose events are kept (the most recent ones)
+PROGRESS_JOBS = int(os.getenv("PROGRESS_JOBS", "1000"))
+# Segundos sin eventos tras los que se manda un comentario para que los
+# proxies no corten la conexión
+# Seconds without events after which a comment is sent so proxies do not
+# drop the connection
+PROGRESS_KEEPALIVE = float(os.getenv("PROGRESS_KEEPALIVE", "15"))
+
+
+class ProgressHub:
+    """
+    Eventos de progreso de cada despliegue (fases, porcentaje de clonado)
+    para seguirlos en directo por SSE en vez de consultar el estado una y
+    otra vez. Cada trabajo guarda su historial, así quien se conecta tarde
+    (o se reconecta con Last-Event-ID) no se pierde nada.
+
+    Progress events of each deploy (phases, clone percentage) to follow
+    them live over SSE instead of polling the status again and again.
+    Each job keeps its history, so whoever connects late (or reconnects
+    with Last-Event-ID) misses nothing.
+    """
+
+    def __init__(self):
+        # (tipo, id) -> eventos | (kind, id) -> events
+        self.events: "OrderedDict[Tuple[str, int], List[Dict[str, Any]]]" = OrderedDict()
+        self._subscribers: Dict[Tuple[str, int], Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    def _publish(self, key: Tuple[str, int], event: Dict[str, Any]):
+        events = self.events.setdefault(key, [])
+        self.events.move_to_end(key)
+        event = {"id": len(events) + 1, "time": time.time(), **event}
+        events.append(event)
+        while len(self.events) > PROGRESS_JOBS:
+            self.events.popitem(last=False)
+        for queue in self._subscribers.get(key, ()):
+            queue.put_nowait(event)
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    def publish(self, kind: str, item_id: int, phase: str, **info: Any):
+        """
+        Apunta un evento. Se puede llamar desde los hilos de trabajo.
+        Record an event. May be called from the worker threads.
+        """
+        event = {"phase": phase, **info}
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._publish, (kind, item_id), event)
+            return
+        self._publish((kind, item_id), event)
+
+    def known(self, kind: str, item_id: int) -> bool:
+        return (kind, item_id) in self.events
+
+    async def follow(
+        self, kind: str, item_id: int, after: int = 0
+    ) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Los eventos posteriores a `after` y luego los nuevos, hasta un
+        estado final. Da None tras PROGRESS_KEEPALIVE segundos sin nada.
+
+        The events after `after` and then the new ones, until a final
+        status. Yields None after PROGRESS_KEEPALIVE seconds of silence.
+        """
+        key = (kind, item_id)
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(key, set()).add(queue)
+        try:
+            for event in list(self.events.get(key, [])):
+                if event["id"] > after:
+                    after = event["id"]
+                    yield event
+                    if event["phase"] in FINAL_STATUSES:
+                        return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), PROGRESS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event["id"] <= after:
+                    continue
+                after = event["id"]
+                yield event
+                if event["phase"] in FINAL_STATUSES:
+                    return
+        finally:
+            self._subscribers[key].discard(queue)
+            if not self._subscribers[key]:
+                del self._subscribers[key]
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "jobs": len(self.events),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+        }
+
+
+def sse(event: Optional[Dict[str, Any]]) -> str:
+    """
+    Un evento en formato text/event-stream (None = comentario keep-alive).
+    One event in text/event-stream format (None = keep-alive comment).
+    """
+    if event is None:
+        return ": keep-alive\n\n"
+    return f"id: {event['id']}\nevent: {event['phase']}\ndata: {json.dumps(event)}\n\n"
+
+
+# Helper singleton compartido por la API | Helper singleton shared by the API
+progress = ProgressHub()
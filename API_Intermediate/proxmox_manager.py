@@ -0,0 +1,665 @@
+# proxmox_manager.py
+import os
+import asyncio
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+from proxmoxer import ProxmoxAPI
+
+from metrics import PROXMOX_ERRORS, PROXMOX_PHASE_SECONDS
+from tracing import traced, tracer
+
+# Credenciales de Proxmox (por variables de entorno, no en el código)
+# Proxmox credentials (from environment variables, not in the code)
+PROXMOX_HOST = os.getenv("PROXMOX_HOST", "192.168.52.241")
+PROXMOX_USER = os.getenv("PROXMOX_USER", "root@pam")
+PROXMOX_PASSWORD = os.getenv("PROXMOX_PASSWORD", "")
+PROXMOX_VERIFY_SSL = os.getenv("PROXMOX_VERIFY_SSL", "0") == "1"
+# Nodo de las plantillas (si cluster/resources no dice otra cosa) y a la
+# vez el nodo de repuesto si no se puede leer el clúster
+# Node holding the templates (unless cluster/resources says otherwise) and
+# the fallback node when the cluster cannot be read
+PROXMOX_NODE = os.getenv("PROXMOX_NODE", "sv1")
+# Nodos donde se pueden crear VMs (separados por comas, vacío = todos)
+# Nodes VMs may be created on (comma separated, empty = all)
+PROXMOX_NODES = {n for n in os.getenv("PROXMOX_NODES", "").split(",") if n}
+# Segundos que vale la lectura de cluster/resources
+# Seconds a cluster/resources read is valid for
+PROXMOX_RESOURCES_TTL = float(os.getenv("PROXMOX_RESOURCES_TTL", "15"))
+# Disco de las plantillas que se amplía a `disksize`
+# Template disk that is grown to `disksize`
+PROXMOX_DISK = os.getenv("PROXMOX_DISK", "scsi0")
+
+# Clones en curso como máximo, para no saturar el nodo
+# Maximum clones in progress, so the node is not overwhelmed
+PROXMOX_MAX_CLONES = int(os.getenv("PROXMOX_MAX_CLONES", "3"))
+# Los clones enlazados solo crean un snapshot: se permiten más a la vez
+# Linked clones only create a snapshot: more are allowed at once
+PROXMOX_MAX_LINKED_CLONES = int(os.getenv("PROXMOX_MAX_LINKED_CLONES", "10"))
+# Reintentos de un clon cuando la plantilla está bloqueada por otro clon
+# Retries of a clone while the template is locked by another clone
+CLONE_LOCK_RETRIES = 8
+# Hilos para las llamadas (bloqueantes) de proxmoxer
+# Threads for the (blocking) proxmoxer calls
+PROXMOX_API_THREADS = int(os.getenv("PROXMOX_API_THREADS", "8"))
+# Espera entre consultas del estado de una tarea: empieza en MIN y crece
+# hasta MAX mientras la tarea no termina
+# Wait between task status checks: starts at MIN and grows up to MAX while
+# the task is still running
+TASK_POLL_MIN = 0.5
+TASK_POLL_MAX = 10.0
+TASK_TIMEOUT = float(os.getenv("PROXMOX_TASK_TIMEOUT", "1800"))
+# Porcentaje en el log de una tarea, p. ej. "transferred 2.0 GiB of 32.0 GiB
+# (6.25%)" (drive-mirror) o "(12.00/100%)" (qemu-img)
+# Percentage in a task's log, e.g. "transferred 2.0 GiB of 32.0 GiB
+# (6.25%)" (drive-mirror) or "(12.00/100%)" (qemu-img)
+TASK_PROGRESS = re.compile(r"(\d+(?:\.\d+)?)(?:/100)?%")
+
+# VMID de la plantilla de cada sistema (rellenar con las del clúster)
+# Template VMID for each OS (fill in with the cluster's ones)
+TEMPLATE_IDS: Dict[str, Optional[int]] = {
+    "Windows 11": None,
+    "Windows Server 2025": None,
+    "Windows Server 2022": None,
+    "Ubuntu 24 Client LTS": None,
+    "Ubuntu 24 Server LTS": 103,
+    "Fedora": None,
+    "RedHat": None,
+}
+
+
+class ProxmoxTaskError(RuntimeError):
+    """Una tarea de Proxmox terminó con error | A Proxmox task ended with an error"""
+
+
+@contextmanager
+def vm_phase(name: str, **attrs: Any):
+    """
+    Mide una fase de la creación de una VM (métrica y span).
+    Time a phase of a VM creation (metric and span).
+    """
+    with tracer.span(name, **attrs), PROXMOX_PHASE_SECONDS.labels(name).time():
+        yield
+
+
+class VmidAllocator:
+    """
+    Reparte VMIDs a partir de `cluster/nextid` guardando una reserva
+    local, para que dos peticiones simultáneas no reciban el mismo id
+    antes de que el clúster vea la primera VM.
+
+    Hands out VMIDs based on `cluster/nextid` while keeping a local
+    reservation, so two concurrent requests never get the same id before
+    the cluster sees the first VM.
+    """
+
+    def __init__(self, manager: "ProxmoxManager"):
+        self._manager = manager
+        self.reserved: Set[int] = set()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _is_free(self, vmid: int) -> bool:
+        api = await self._manager.connect()
+        try:
+            # Con `vmid`, nextid solo responde si ese id está libre
+            # With `vmid`, nextid only answers if that id is free
+            await self._manager._call(api.cluster.nextid.get, vmid=vmid)
+            return True
+        except Exception:
+            return False
+
+    async def allocate(self) -> int:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            api = await self._manager.connect()
+            first = int(await self._manager._call(api.cluster.nextid.get))
+            candidate = first
+            while candidate in self.reserved or (
+                candidate != first and not await self._is_free(candidate)
+            ):
+                candidate += 1
+            self.reserved.add(candidate)
+            return candidate
+
+    def release(self, vmid: int):
+        """
+        Libera la reserva (cuando la VM ya existe en el clúster o falló).
+        Drop the reservation (once the VM exists in the cluster or failed).
+        """
+        self.reserved.discard(vmid)
+
+
+class NodePlacer:
+    """
+    Elige el nodo de cada VM nueva con una sola lectura (cacheada) de
+    `cluster/resources`: el que más memoria, CPU y disco libres conserva
+    tras sumar lo pedido. Lo ya colocado cuenta como reserva local hasta
+    que una lectura posterior incluye la VM, para que las peticiones
+    simultáneas no elijan todas el mismo nodo. Solo se puede clonar a otro
+    nodo si el disco de la plantilla está en almacenamiento compartido.
+
+    Chooses each new VM's node with a single (cached) read of
+    `cluster/resources`: the one that keeps the most free memory, CPU and
+    disk after adding what was requested. What was already placed counts
+    as a local reservation until a later read includes the VM, so
+    concurrent requests do not all pick the same node. Cloning to another
+    node is only possible when the template's disk is on shared storage.
+    """
+
+    def __init__(self, manager: "ProxmoxManager"):
+        self._manager = manager
+        self.resources: List[dict] = []
+        self.fetched_at = 0.0
+        # vmid -> (nodo, demanda, cuándo terminó) | vmid -> (node, demand, when it finished)
+        self.reserved: Dict[int, Tuple[str, Dict[str, float], Optional[float]]] = {}
+        self._storages: Dict[int, Optional[str]] = {}
+        self._lock: Optional[asyncio.Lock] = None
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    def _of_type(self, kind: str) -> List[dict]:
+        return [r for r in self.resources if r.get("type") == kind]
+
+    # Nodo y almacenamiento del disco de la plantilla
+    # Node and disk storage of the template
+    async def _template_home(self, template_id: int) -> Tuple[str, Optional[str]]:
+        node = next(
+            (r["node"] for r in self._of_type("qemu") if r.get("vmid") == template_id),
+            PROXMOX_NODE,
+        )
+        if template_id not in self._storages:
+            api = await self._manager.connect()
+            config = await self._manager._call(api.nodes(node).qemu(template_id).config.get)
+            self._storages[template_id] = config.get(PROXMOX_DISK, "").split(":")[0] or None
+        return node, self._storages[template_id]
+
+    def _storage(self, node: str, storage: Optional[str]) -> Optional[dict]:
+        for entry in self._of_type("storage"):
+            if entry.get("node") == node and entry.get("storage") == storage:
+                return entry
+        return None
+
+    def _candidates(self, home: str, storage: Optional[str]) -> List[str]:
+        shared = any(
+            entry.get("storage") == storage and entry.get("shared")
+            for entry in self._of_type("storage")
+        )
+        if not shared:
+            return [home]
+        nodes = [
+            entry["node"] for entry in self._of_type("node")
+            if entry.get("status") == "online"
+            and (not PROXMOX_NODES or entry["node"] in PROXMOX_NODES)
+            and (self._storage(entry["node"], storage) or {}).get("status", "available") == "available"
+        ]
+        return nodes or [home]
+
+    # Memoria, CPU y disco que ya tiene comprometidos un nodo
+    # Memory, CPU and disk a node already has committed
+    def _committed(self, node: str, storage: Optional[str]) -> Dict[str, float]:
+        entry = next((r for r in self._of_type("node") if r["node"] == node), {})
+        running = [
+            vm for vm in self._of_type("qemu")
+            if vm.get("node") == node and vm.get("status") == "running"
+        ]
+        used = {
+            "memory": max(entry.get("mem", 0), sum(vm.get("maxmem", 0) for vm in running)),
+            "cores": max(entry.get("cpu", 0) * entry.get("maxcpu", 0), sum(vm.get("maxcpu", 0) for vm in running)),
+            "disk": (self._storage(node, storage) or {}).get("disk", 0),
+        }
+        for reserved_node, demand, _ in self.reserved.values():
+            if reserved_node == node:
+                for key in used:
+                    used[key] += demand[key]
+        return used
+
+    def _score(self, node: str, storage: Optional[str], demand: Dict[str, float]) -> Tuple[bool, float]:
+        entry = next((r for r in self._of_type("node") if r["node"] == node), {})
+        totals = {
+            "memory": entry.get("maxmem", 0),
+            "cores": entry.get("maxcpu", 0),
+            "disk": (self._storage(node, storage) or {}).get("maxdisk", 0),
+        }
+        used = self._committed(node, storage)
+        free = {
+            key: (totals[key] - used[key] - demand[key]) / totals[key]
+            for key in totals if totals[key]
+        }
+        # Cabe si no se pasa de memoria ni de disco (la CPU se puede repartir)
+        # It fits if memory and disk are not exceeded (CPU can be shared)
+        fits = free.get("memory", 0) >= 0 and free.get("disk", 0) >= 0
+        return fits, min(free.values()) if free else 0.0
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    async def refresh(self):
+        """
+        Vuelve a leer cluster/resources si la copia tiene más de
+        PROXMOX_RESOURCES_TTL segundos.
+
+        Read cluster/resources again if the copy is older than
+        PROXMOX_RESOURCES_TTL seconds.
+        """
+        if time.monotonic() - self.fetched_at < PROXMOX_RESOURCES_TTL:
+            return
+        started = time.monotonic()
+        api = await self._manager.connect()
+        self.resources = await self._manager._call(api.cluster.resources.get)
+        self.fetched_at = started
+        # Las VMs que ya salen en marcha (o terminaron antes de esta
+        # lectura) cuentan por sí mismas
+        # VMs already shown running (or finished before this read) count
+        # on their own
+        running = {vm.get("vmid") for vm in self._of_type("qemu") if vm.get("status") == "running"}
+        self.reserved = {
+            vmid: entry for vmid, entry in self.reserved.items()
+            if vmid not in running and (entry[2] is None or entry[2] > started)
+        }
+
+    @traced("place_vm", "vmid")
+    async def place(self, vmid: int, template_id: int, demand: Dict[str, float]) -> Tuple[str, str]:
+        """
+        Devuelve (nodo de la plantilla, nodo destino) y reserva `demand`
+        (memory y disk en bytes, cores) en el destino.
+
+        Returns (template node, target node) and books `demand` (memory and
+        disk in bytes, cores) on the target.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                await self.refresh()
+                home, storage = await self._template_home(template_id)
+            except Exception as exc:
+                print(f"[Proxmox] No se pudo leer el clúster, uso {PROXMOX_NODE}: {exc}")
+                return PROXMOX_NODE, PROXMOX_NODE
+            scores = {node: self._score(node, storage, demand) for node in self._candidates(home, storage)}
+            target = max(scores, key=scores.get)
+            if not scores[target][0]:
+                print(f"[Proxmox] Ningún nodo tiene sitio para la VM {vmid}, uso {target}")
+            self.reserved[vmid] = (target, demand, None)
+            return home, target
+
+    def done(self, vmid: int):
+        """
+        La VM ya existe: su reserva dura hasta la siguiente lectura.
+        The VM exists now: its reservation lasts until the next read.
+        """
+        if vmid in self.reserved:
+            node, demand, _ = self.reserved[vmid]
+            self.reserved[vmid] = (node, demand, time.monotonic())
+
+    def release(self, vmid: int):
+        self.reserved.pop(vmid, None)
+
+    def status(self) -> Dict[str, Any]:
+        nodes = []
+        for entry in self._of_type("node"):
+            node = entry["node"]
+            used = self._committed(node, None)
+            nodes.append({
+                "node": node,
+                "status": entry.get("status"),
+                "maxmem": entry.get("maxmem"),
+                "committed_mem": used["memory"],
+                "maxcpu": entry.get("maxcpu"),
+                "committed_cores": round(used["cores"], 2),
+                "reservations": sum(1 for r in self.reserved.values() if r[0] == node),
+            })
+        return {
+            "resources_ttl": PROXMOX_RESOURCES_TTL,
+            "fetched_age": round(time.monotonic() - self.fetched_at, 1) if self.fetched_at else None,
+            "nodes": nodes,
+        }
+
+
+class ProxmoxManager:
+    """
+    Orquesta la creación de VMs en Proxmox sin bloquear el event loop: cada
+    llamada a la API va a un pool de hilos pequeño y las esperas se hacen
+    consultando el UPID de la tarea con backoff (asyncio.sleep, no
+    time.sleep). Un semáforo limita los clones simultáneos.
+
+    Orchestrates VM creation on Proxmox without blocking the event loop:
+    every API call goes to a small thread pool and waits poll the task's
+    UPID with backoff (asyncio.sleep, not time.sleep). A semaphore caps the
+    number of simultaneous clones.
+    """
+
+    def __init__(self):
+        # El login se hace la primera vez que hace falta, fuera del event loop
+        # The login happens the first time it is needed, off the event loop
+        self._api: Optional[ProxmoxAPI] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=PROXMOX_API_THREADS, thread_name_prefix="proxmox"
+        )
+        self._slots: Dict[bool, asyncio.Semaphore] = {}
+        self.vmids = VmidAllocator(self)
+        self.nodes = NodePlacer(self)
+        self.in_flight = 0
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    @property
+    def api(self) -> ProxmoxAPI:
+        if self._api is None:
+            self._api = ProxmoxAPI(
+                PROXMOX_HOST,
+                user=PROXMOX_USER,
+                password=PROXMOX_PASSWORD,
+                verify_ssl=PROXMOX_VERIFY_SSL,
+                timeout=30,
+            )
+        return self._api
+
+    async def connect(self) -> ProxmoxAPI:
+        """
+        Cliente ya autenticado. El login (bloqueante) va al pool de hilos y
+        solo lo hace una petición aunque lleguen varias a la vez.
+
+        Authenticated client. The (blocking) login goes to the thread pool
+        and only one request does it even if several arrive at once.
+        """
+        if self._api is not None:
+            return self._api
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            return await self._call(lambda: self.api)
+
+    async def ping(self) -> bool:
+        api = await self.connect()
+        return bool(await self._call(api.version.get))
+
+    async def _call(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    def _clone_slots(self, linked: bool) -> asyncio.Semaphore:
+        if linked not in self._slots:
+            self._slots[linked] = asyncio.Semaphore(
+                PROXMOX_MAX_LINKED_CLONES if linked else PROXMOX_MAX_CLONES
+            )
+        return self._slots[linked]
+
+    # Tamaño en GB de un disco a partir de su línea de configuración
+    # Size in GB of a disk from its config line
+    @staticmethod
+    def _disk_gb(config_line: str) -> Optional[float]:
+        for part in config_line.split(","):
+            if part.startswith("size="):
+                value = part[5:]
+                units = {"T": 1024, "G": 1, "M": 1 / 1024, "K": 1 / 1024 ** 2}
+                if value[-1] in units:
+                    return float(value[:-1]) * units[value[-1]]
+                return float(value) / 1024 ** 3
+        return None
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    async def wait_task(
+        self, node: str, upid: str, on_progress: Optional[Callable[[Dict], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Espera a que termine la tarea `upid`. Lanza ProxmoxTaskError si
+        acaba mal y TimeoutError si pasa de TASK_TIMEOUT. Con `on_progress`
+        también lee las líneas nuevas del log y le pasa el estado con el
+        último porcentaje visto en `progress` (None si el log no da).
+
+        Wait for task `upid` to finish. Raises ProxmoxTaskError if it fails
+        and TimeoutError if it takes longer than TASK_TIMEOUT. With
+        `on_progress` it also reads the new log lines and passes it the
+        status with the last percentage seen in `progress` (None if the log
+        gives none).
+        """
+        delay = TASK_POLL_MIN
+        deadline = time.monotonic() + TASK_TIMEOUT
+        log_lines = 0
+        progress = None
+        while True:
+            api = await self.connect()
+            task = api.nodes(node).tasks(upid)
+            status = await self._call(task.status.get)
+            if on_progress:
+                lines = await self._call(task.log.get, start=log_lines, limit=500)
+                log_lines += len(lines)
+                for line in lines:
+                    match = TASK_PROGRESS.search(line.get("t", ""))
+                    if match:
+                        progress = float(match.group(1))
+                on_progress({**status, "progress": progress})
+            if status.get("status") == "stopped":
+                if status.get("exitstatus") != "OK":
+                    raise ProxmoxTaskError(
+                        f"Tarea {upid} terminó con: {status.get('exitstatus')}"
+                    )
+                return status
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Tarea {upid} sin terminar tras {TASK_TIMEOUT}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, TASK_POLL_MAX)
+
+    async def clone_vm(
+        self, node: str, template_id: int, vm_id: int, vm_name: str, linked: bool = False,
+        target: Optional[str] = None
+    ) -> str:
+        """
+        Clona la plantilla (que está en `node`) en `target` (el mismo nodo
+        si no se indica). Con `linked` hace un clon enlazado (full=0), que
+        comparte los discos de la plantilla y tarda segundos.
+
+        Clone the template (which lives on `node`) onto `target` (the same
+        node if not given). With `linked` it makes a linked clone (full=0),
+        which shares the template's disks and takes seconds.
+        """
+        target = target or node
+        kind = "enlazado" if linked else "completo"
+        print(f"[Proxmox] Clon {kind} de la plantilla {template_id} en la VM {vm_id}...")
+        clone = (await self.connect()).nodes(node).qemu(template_id).clone.post
+        delay = TASK_POLL_MIN
+        for attempt in range(CLONE_LOCK_RETRIES):
+            try:
+                if linked and target == node:
+                    return await self._call(clone, newid=vm_id, name=vm_name, full=0)
+                return await self._call(
+                    clone, newid=vm_id, target=target, name=vm_name, full=0 if linked else 1
+                )
+            except Exception as exc:
+                # Otro clon tiene bloqueada la plantilla: esperar y reintentar
+                # Another clone holds the template lock: wait and retry
+                if "lock" not in str(exc).lower() or attempt == CLONE_LOCK_RETRIES - 1:
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, TASK_POLL_MAX)
+
+    async def wait_for_vm_ready(self, node: str, vm_id: int):
+        """
+        Espera a que la VM exista y no tenga lock (clone/disk en curso).
+        Wait until the VM exists and holds no lock (clone/disk in progress).
+        """
+        delay = TASK_POLL_MIN
+        deadline = time.monotonic() + TASK_TIMEOUT
+        while True:
+            api = await self.connect()
+            status = await self._call(api.nodes(node).qemu(vm_id).status.current.get)
+            if status.get("status") in ("stopped", "running") and not status.get("lock"):
+                return status
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"La VM {vm_id} no está lista tras {TASK_TIMEOUT}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, TASK_POLL_MAX)
+
+    async def configure_vm(
+        self, node: str, vm_id: int, vm_name: str, spec: Dict[str, Any]
+    ):
+        vm = (await self.connect()).nodes(node).qemu(vm_id)
+        config = {
+            "name": vm_name,
+            "memory": spec["memory"],
+            "cores": spec["cores"],
+            "sockets": 1,
+            # Usuario de cloud-init con la contraseña de la petición
+            # cloud-init user with the request's password
+            "ciuser": spec["userid"],
+            "cipassword": spec["upassword"],
+        }
+        if spec.get("sshpb"):
+            config["sshkeys"] = quote(spec["sshpb"].strip(), safe="")
+        await self._call(vm.config.post, **config)
+
+        current = await self._call(vm.config.get)
+        size = self._disk_gb(current.get(PROXMOX_DISK, ""))
+        if size is not None and spec["disksize"] > size:
+            await self._call(vm.resize.put, disk=PROXMOX_DISK, size=f"{spec['disksize']}G")
+
+    async def start_vm(self, node: str, vm_id: int):
+        print(f"[Proxmox] Arrancando la VM {vm_id}...")
+        api = await self.connect()
+        upid = await self._call(api.nodes(node).qemu(vm_id).status.start.post)
+        await self.wait_task(node, upid)
+
+    @traced("destroy_vm", "node", "vm_id")
+    async def destroy_vm(self, node: str, vm_id: int) -> bool:
+        """
+        Para la VM (sin esperar al apagado del sistema) y la borra con sus
+        discos. Devuelve False si ya no existía.
+
+        Stop the VM (without waiting for the guest to shut down) and delete
+        it with its disks. Returns False if it no longer existed.
+        """
+        api = await self.connect()
+        vm = api.nodes(node).qemu(vm_id)
+        try:
+            current = await self._call(vm.status.current.get)
+        except Exception as exc:
+            if "does not exist" in str(exc):
+                return False
+            raise
+        if current.get("status") != "stopped":
+            with vm_phase("stop", node=node, vmid=vm_id):
+                await self.wait_task(node, await self._call(vm.status.stop.post))
+        with vm_phase("destroy", node=node, vmid=vm_id):
+            upid = await self._call(vm.delete, purge=1, **{"destroy-unreferenced-disks": 1})
+            await self.wait_task(node, upid)
+        self.nodes.release(vm_id)
+        print(f"[Proxmox] VM {vm_id} borrada de {node}")
+        return True
+
+    @traced("create_vm")
+    async def create_vm_and_start(
+        self,
+        spec: Dict[str, Any],
+        on_phase: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        linked: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Clona la plantilla del sistema pedido, espera al clon, configura la
+        VM y la arranca. Como mucho PROXMOX_MAX_CLONES (o
+        PROXMOX_MAX_LINKED_CLONES) a la vez.
+
+        Clone the requested OS template, wait for the clone, configure the
+        VM and start it. At most PROXMOX_MAX_CLONES (or
+        PROXMOX_MAX_LINKED_CLONES) at once.
+        """
+        template_id = TEMPLATE_IDS.get(spec["os"])
+        if template_id is None:
+            raise NotImplementedError(f"Plantilla {spec['os']} sin configurar")
+        notify = on_phase or (lambda phase, info: None)
+        demand = {
+            "memory": spec["memory"] * 1024 ** 2,
+            "cores": spec["cores"],
+            "disk": spec["disksize"] * 1024 ** 3,
+        }
+
+        tracer.annotate(userid=spec["userid"], os=spec["os"], linked=linked)
+
+        async with self._clone_slots(linked):
+            self.in_flight += 1
+            vm_id = None
+            try:
+                vm_id = await self.vmids.allocate()
+                try:
+                    home, node = await self.nodes.place(vm_id, template_id, demand)
+                    vm_name = f"{spec['userid']}-{vm_id}"
+                    info = {"node": node, "vmid": vm_id}
+                    notify("cloning", info)
+                    seen = {"progress": None}
+
+                    # Solo los cambios de porcentaje (los clones completos)
+                    # Only percentage changes (full clones)
+                    def clone_progress(status: Dict[str, Any]):
+                        if status["progress"] not in (None, seen["progress"]):
+                            seen["progress"] = status["progress"]
+                            notify("cloning", {**info, "progress": status["progress"]})
+
+                    with vm_phase("clone", **info):
+                        upid = await self.clone_vm(home, template_id, vm_id, vm_name, linked, node)
+                    # La tarea de clonado corre en el nodo de la plantilla
+                    # The clone task runs on the template's node
+                    with vm_phase("clone_wait", **info):
+                        await self.wait_task(home, upid, clone_progress)
+                finally:
+                    self.vmids.release(vm_id)
+                with vm_phase("vm_ready", **info):
+                    await self.wait_for_vm_ready(node, vm_id)
+                notify("configuring", info)
+                with vm_phase("configure", **info):
+                    await self.configure_vm(node, vm_id, vm_name, spec)
+                notify("starting", info)
+                with vm_phase("start", **info):
+                    await self.start_vm(node, vm_id)
+                self.nodes.done(vm_id)
+            except BaseException as exc:
+                # También si se cancela, para no dejar la reserva colgada
+                # Also when cancelled, so the reservation is not left behind
+                if vm_id is not None:
+                    self.nodes.release(vm_id)
+                if isinstance(exc, Exception):
+                    PROXMOX_ERRORS.labels(spec["os"]).inc()
+                raise
+            finally:
+                self.in_flight -= 1
+        print(f"[Proxmox] VM {vm_id} creada y arrancada.")
+        return info
+
+    async def create_batch(
+        self,
+        specs: List[Dict[str, Any]],
+        on_phase: Optional[Callable[[int, str, Dict[str, Any]], None]] = None,
+        linked: bool = True,
+    ) -> List[Any]:
+        """
+        Crea las VMs de varios alumnos a la vez (clones enlazados por
+        defecto). Devuelve, en el mismo orden, la info de cada VM o la
+        excepción con la que falló.
+
+        Create several students' VMs at once (linked clones by default).
+        Returns, in the same order, each VM's info or the exception it
+        failed with.
+        """
+        notify = on_phase or (lambda index, phase, info: None)
+        return await asyncio.gather(
+            *(
+                self.create_vm_and_start(
+                    spec, lambda phase, info, i=i: notify(i, phase, info), linked
+                )
+                for i, spec in enumerate(specs)
+            ),
+            return_exceptions=True,
+        )
+
+
+# Helper singleton (la conexión se abre en la primera llamada)
+# Helper singleton (the connection opens on the first call)
+proxmox_manager = ProxmoxManager()
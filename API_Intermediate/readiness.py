@@ -0,0 +1,123 @@
+# readiness.py
+import os
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator
+
+from metrics import DEPENDENCY_UP, STARTUP_SECONDS
+
+# Cada cuánto se revisan las dependencias y cuánto se espera a cada una
+# How often the dependencies are checked and how long each one is awaited
+READY_CHECK_INTERVAL = float(os.getenv("READY_CHECK_INTERVAL", "15"))
+READY_CHECK_TIMEOUT = float(os.getenv("READY_CHECK_TIMEOUT", "5"))
+# Dependencias sin las que la API no está lista (separadas por comas).
+# Proxmox no está por defecto: sin él se pueden seguir desplegando webs.
+# "store" es el almacén de ficheros bajo BASE_PATH
+# Dependencies without which the API is not ready (comma separated).
+# Proxmox is not included by default: sites can still be deployed without it.
+# "store" is the file store under BASE_PATH
+READY_REQUIRES = {name for name in os.getenv("READY_REQUIRES", "docker,store").split(",") if name}
+
+
+class Readiness:
+    """
+    Salud de las dependencias (daemon Docker, Proxmox...) comprobada en
+    segundo plano y guardada, para que /ready responda al momento sin
+    llamar a nadie. También apunta cuánto tarda cada paso del arranque.
+
+    Health of the dependencies (Docker daemon, Proxmox...) checked in the
+    background and cached, so /ready answers at once without calling
+    anybody. It also records how long each startup step takes.
+    """
+
+    def __init__(self):
+        self.created = time.perf_counter()
+        self.startup: Dict[str, float] = {}
+        self.checks: Dict[str, Callable[[], Awaitable[Any]]] = {}
+        self.health: Dict[str, Dict[str, Any]] = {}
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    def _record(self, step: str, seconds: float):
+        self.startup[step] = round(seconds, 4)
+        STARTUP_SECONDS.labels(step).set(seconds)
+        print(f"[API] Arranque: {step} en {seconds:.3f}s")
+
+    async def _probe(self, name: str, check: Callable[[], Awaitable[Any]]):
+        start = time.perf_counter()
+        try:
+            ok = bool(await asyncio.wait_for(check(), READY_CHECK_TIMEOUT))
+            error = None if ok else "respuesta inesperada"
+        except asyncio.TimeoutError:
+            ok, error = False, f"sin respuesta en {READY_CHECK_TIMEOUT}s"
+        except Exception as exc:
+            ok, error = False, str(exc) or type(exc).__name__
+        previous = self.health.get(name, {}).get("ok")
+        if previous is not None and previous != ok:
+            print(f"[API] {name}: {'disponible' if ok else f'no disponible ({error})'}")
+        self.health[name] = {
+            "ok": ok,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "checked_at": time.time(),
+            "error": error,
+        }
+        DEPENDENCY_UP.labels(name).set(1 if ok else 0)
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        """
+        Mide un paso del arranque (solo si sale bien)
+        Time a startup step (only when it succeeds)
+        """
+        start = time.perf_counter()
+        yield
+        self._record(name, time.perf_counter() - start)
+
+    def since_created(self, name: str):
+        """
+        Apunta el tiempo desde que se importó este módulo (p. ej. el de
+        importar la app entera).
+
+        Record the time since this module was imported (e.g. the time it
+        takes to import the whole app).
+        """
+        self._record(name, time.perf_counter() - self.created)
+
+    def add_check(self, name: str, check: Callable[[], Awaitable[Any]]):
+        self.checks[name] = check
+
+    async def check(self):
+        """
+        Una pasada por todas las dependencias, a la vez.
+        One pass over every dependency, at the same time.
+        """
+        await asyncio.gather(*(
+            self._probe(name, check) for name, check in self.checks.items()
+        ))
+
+    async def run(self):
+        """
+        Bucle de fondo para el lifespan de la API.
+        Background loop for the API's lifespan.
+        """
+        while True:
+            await self.check()
+            await asyncio.sleep(READY_CHECK_INTERVAL)
+
+    def status(self) -> Dict[str, Any]:
+        required = sorted(READY_REQUIRES & set(self.checks))
+        return {
+            "ready": all(self.health.get(name, {}).get("ok") for name in required),
+            "requires": required,
+            "checks": self.health,
+            "startup": self.startup,
+        }
+
+
+# Helper singleton compartido por la API | Helper singleton shared by the API
+readiness = Readiness()
@@ -0,0 +1,65 @@
+# roster.py
+import os
+import csv
+import io
+import json
+from typing import Dict, List, Optional
+
+# Filas como máximo en una lista de clase
+# Maximum rows in a class roster
+ROSTER_MAX = int(os.getenv("ROSTER_MAX", "200"))
+
+
+class RosterError(ValueError):
+    """Lista de clase ilegible o demasiado larga | Unreadable or too long roster"""
+
+
+def _parse_csv(text: str) -> List[Dict[str, str]]:
+    # Excel en español separa con ";"; se detecta con la primera línea
+    # Spanish Excel separates with ";"; detected from the first line
+    try:
+        dialect = csv.Sniffer().sniff(text.split("\n", 1)[0], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    return list(csv.DictReader(io.StringIO(text), dialect=dialect))
+
+
+def parse_roster(raw: bytes, filename: Optional[str] = None) -> List[Dict[str, str]]:
+    """
+    Filas de una lista de clase: CSV con cabecera (userid,Webname,... o
+    userid,upassword,...) o JSON con una lista de objetos. Se quitan los
+    espacios, las celdas vacías y las filas en blanco; la validación de
+    cada campo la hace quien la usa.
+
+    Rows of a class roster: CSV with a header (userid,Webname,... or
+    userid,upassword,...) or JSON with a list of objects. Spaces, empty
+    cells and blank rows are dropped; each field is validated by the
+    caller.
+    """
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise RosterError("La lista tiene que estar en UTF-8")
+    if (filename or "").lower().endswith(".json") or text.lstrip().startswith("["):
+        try:
+            rows = json.loads(text)
+        except ValueError as exc:
+            raise RosterError(f"JSON no válido: {exc}")
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise RosterError("El JSON tiene que ser una lista de objetos")
+    else:
+        rows = _parse_csv(text)
+    cleaned = []
+    for row in rows:
+        row = {
+            str(key).strip(): value.strip() if isinstance(value, str) else value
+            for key, value in row.items()
+            if key is not None and value not in (None, "")
+        }
+        if row:
+            cleaned.append(row)
+    if not cleaned:
+        raise RosterError("La lista está vacía")
+    if len(cleaned) > ROSTER_MAX:
+        raise RosterError(f"Demasiadas filas ({len(cleaned)}, máximo {ROSTER_MAX})")
+    return cleaned
@@ -0,0 +1,190 @@
+# site_manifest.py
+import os
+import json
+import pathlib
+from typing import Dict, Iterable, Optional
+
+# incremental  un redespliegue solo escribe los ficheros añadidos o
+#              cambiados y borra los que ya no vienen en el zip
+# full         se escribe todo el zip encima de data (lo de antes)
+# incremental  a redeploy only writes added or changed files and removes
+#              the ones missing from the new zip
+# full         the whole zip is written over data (the old behaviour)
+REDEPLOY_MODE = os.getenv("REDEPLOY_MODE", "incremental")
+MANIFEST_NAME = "manifest.json"
+
+
+class SiteManifest:
+    """
+    Qué ficheros dejó en `data` el último zip de un proyecto: su CRC y
+    tamaño (los del zip) y el tamaño y mtime que tienen en disco. Un
+    fichero del zip nuevo con el mismo CRC y tamaño, y que nadie ha tocado
+    desde filebrowser, no hace falta escribirlo otra vez.
+
+    Which files the last zip of a project left in `data`: their CRC and
+    size (as in the zip) and the size and mtime they have on disk. A file
+    of the new zip with the same CRC and size, and that nobody touched
+    from filebrowser, does not need to be written again.
+
+    Los ficheros que pasaron por el almacén llevan además su sha256: así se
+    sabe qué blobs siguen usando los proyectos.
+    The files that went through the store also carry their sha256: that is
+    how the blobs projects still use are known.
+    """
+
+    def __init__(self, target: pathlib.Path):
+        self.path = target / MANIFEST_NAME
+        self.data = target / "data"
+        # nombre -> {"crc", "size", "mtime_ns"[, "sha256"]}
+        # name -> {"crc", "size", "mtime_ns"[, "sha256"]}
+        self.files: Dict[str, dict] = {}
+        try:
+            self.files = json.loads(self.path.read_text())["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    # ¿Sigue el fichero en disco como lo dejó el último despliegue?
+    # Is the file on disk still as the last deploy left it?
+    def _untouched(self, name: str, entry: dict) -> bool:
+        try:
+            st = os.lstat(self.data / name)
+        except OSError:
+            return False
+        return st.st_size == entry["size"] and st.st_mtime_ns == entry["mtime_ns"]
+
+    def _remove(self, name: str):
+        path = self.data / name
+        path.unlink()
+        # Carpetas que se quedan vacías | Folders left empty
+        parent = path.parent
+        while parent != self.data:
+            try:
+                parent.rmdir()
+            except OSError:
+                break
+            parent = parent.parent
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    def unchanged(self, name: str, crc: int, size: int) -> bool:
+        """
+        ¿Se puede saltar este miembro del zip? Lo usa el extractor.
+        Can this zip member be skipped? Used by the extractor.
+        """
+        if REDEPLOY_MODE != "incremental":
+            return False
+        entry = self.files.get(name)
+        if entry is None or entry["crc"] != crc or entry["size"] != size:
+            return False
+        return self._untouched(name, entry)
+
+    def intact(self) -> bool:
+        """
+        ¿Siguen en disco todos los ficheros del último zip tal y como se
+        dejaron? Si alguien los tocó, volver a subir el mismo zip sí
+        cambia algo.
+
+        Are all the files of the last zip still on disk as they were left?
+        If someone touched them, uploading the same zip again does change
+        something.
+        """
+        return all(self._untouched(name, entry) for name, entry in self.files.items())
+
+    def size(self) -> int:
+        """
+        Bytes que dejó en data el último zip (sin lo subido a mano).
+        Bytes the last zip left in data (not counting manual uploads).
+        """
+        return sum(entry["size"] for entry in self.files.values())
+
+    def digests(self) -> Iterable[str]:
+        """
+        sha256 de los ficheros del último zip que están en el almacén.
+        sha256 of the last zip's files that are in the store.
+        """
+        return (entry["sha256"] for entry in self.files.values() if entry.get("sha256"))
+
+    def apply(
+        self, members: Dict[str, tuple], written: Iterable[str]
+    ) -> Dict[str, int]:
+        """
+        Cierra un despliegue ya volcado en data: borra los ficheros del
+        zip anterior que no vienen en `members` (si nadie los ha editado),
+        apunta cómo han quedado los demás y guarda el manifiesto.
+
+        Close a deploy already merged into data: remove the files of the
+        previous zip missing from `members` (unless someone edited them),
+        record how the rest ended up and save the manifest.
+        """
+        written = set(written)
+        removed = 0
+        if REDEPLOY_MODE == "incremental":
+            for name, entry in self.files.items():
+                if name not in members and self._untouched(name, entry):
+                    self._remove(name)
+                    removed += 1
+
+        files: Dict[str, dict] = {}
+        for name, (crc, size, *digest) in members.items():
+            old = self.files.get(name)
+            if name not in written:
+                # Saltado en la subida: solo vale si sigue igual (otro
+                # despliegue del mismo proyecto pudo cambiarlo entretanto)
+                # Skipped on upload: only valid if it is still the same
+                # (another deploy of the project may have changed it since)
+                if old is None or (old["crc"], old["size"]) != (crc, size) or not self._untouched(name, old):
+                    continue
+                digest = digest or [old.get("sha256")]
+            try:
+                st = os.lstat(self.data / name)
+            except OSError:
+                continue
+            files[name] = {"crc": crc, "size": size, "mtime_ns": st.st_mtime_ns}
+            if digest and digest[0]:
+                files[name]["sha256"] = digest[0]
+        self.files = files
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"files": files}))
+        os.replace(tmp, self.path)
+        return {
+            "written": len(written),
+            "unchanged": len(set(members) - written),
+            "removed": removed,
+        }
+
+
+def members_path(staged: pathlib.Path) -> pathlib.Path:
+    """
+    Dónde deja la subida la lista de miembros del zip, junto al staging.
+    Where the upload leaves the zip's member list, next to the staging.
+    """
+    return staged.with_name(staged.name + ".members.json")
+
+
+def with_digests(members: Dict[str, tuple], digests: Dict[str, str]) -> Dict[str, tuple]:
+    """
+    (crc, tamaño) de cada miembro, más su sha256 si pasó por el almacén.
+    Each member's (crc, size), plus its sha256 if it went through the store.
+    """
+    return {
+        name: (*value, digests[name]) if name in digests else tuple(value)
+        for name, value in members.items()
+    }
+
+
+def save_members(staged: pathlib.Path, members: Dict[str, tuple], digests: Optional[Dict[str, str]] = None):
+    members_path(staged).write_text(json.dumps(with_digests(members, digests or {})))
+
+
+def load_members(staged: pathlib.Path) -> Optional[Dict[str, tuple]]:
+    try:
+        return {
+            name: tuple(value)
+            for name, value in json.loads(members_path(staged).read_text()).items()
+        }
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,271 @@
+# tracing.py
+import os
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Trazas que se guardan en memoria (las más recientes)
+# Traces kept in memory (the most recent ones)
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", "2000"))
+# Fichero JSON lines donde se añade cada span al terminar (vacío = ninguno)
+# JSON lines file each span is appended to when it ends (empty = none)
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+
+# Span en curso de esta tarea o hilo | Span in progress for this task or thread
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("iapi_span", default=None)
+
+
+class Span:
+    """
+    Un tramo medido de un despliegue, con su traza, su padre y atributos.
+    A timed stretch of a deploy, with its trace, its parent and attributes.
+    """
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attrs: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status = "running"
+        self.error: Optional[str] = None
+
+    def set(self, **attrs: Any):
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        duration = self.duration if self.duration is not None else time.perf_counter() - self._t0
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(duration * 1000, 3),
+            "status": self.status,
+            "error": self.error,
+            "attrs": self.attrs,
+        }
+
+
+class Tracer:
+    """
+    Trazas de los despliegues Docker y Proxmox: cada petición abre una y
+    cada fase (extracción, contenedores efímeros, compose, clonado...) es
+    un span hijo, también en los hilos de trabajo. Se guardan las últimas
+    TRACE_BUFFER en memoria para consultarlas por la API y, con TRACE_FILE,
+    cada span terminado se añade a un fichero JSON lines.
+
+    Traces of the Docker and Proxmox deploys: every request opens one and
+    every phase (extraction, one-off containers, compose, cloning...) is a
+    child span, also on the worker threads. The last TRACE_BUFFER are kept
+    in memory to be queried through the API and, with TRACE_FILE, every
+    finished span is appended to a JSON lines file.
+    """
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        # traza -> spans | trace -> spans
+        self.traces: "OrderedDict[str, List[Span]]" = OrderedDict()
+        # (tipo, id) -> (traza, span) donde empezó el trabajo
+        # (kind, id) -> (trace, span) where the job started
+        self.items: "OrderedDict[Tuple[str, Any], Tuple[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._file = None
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    def _record(self, span: Span):
+        with self._lock:
+            self.traces.setdefault(span.trace_id, []).append(span)
+            self.traces.move_to_end(span.trace_id)
+            while len(self.traces) > TRACE_BUFFER:
+                self.traces.popitem(last=False)
+
+    def _export(self, span: Span):
+        if not self.path:
+            return
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a", buffering=1)
+                self._file.write(line + "\n")
+            except OSError as exc:
+                print(f"[API] No se pudo escribir la traza en {self.path}: {exc}")
+                self.path = ""
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    @contextmanager
+    def span(self, name: str, item: Optional[Tuple[str, Any]] = None, **attrs: Any) -> Iterator[Span]:
+        """
+        Mide un bloque como hijo del span en curso. Sin span en curso (un
+        worker de la cola), con `item` (tipo, id) cuelga de donde se encoló
+        ese trabajo; si no se apuntó allí, se apunta aquí.
+
+        Time a block as a child of the current span. Without a current span
+        (a queue worker), with `item` (kind, id) it hangs from where that
+        job was queued; if it was not recorded there, it is recorded here.
+        """
+        current = _current.get()
+        if current is not None:
+            parent = (current.trace_id, current.span_id)
+        else:
+            parent = (self.items.get(item) if item else None) or (uuid.uuid4().hex, None)
+        span = Span(name, parent[0], parent[1], attrs)
+        if item:
+            self.bind(*item, span)
+        self._record(span)
+        token = _current.set(span)
+        try:
+            yield span
+            span.status = "ok"
+        except BaseException as exc:
+            span.status = "error"
+            span.error = str(exc) or type(exc).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - span._t0
+            _current.reset(token)
+            self._export(span)
+
+    def bind(self, kind: str, item_id: Any, span: Optional[Span] = None):
+        """
+        Asocia un trabajo al span dado (o al actual) para seguir su traza.
+        Tie a job to the given (or current) span to follow its trace.
+        """
+        span = span or _current.get()
+        if span is None:
+            return
+        with self._lock:
+            self.items.setdefault((kind, item_id), (span.trace_id, span.span_id))
+            while len(self.items) > TRACE_BUFFER * 10:
+                self.items.popitem(last=False)
+
+    def annotate(self, **attrs: Any):
+        """
+        Añade atributos al span en curso, si lo hay.
+        Add attributes to the current span, if any.
+        """
+        span = _current.get()
+        if span is not None:
+            span.set(**attrs)
+
+    def current_trace(self) -> Optional[str]:
+        span = _current.get()
+        return span.trace_id if span else None
+
+    def trace_of(self, kind: str, item_id: Any) -> Optional[str]:
+        entry = self.items.get((kind, item_id))
+        return entry[0] if entry else None
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Spans de una traza en orden y los más lentos de los que no tienen
+        hijos, que son las fases que de verdad se llevaron el tiempo.
+
+        A trace's spans in order and the slowest of those without
+        children, which are the phases that really took the time.
+        """
+        with self._lock:
+            spans = [span.to_dict() for span in self.traces.get(trace_id, [])]
+        if not spans:
+            return None
+        spans.sort(key=lambda s: s["start"])
+        parents = {s["parent_id"] for s in spans}
+        leaves = sorted(
+            (s for s in spans if s["span_id"] not in parents),
+            key=lambda s: s["duration_ms"], reverse=True,
+        )
+        roots = [s for s in spans if s["parent_id"] is None] or spans[:1]
+        return {
+            "trace_id": trace_id,
+            "name": roots[0]["name"],
+            # De la petición al final del despliegue | From the request to the end of the deploy
+            "duration_ms": round(
+                max(s["start"] * 1000 + s["duration_ms"] for s in spans) - spans[0]["start"] * 1000, 3
+            ),
+            "status": next(
+                (status for status in ("error", "running") if any(s["status"] == status for s in spans)), "ok"
+            ),
+            "slowest": [{k: s[k] for k in ("name", "duration_ms", "attrs")} for s in leaves[:5]],
+            "spans": spans,
+        }
+
+    def recent(
+        self, limit: int = 50, name: Optional[str] = None,
+        min_ms: Optional[float] = None, status: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Resumen de las trazas más recientes, con filtros.
+        Summary of the most recent traces, with filters.
+        """
+        with self._lock:
+            trace_ids = list(reversed(self.traces))
+        found = []
+        for trace_id in trace_ids:
+            trace = self.get(trace_id)
+            if trace is None:
+                continue
+            if name and trace["name"] != name:
+                continue
+            if min_ms is not None and trace["duration_ms"] < min_ms:
+                continue
+            if status and trace["status"] != status:
+                continue
+            trace["slowest"] = trace["slowest"][:1]
+            trace["spans"] = len(trace["spans"])
+            found.append(trace)
+            if len(found) >= limit:
+                break
+        return found
+
+
+# Helper singleton compartido por la API y los gestores
+# Helper singleton shared by the API and the managers
+tracer = Tracer()
+
+
+def traced(name: str, *fields: str) -> Callable:
+    """
+    Decorador: cada llamada es un span, con los argumentos `fields` como
+    atributos. Vale para funciones normales y async.
+
+    Decorator: every call is a span, with the `fields` arguments as
+    attributes. Works for plain and async functions.
+    """
+    def decorate(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+
+        def attrs(args, kwargs) -> Dict[str, Any]:
+            if not fields:
+                return {}
+            bound = signature.bind_partial(*args, **kwargs).arguments
+            return {field: bound[field] for field in fields if field in bound}
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with tracer.span(name, **attrs(args, kwargs)):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with tracer.span(name, **attrs(args, kwargs)):
+                    return func(*args, **kwargs)
+        return wrapper
+
+    return decorate
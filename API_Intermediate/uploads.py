@@ -0,0 +1,301 @@
+# uploads.py
+import os
+import asyncio
+import base64
+import binascii
+import hashlib
+import shutil
+import time
+import uuid
+from email.utils import formatdate
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from docker_manager import docker_manager
+from site_manifest import members_path, save_members
+from zip_preflight import stream_limit
+from zip_stream import StreamingZipExtractor, ZipStreamError
+
+# Versión del protocolo tus que se implementa (núcleo + creation,
+# expiration y termination)
+# tus protocol version implemented (core + creation, expiration and
+# termination)
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,expiration,termination"
+# Tamaño máximo de un zip subido por partes
+# Maximum size of a zip uploaded in parts
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Segundos sin recibir nada tras los que una subida se descarta (al crear
+# otra o en la siguiente pasada del recolector de basura)
+# Seconds without receiving anything after which an upload is dropped (when
+# another one is created or on the garbage collector's next pass)
+UPLOAD_EXPIRES = float(os.getenv("UPLOAD_EXPIRES", str(6 * 3600)))
+# Subidas abiertas a la vez por usuario
+# Uploads open at the same time per user
+UPLOAD_MAX_PER_USER = int(os.getenv("UPLOAD_MAX_PER_USER", "4"))
+
+
+class UploadError(ValueError):
+    """Subida o trozo no válido | Invalid upload or chunk"""
+
+
+class UploadConflict(UploadError):
+    """El trozo no encaja con el estado de la subida | The chunk does not fit the upload's state"""
+
+
+class UploadLocked(UploadError):
+    """Otra petición está escribiendo en la subida | Another request is writing to the upload"""
+
+
+def parse_metadata(header: Optional[str]) -> Dict[str, str]:
+    """
+    Cabecera Upload-Metadata de tus: pares "clave valor-base64" separados
+    por comas.
+    tus Upload-Metadata header: comma separated "key base64-value" pairs.
+    """
+    metadata = {}
+    for pair in (header or "").split(","):
+        key, _, value = pair.strip().partition(" ")
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value.strip(), validate=True).decode()
+        except (binascii.Error, UnicodeDecodeError):
+            raise UploadError(f"Upload-Metadata no válida en '{key}'")
+    return metadata
+
+
+class Upload:
+    """
+    Una subida por partes: el zip se extrae en su carpeta de staging y se
+    va calculando su SHA-256 a medida que llegan los trozos, así que al
+    terminar no hay nada que juntar ni que volver a leer.
+
+    An upload in parts: the zip is extracted into its staging folder and
+    its SHA-256 computed as the chunks arrive, so once finished there is
+    nothing to assemble or read again.
+    """
+
+    def __init__(self, userid: str, Webname: str, length: int, filename: Optional[str]):
+        self.id = uuid.uuid4().hex
+        self.userid = userid
+        self.Webname = Webname
+        self.length = length
+        self.filename = filename
+        self.offset = 0
+        self.staged = docker_manager.staging_path(userid, Webname)
+        manifest = docker_manager.site_manifest(userid, Webname)
+        self.extractor = StreamingZipExtractor(
+            self.staged,
+            max_total_bytes=stream_limit(docker_manager.quota_left(userid, Webname)),
+            store=docker_manager.store,
+            skip=manifest.unchanged,
+        )
+        self.digest = hashlib.sha256()
+        self.result: Optional[Dict[str, Any]] = None
+        self.touched_at = time.time()
+        self.lock = asyncio.Lock()
+
+    @property
+    def expires_at(self) -> float:
+        return self.touched_at + UPLOAD_EXPIRES
+
+    def feed(self, chunk: bytes):
+        self.digest.update(chunk)
+        self.extractor.feed(chunk)
+        self.offset += len(chunk)
+
+    def finish(self):
+        stats = self.extractor.close()
+        save_members(self.staged, self.extractor.members, self.extractor.digests)
+        self.result = {
+            "staged_path": str(self.staged),
+            "sha256": self.digest.hexdigest(),
+            "filename": self.filename,
+            **stats,
+        }
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "Tus-Resumable": TUS_VERSION,
+            "Upload-Offset": str(self.offset),
+            "Upload-Length": str(self.length),
+            "Upload-Expires": formatdate(self.expires_at, usegmt=True),
+            "Cache-Control": "no-store",
+        }
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "upload_id": self.id,
+            "userid": self.userid,
+            "Webname": self.Webname,
+            "filename": self.filename,
+            "offset": self.offset,
+            "length": self.length,
+            "complete": self.result is not None,
+            "sha256": self.result["sha256"] if self.result else None,
+            "expires_at": self.expires_at,
+        }
+
+
+class UploadManager:
+    """
+    Subidas reanudables al estilo tus junto al campo `userfile` de siempre.
+    Un cliente con mala conexión crea la subida, manda el zip en PATCH
+    sucesivos y, si se corta, pregunta con HEAD por dónde iba y sigue desde
+    ahí. Al completarse, POST /docker/ recibe su `upload_id` y el despliegue
+    usa la carpeta ya extraída, sin volver a subir nada.
+
+    El estado del extractor vive en memoria: si la API se reinicia a mitad,
+    la subida se pierde (HEAD da 404) y el cliente empieza de nuevo.
+
+    tus-style resumable uploads next to the usual `userfile` field. A client
+    on a bad connection creates the upload, sends the zip in successive
+    PATCHes and, if it gets cut, asks with HEAD where it was and carries on
+    from there. Once complete, POST /docker/ takes its `upload_id` and the
+    deploy uses the already extracted folder, with nothing uploaded again.
+
+    The extractor's state lives in memory: if the API restarts midway, the
+    upload is lost (HEAD gives 404) and the client starts again.
+    """
+
+    def __init__(self):
+        self.uploads: Dict[str, Upload] = {}
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    # Descarta las subidas que llevan demasiado sin recibir nada
+    # Drop the uploads that have not received anything for too long
+    async def _expire(self):
+        for upload in self.expired():
+            await asyncio.to_thread(self.discard, upload)
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    @staticmethod
+    def discard(upload: Upload):
+        """
+        Borra lo que había extraído una subida que ya no está en la lista.
+        Delete what an upload no longer on the list had extracted.
+        """
+        if upload.result is None:
+            upload.extractor.abort()
+        else:
+            shutil.rmtree(upload.staged, ignore_errors=True)
+            members_path(upload.staged).unlink(missing_ok=True)
+
+    def expired(self) -> List[Upload]:
+        """
+        Saca de la lista las subidas que llevan más de UPLOAD_EXPIRES sin
+        recibir nada (no las que están recibiendo ahora) y las devuelve
+        para borrarlas con discard. Solo desde el event loop.
+
+        Take off the list the uploads that have received nothing for more
+        than UPLOAD_EXPIRES (not the ones receiving right now) and return
+        them to be deleted with discard. Only from the event loop.
+        """
+        now = time.time()
+        found = [u for u in self.uploads.values() if u.expires_at < now and not u.lock.locked()]
+        for upload in found:
+            del self.uploads[upload.id]
+            print(f"[Docker] Subida {upload.id} de {upload.Webname} caducada")
+        return found
+
+    async def create(self, userid: str, Webname: str, length: int, filename: Optional[str]) -> Upload:
+        if length <= 0:
+            raise UploadError("Upload-Length tiene que ser mayor que 0")
+        if length > UPLOAD_MAX_BYTES:
+            raise UploadError(f"El zip supera el máximo ({UPLOAD_MAX_BYTES} bytes)")
+        if filename and not filename.lower().endswith(".zip"):
+            raise UploadError("Solo se aceptan archivos .zip")
+        await self._expire()
+        if sum(u.userid == userid for u in self.uploads.values()) >= UPLOAD_MAX_PER_USER:
+            raise UploadConflict(f"Demasiadas subidas abiertas (máximo {UPLOAD_MAX_PER_USER})")
+        upload = await asyncio.to_thread(Upload, userid, Webname, length, filename)
+        self.uploads[upload.id] = upload
+        return upload
+
+    def get(self, upload_id: str) -> Optional[Upload]:
+        upload = self.uploads.get(upload_id)
+        if upload is None or upload.expires_at < time.time():
+            return None
+        return upload
+
+    async def write(self, upload: Upload, offset: int, chunks: AsyncIterator[bytes]) -> Upload:
+        """
+        Añade lo que llegue del cuerpo de un PATCH. Si el cliente se corta,
+        lo recibido hasta entonces ya está extraído y cuenta en el offset.
+
+        Append whatever arrives in a PATCH body. If the client drops, what
+        was received until then is already extracted and counts in the
+        offset.
+        """
+        if upload.lock.locked():
+            raise UploadLocked("La subida está recibiendo otro PATCH")
+        async with upload.lock:
+            if offset != upload.offset:
+                raise UploadConflict(f"Upload-Offset {offset} no coincide con {upload.offset}")
+            if upload.result is not None:
+                raise UploadConflict("La subida ya está completa")
+            try:
+                async for chunk in chunks:
+                    if upload.offset + len(chunk) > upload.length:
+                        raise UploadError("El cuerpo supera Upload-Length")
+                    await asyncio.to_thread(upload.feed, chunk)
+                    upload.touched_at = time.time()
+                if upload.offset == upload.length:
+                    await asyncio.to_thread(upload.finish)
+            except (UploadError, ZipStreamError):
+                # Un zip roto no se arregla reanudando | A broken zip is not fixed by resuming
+                self.uploads.pop(upload.id, None)
+                await asyncio.to_thread(upload.extractor.abort)
+                raise
+        return upload
+
+    def take(self, upload_id: str, userid: str, Webname: str) -> Dict[str, Any]:
+        """
+        Entrega una subida completa al despliegue (deja de ser de la
+        subida: quien la recibe se encarga de la carpeta).
+
+        Hand a complete upload over to the deploy (it no longer belongs to
+        the upload: the receiver owns the folder).
+        """
+        upload = self.get(upload_id)
+        if upload is None:
+            raise KeyError(upload_id)
+        if (upload.userid, upload.Webname) != (userid, Webname):
+            raise UploadError("La subida es de otro proyecto")
+        if upload.result is None or upload.lock.locked():
+            raise UploadConflict(f"Subida incompleta ({upload.offset} de {upload.length} bytes)")
+        del self.uploads[upload_id]
+        return upload.result
+
+    async def terminate(self, upload_id: str) -> bool:
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return False
+        if upload.lock.locked():
+            raise UploadLocked("La subida está recibiendo otro PATCH")
+        del self.uploads[upload_id]
+        await asyncio.to_thread(self.discard, upload)
+        return True
+
+    def options(self) -> Dict[str, str]:
+        return {
+            "Tus-Resumable": TUS_VERSION,
+            "Tus-Version": TUS_VERSION,
+            "Tus-Extension": TUS_EXTENSIONS,
+            "Tus-Max-Size": str(UPLOAD_MAX_BYTES),
+        }
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "open": len(self.uploads),
+            "receiving": sum(u.lock.locked() for u in self.uploads.values()),
+            "bytes": sum(u.offset for u in self.uploads.values()),
+        }
+
+
+# Helper singleton compartido por la API | Helper singleton shared by the API
+uploads = UploadManager()
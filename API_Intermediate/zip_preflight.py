@@ -0,0 +1,146 @@
+# zip_preflight.py
+import os
+import zipfile
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from zip_stream import (
+    ZIP_MAX_DEPTH,
+    ZIP_MAX_ENTRIES,
+    ZIP_MAX_RATIO,
+    ZIP_MAX_TOTAL_BYTES,
+    ZIP_PARALLEL_MAX_BYTES,
+    ZIP_PARALLEL_MIN_BYTES,
+    ZIP_RATIO_MIN_BYTES,
+    ZipStreamError,
+)
+
+# Zips que descomprimidos pasan de aquí se encolan con prioridad baja
+# Zips larger than this once uncompressed are queued at low priority
+ZIP_LOW_PRIORITY_BYTES = int(os.getenv("ZIP_LOW_PRIORITY_BYTES", str(256 * 1024 * 1024)))
+# Miembros que se descomprimen en el pool a partir de los cuales compensa
+# Members inflated on the pool from which it pays off
+ZIP_PARALLEL_MIN_MEMBERS = int(os.getenv("ZIP_PARALLEL_MIN_MEMBERS", "2"))
+
+# Lo mínimo que ocupa una cabecera local | The smallest a local header can be
+_LOCAL_HEADER_LEN = 30
+
+
+class QuotaExceeded(ZipStreamError):
+    """El zip no cabe en la cuota del usuario | The zip does not fit the user's quota"""
+
+
+def summarize(infos: List[zipfile.ZipInfo]) -> Dict[str, Any]:
+    """
+    Números de un zip sacados de su directorio central: entradas, tamaños,
+    compresión, anidamiento y lo que delata un zip mal formado o hostil.
+
+    A zip's figures taken from its central directory: entries, sizes,
+    compression, nesting and whatever gives away a malformed or hostile
+    zip.
+    """
+    files = [info for info in infos if not info.is_dir()]
+    worst, max_ratio = None, 0.0
+    for info in files:
+        if info.file_size >= ZIP_RATIO_MIN_BYTES:
+            ratio = info.file_size / max(info.compress_size, 1)
+            if ratio > max_ratio:
+                worst, max_ratio = info.filename, ratio
+    # Entradas cuyos datos se pisan: el truco de las zip bombs sin
+    # recursión, que reusan los mismos bytes comprimidos muchas veces
+    # Entries whose data overlap: the trick of non-recursive zip bombs,
+    # which reuse the same compressed bytes many times
+    ordered = sorted(infos, key=lambda info: info.header_offset)
+    overlapping = any(
+        a.header_offset + _LOCAL_HEADER_LEN + a.compress_size > b.header_offset
+        for a, b in zip(ordered, ordered[1:])
+    )
+    total = sum(info.file_size for info in files)
+    compressed = sum(info.compress_size for info in files)
+    return {
+        "entries": len(infos),
+        "files": len(files),
+        "bytes": total,
+        "compressed": compressed,
+        "ratio": round(total / max(compressed, 1), 1),
+        "max_ratio": round(max_ratio, 1),
+        "worst": worst,
+        "largest": max((info.file_size for info in files), default=0),
+        "depth": max((info.filename.rstrip("/").count("/") + 1 for info in infos), default=0),
+        "parallel_members": sum(
+            info.compress_type == zipfile.ZIP_DEFLATED
+            and ZIP_PARALLEL_MIN_BYTES <= info.compress_size <= ZIP_PARALLEL_MAX_BYTES
+            for info in files
+        ),
+        "encrypted": any(info.flag_bits & 0x01 for info in infos),
+        "methods": sorted({info.compress_type for info in files}),
+        "overlapping": overlapping,
+    }
+
+
+def analyze(fp: BinaryIO) -> Dict[str, Any]:
+    """
+    Lee solo el directorio central (al final del fichero) y lo resume;
+    el fichero se deja al principio para extraerlo después.
+
+    Read only the central directory (at the end of the file) and summarize
+    it; the file is left at the start to be extracted afterwards.
+    """
+    try:
+        with zipfile.ZipFile(fp) as zf:
+            return summarize(zf.infolist())
+    except (zipfile.BadZipFile, EOFError, ValueError) as exc:
+        raise ZipStreamError(f"No es un zip válido ({exc})")
+    finally:
+        fp.seek(0)
+
+
+def plan(report: Dict[str, Any], quota_left: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Decide qué hacer con un zip antes de gastar nada en él: lanza
+    ZipStreamError (o QuotaExceeded) si hay que rechazarlo y si no dice si
+    va con prioridad baja y si se descomprime en paralelo.
+
+    Decide what to do with a zip before spending anything on it: raises
+    ZipStreamError (or QuotaExceeded) if it has to be rejected, otherwise
+    says whether it goes at low priority and whether it is inflated in
+    parallel.
+    """
+    if report["encrypted"]:
+        raise ZipStreamError("No se admiten zips cifrados")
+    unsupported = set(report["methods"]) - {zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED}
+    if unsupported:
+        raise ZipStreamError(f"Método de compresión {min(unsupported)} no soportado")
+    if report["overlapping"]:
+        raise ZipStreamError("Entradas solapadas en el zip (posible zip bomb)")
+    if report["entries"] > ZIP_MAX_ENTRIES:
+        raise ZipStreamError(f"El zip tiene más de {ZIP_MAX_ENTRIES} entradas")
+    if report["depth"] > ZIP_MAX_DEPTH:
+        raise ZipStreamError(f"Demasiadas carpetas anidadas ({report['depth']})")
+    if report["max_ratio"] > ZIP_MAX_RATIO:
+        raise ZipStreamError(
+            f"Compresión sospechosa en {report['worst']} ({report['max_ratio']:.0f}:1, posible zip bomb)"
+        )
+    if report["bytes"] > ZIP_MAX_TOTAL_BYTES:
+        raise ZipStreamError(f"El zip descomprimido supera {ZIP_MAX_TOTAL_BYTES} bytes")
+    if quota_left is not None and report["bytes"] > quota_left:
+        raise QuotaExceeded(
+            f"El zip descomprimido ({report['bytes']} bytes) no cabe en la cuota "
+            f"(quedan {max(quota_left, 0)} bytes)"
+        )
+    return {
+        "low_priority": report["bytes"] > ZIP_LOW_PRIORITY_BYTES,
+        "parallel": report["parallel_members"] >= ZIP_PARALLEL_MIN_MEMBERS,
+    }
+
+
+def stream_limit(quota_left: Optional[int]) -> int:
+    """
+    Límite de bytes para un zip que se extrae en streaming, cuyo directorio
+    central llega al final: el máximo de siempre o lo que quede de cuota.
+
+    Byte limit for a zip extracted while streaming, whose central directory
+    arrives last: the usual maximum or what is left of the quota.
+    """
+    if quota_left is None:
+        return ZIP_MAX_TOTAL_BYTES
+    return max(min(ZIP_MAX_TOTAL_BYTES, quota_left), 0)
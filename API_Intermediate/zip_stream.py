@@ -0,0 +1,443 @@
+# zip_stream.py
+import os
+import hashlib
+import pathlib
+import shutil
+import struct
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from content_store import ContentStore
+
+# Límites de un zip subido | Limits of an uploaded zip
+ZIP_MAX_TOTAL_BYTES = int(os.getenv("ZIP_MAX_TOTAL_BYTES", str(1024 * 1024 * 1024)))
+ZIP_MAX_ENTRIES = int(os.getenv("ZIP_MAX_ENTRIES", "20000"))
+# Carpetas anidadas como máximo | Maximum nested folders
+ZIP_MAX_DEPTH = int(os.getenv("ZIP_MAX_DEPTH", "32"))
+# Compresión máxima (descomprimido:comprimido) de un miembro de al menos
+# ZIP_RATIO_MIN_BYTES; más que eso huele a zip bomb
+# Maximum compression (uncompressed:compressed) of a member of at least
+# ZIP_RATIO_MIN_BYTES; more than that smells like a zip bomb
+ZIP_MAX_RATIO = float(os.getenv("ZIP_MAX_RATIO", "200"))
+ZIP_RATIO_MIN_BYTES = int(os.getenv("ZIP_RATIO_MIN_BYTES", str(1024 * 1024)))
+# Miembros comprimidos a partir de este tamaño se descomprimen en el pool
+# (y hasta ZIP_PARALLEL_MAX_BYTES, que es lo que se guarda en memoria)
+# Compressed members from this size on are inflated on the pool
+# (up to ZIP_PARALLEL_MAX_BYTES, which is what is buffered in memory)
+ZIP_PARALLEL_MIN_BYTES = int(os.getenv("ZIP_PARALLEL_MIN_BYTES", str(4 * 1024 * 1024)))
+ZIP_PARALLEL_MAX_BYTES = int(os.getenv("ZIP_PARALLEL_MAX_BYTES", str(64 * 1024 * 1024)))
+ZIP_PARALLEL_WORKERS = int(os.getenv("ZIP_PARALLEL_WORKERS", "4"))
+
+# Trozo máximo que se descomprime de una vez (defensa contra zip bombs)
+# Largest piece inflated at once (defence against zip bombs)
+_OUT_CHUNK = 1024 * 1024
+
+_LOCAL_HEADER = 0x04034B50
+_CENTRAL_HEADER = 0x02014B50
+_END_OF_CENTRAL = 0x06054B50
+_DATA_DESCRIPTOR = 0x08074B50
+
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+class ZipStreamError(ValueError):
+    """El zip no es válido o supera los límites | Invalid zip or over the limits"""
+
+
+def _parallel_pool() -> Optional[ThreadPoolExecutor]:
+    global _pool
+    if ZIP_PARALLEL_WORKERS <= 0:
+        return None
+    if _pool is None:
+        _pool = ThreadPoolExecutor(
+            max_workers=ZIP_PARALLEL_WORKERS, thread_name_prefix="zip-inflate"
+        )
+    return _pool
+
+
+class _Member:
+    def __init__(self, name: str, flags: int, method: int, crc: int, csize: int, usize: int):
+        self.name = name
+        self.flags = flags
+        self.method = method
+        self.crc = crc
+        self.csize = csize
+        self.usize = usize
+        self.has_descriptor = bool(flags & 0x08)
+        self.consumed = 0
+        self.written = 0
+        self.crc_running = 0
+        self.inflater = zlib.decompressobj(-15) if method == 8 else None
+        self.path: Optional[pathlib.Path] = None
+        self.out: Optional[BinaryIO] = None
+        self.buffer: Optional[bytearray] = None
+        # sha256 del contenido, si va al almacén | content sha256, if it goes to the store
+        self.hasher = None
+        # Igual que el que ya hay en disco: se descarta | Same as the one on disk: discarded
+        self.skip = False
+
+
+class StreamingZipExtractor:
+    """
+    Descomprime un zip a medida que llegan sus bytes, leyendo las cabeceras
+    locales en vez del directorio central (que está al final). Cada nombre
+    se valida contra path traversal antes de escribir nada y se aplican
+    los límites de tamaño total, número de entradas, anidamiento y
+    compresión (la declarada en cada cabecera).
+
+    Extract a zip while its bytes arrive, reading the local headers instead
+    of the central directory (which sits at the end). Every name is checked
+    for path traversal before anything is written, and the total size,
+    entry count, nesting and compression (as declared in each header)
+    limits are enforced.
+
+    Con un `store`, cada fichero se hashea mientras se escribe y se
+    deduplica contra el almacén nada más terminarlo.
+    With a `store`, every file is hashed while it is written and
+    deduplicated against the store as soon as it is finished.
+
+    Con `skip(nombre, crc, tamaño)` los miembros que ya están en disco tal
+    cual no se escriben; `members` guarda el CRC y tamaño de todos.
+    With `skip(name, crc, size)` members already on disk as they are are
+    not written; `members` keeps the CRC and size of all of them.
+
+    `digests` guarda el sha256 de los que pasaron por el almacén.
+    `digests` keeps the sha256 of the ones that went through the store.
+    """
+
+    def __init__(
+        self,
+        dest: pathlib.Path,
+        max_total_bytes: int = ZIP_MAX_TOTAL_BYTES,
+        max_entries: int = ZIP_MAX_ENTRIES,
+        parallel: bool = True,
+        store: Optional[ContentStore] = None,
+        skip: Optional[Callable[[str, int, int], bool]] = None,
+    ):
+        self.dest = dest
+        self.skip = skip
+        self.members: Dict[str, Tuple[int, int]] = {}
+        self.skipped = 0
+        self.skipped_bytes = 0
+        self.store = store if store is not None and store.enabled else None
+        self.deduplicated = 0
+        self.digests: Dict[str, str] = {}
+        self._dedup_lock = threading.Lock()
+        self.max_total_bytes = max_total_bytes
+        self.max_entries = max_entries
+        self.executor = _parallel_pool() if parallel else None
+        self.entries = 0
+        self.total_bytes = 0
+        self.received = 0
+        self.finished = False
+        self._buf = bytearray()
+        self._member: Optional[_Member] = None
+        self._futures: List[Future] = []
+        self._root = str(dest.resolve())
+        dest.mkdir(parents=True, exist_ok=True)
+
+    # ---------- utilidades internas ----------
+    # ---------- internal utilities ----------
+
+    def _target(self, name: str) -> pathlib.Path:
+        if name.startswith("/") or ".." in name.split("/"):
+            raise ZipStreamError(f"Zip traversal detected! ({name})")
+        path = self.dest / name
+        resolved = str(path.resolve())
+        if resolved != self._root and not resolved.startswith(self._root + os.sep):
+            raise ZipStreamError(f"Zip traversal detected! ({name})")
+        return path
+
+    def _count(self, nbytes: int):
+        self.total_bytes += nbytes
+        if self.total_bytes > self.max_total_bytes:
+            raise ZipStreamError(
+                f"El zip descomprimido supera {self.max_total_bytes} bytes"
+            )
+
+    def _parse_header(self) -> bool:
+        if len(self._buf) < 4:
+            return False
+        (sig,) = struct.unpack_from("<I", self._buf)
+        if sig in (_CENTRAL_HEADER, _END_OF_CENTRAL):
+            # Ya no quedan ficheros, el resto es el directorio central
+            # No files left, the rest is the central directory
+            self.finished = True
+            self._buf.clear()
+            return False
+        if sig != _LOCAL_HEADER:
+            raise ZipStreamError("No es un zip válido (cabecera local esperada)")
+        if len(self._buf) < 30:
+            return False
+        (_, _, flags, method, _, _, crc, csize, usize, name_len, extra_len) = struct.unpack_from(
+            "<IHHHHHIIIHH", self._buf
+        )
+        header_len = 30 + name_len + extra_len
+        if len(self._buf) < header_len:
+            return False
+        raw_name = bytes(self._buf[30:30 + name_len])
+        extra = bytes(self._buf[30 + name_len:header_len])
+        del self._buf[:header_len]
+
+        if flags & 0x01:
+            raise ZipStreamError("No se admiten zips cifrados")
+        name = raw_name.decode("utf-8" if flags & 0x800 else "cp437").replace("\\", "/")
+        if csize == 0xFFFFFFFF or usize == 0xFFFFFFFF:
+            usize, csize = self._zip64_sizes(extra, usize, csize)
+
+        self.entries += 1
+        if self.entries > self.max_entries:
+            raise ZipStreamError(f"El zip tiene más de {self.max_entries} entradas")
+        if name.rstrip("/").count("/") >= ZIP_MAX_DEPTH:
+            raise ZipStreamError(f"Demasiadas carpetas anidadas ({name})")
+        if not flags & 0x08 and usize >= ZIP_RATIO_MIN_BYTES and usize > csize * ZIP_MAX_RATIO:
+            raise ZipStreamError(f"Compresión sospechosa en {name} (posible zip bomb)")
+        path = self._target(name)
+        member = _Member(name, flags, method, crc, csize, usize)
+
+        if name.endswith("/"):
+            path.mkdir(parents=True, exist_ok=True)
+        elif method not in (0, 8):
+            raise ZipStreamError(f"Método de compresión {method} no soportado ({name})")
+        elif method == 0 and member.has_descriptor:
+            raise ZipStreamError(
+                f"Entrada sin comprimir y sin tamaño en cabecera ({name}); "
+                "vuelve a crear el zip con otra herramienta"
+            )
+        elif self.skip is not None and not member.has_descriptor and self.skip(name, crc, usize):
+            self._count(usize)
+            member.skip = True
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if (
+                self.executor is not None
+                and method == 8
+                and not member.has_descriptor
+                and ZIP_PARALLEL_MIN_BYTES <= csize <= ZIP_PARALLEL_MAX_BYTES
+            ):
+                # Se acumula en memoria y se descomprime en el pool
+                # Buffered in memory and inflated on the pool
+                self._count(usize)
+                member.buffer = bytearray()
+            else:
+                member.out = open(path, "wb")
+        member.path = path
+        if (
+            self.store is not None
+            and not name.endswith("/")
+            and not member.skip
+            and self.store.wants(usize)
+        ):
+            member.hasher = hashlib.sha256()
+        self._member = member
+        return True
+
+    @staticmethod
+    def _zip64_sizes(extra: bytes, usize: int, csize: int):
+        pos = 0
+        while pos + 4 <= len(extra):
+            tag, size = struct.unpack_from("<HH", extra, pos)
+            if tag == 0x0001:
+                values = list(struct.unpack_from(f"<{size // 8}Q", extra, pos + 4))
+                if usize == 0xFFFFFFFF and values:
+                    usize = values.pop(0)
+                if csize == 0xFFFFFFFF and values:
+                    csize = values.pop(0)
+                break
+            pos += 4 + size
+        return usize, csize
+
+    def _write(self, member: _Member, data: bytes):
+        if not data:
+            return
+        if member.buffer is None:
+            self._count(len(data))
+        member.written += len(data)
+        member.crc_running = zlib.crc32(data, member.crc_running)
+        if member.hasher is not None:
+            member.hasher.update(data)
+        member.out.write(data)
+
+    def _inflate(self, member: _Member, data: bytes):
+        inflater = member.inflater
+        out = inflater.decompress(data, _OUT_CHUNK)
+        self._write(member, out)
+        while inflater.unconsumed_tail and not inflater.eof:
+            out = inflater.decompress(inflater.unconsumed_tail, _OUT_CHUNK)
+            self._write(member, out)
+
+    # Consume datos del miembro actual; devuelve False si faltan bytes
+    # Consume data of the current member; returns False when bytes are missing
+    def _parse_body(self) -> bool:
+        member = self._member
+        if member.name.endswith("/") or member.skip:
+            # Las carpetas no tienen contenido útil y los ficheros saltados
+            # ya están en disco: se descarta
+            # Folders carry no useful content and skipped files are already
+            # on disk: discard it
+            if member.has_descriptor:
+                return self._parse_descriptor()
+            skip = min(len(self._buf), member.csize - member.consumed)
+            del self._buf[:skip]
+            member.consumed += skip
+            if member.consumed < member.csize:
+                return False
+            return self._finish_member()
+
+        if member.has_descriptor:
+            # Deflate sin tamaño conocido: se termina cuando acaba el stream
+            # Deflate with unknown size: it ends when the stream does
+            if not member.inflater.eof:
+                data = bytes(self._buf)
+                self._buf.clear()
+                self._inflate(member, data)
+                if not member.inflater.eof:
+                    return False
+                self._buf[:0] = member.inflater.unused_data
+            return self._parse_descriptor()
+
+        remaining = member.csize - member.consumed
+        take = bytes(self._buf[:remaining])
+        del self._buf[:len(take)]
+        member.consumed += len(take)
+        if member.buffer is not None:
+            member.buffer += take
+        elif member.method == 8:
+            self._inflate(member, take)
+        else:
+            self._write(member, take)
+        if member.consumed < member.csize:
+            return False
+        return self._finish_member()
+
+    def _parse_descriptor(self) -> bool:
+        member = self._member
+        zip64 = member.csize == 0xFFFFFFFF or member.usize == 0xFFFFFFFF
+        size_len = 16 if zip64 else 8
+        if len(self._buf) < 4:
+            return False
+        has_sig = struct.unpack_from("<I", self._buf)[0] == _DATA_DESCRIPTOR
+        need = (4 if has_sig else 0) + 4 + size_len
+        if len(self._buf) < need:
+            return False
+        offset = 4 if has_sig else 0
+        (member.crc,) = struct.unpack_from("<I", self._buf, offset)
+        fmt = "<QQ" if zip64 else "<II"
+        member.csize, member.usize = struct.unpack_from(fmt, self._buf, offset + 4)
+        del self._buf[:need]
+        return self._finish_member()
+
+    def _finish_member(self) -> bool:
+        member = self._member
+        self._member = None
+        if member.name.endswith("/"):
+            return True
+        self.members[member.name] = (member.crc, member.usize)
+        if member.skip:
+            self.skipped += 1
+            self.skipped_bytes += member.usize
+            return True
+        if member.buffer is not None:
+            self._submit_parallel(member)
+            return True
+        if member.out is not None:
+            member.out.close()
+            self._check_crc(member)
+            self._deduplicate(member)
+        return True
+
+    def _deduplicate(self, member: _Member):
+        if member.hasher is None:
+            return
+        digest = member.hasher.hexdigest()
+        saved = self.store.adopt(member.path, digest, member.written)
+        with self._dedup_lock:
+            self.deduplicated += saved
+            self.digests[member.name] = digest
+
+    @staticmethod
+    def _check_crc(member: _Member):
+        if member.written != member.usize or member.crc_running != member.crc:
+            raise ZipStreamError(f"CRC o tamaño incorrecto en {member.name}")
+
+    def _submit_parallel(self, member: _Member):
+        # No más de un lote por worker en vuelo, para acotar la memoria
+        # At most one batch per worker in flight, to bound memory
+        while len(self._futures) >= ZIP_PARALLEL_WORKERS:
+            done, pending = wait(self._futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+            self._futures = list(pending)
+        self._futures.append(self.executor.submit(self._inflate_buffered, member))
+
+    def _inflate_buffered(self, member: _Member):
+        data = bytes(member.buffer)
+        member.buffer = None
+        inflater = member.inflater
+        with open(member.path, "wb") as out:
+            chunk = inflater.decompress(data, _OUT_CHUNK)
+            while True:
+                member.written += len(chunk)
+                if member.written > member.usize:
+                    raise ZipStreamError(f"{member.name} es mayor de lo declarado")
+                member.crc_running = zlib.crc32(chunk, member.crc_running)
+                if member.hasher is not None:
+                    member.hasher.update(chunk)
+                out.write(chunk)
+                if inflater.eof or not inflater.unconsumed_tail:
+                    break
+                chunk = inflater.decompress(inflater.unconsumed_tail, _OUT_CHUNK)
+        self._check_crc(member)
+        self._deduplicate(member)
+
+    # ---------- casos públicos ----------
+    # ---------- public cases ----------
+
+    def feed(self, chunk: bytes):
+        """
+        Procesa el siguiente trozo del zip. Bloqueante (escribe a disco).
+        Process the next piece of the zip. Blocking (writes to disk).
+        """
+        self.received += len(chunk)
+        if self.finished:
+            return
+        self._buf += chunk
+        while not self.finished:
+            if self._member is None:
+                if not self._parse_header():
+                    break
+            elif not self._parse_body():
+                break
+
+    def feed_file(self, fp: BinaryIO, chunk_size: int = 1024 * 1024):
+        while chunk := fp.read(chunk_size):
+            self.feed(chunk)
+
+    def close(self) -> Dict[str, int]:
+        """
+        Termina la extracción y espera a los miembros en el pool.
+        Finish the extraction and wait for the members on the pool.
+        """
+        for future in self._futures:
+            future.result()
+        self._futures = []
+        if self._member is not None or not self.finished:
+            self.abort()
+            raise ZipStreamError("El zip está incompleto")
+        return {
+            "entries": self.entries,
+            "bytes": self.total_bytes,
+            "received": self.received,
+            "deduplicated": self.deduplicated,
+            "skipped": self.skipped,
+            "skipped_bytes": self.skipped_bytes,
+        }
+
+    def abort(self):
+        if self._member is not None and self._member.out is not None:
+            self._member.out.close()
+        for future in self._futures:
+            future.cancel()
+        shutil.rmtree(self.dest, ignore_errors=True)
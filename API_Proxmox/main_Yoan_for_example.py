@@ -71,6 +71,44 @@ def create_vm_and_start(proxmox, node, template_id, vm_id, vm_name, disksize, co
     create_vm(proxmox, node, vm_id, disksize, cores, memory)
     start_vm(proxmox, node, vm_id)
     print(f"VM {vm_id} créée et démarrée avec succès.")
+
+# 5. Réserver un VMID
+# Reparto de VMIDs de este proceso: nextid con una reserva local, para que
+# dos peticiones a la vez no reciban el mismo antes de que exista la VM.
+# Solo vale dentro de este proceso (la API intermedia tiene el suyo)
+# VMID allocation for this process: nextid with a local reservation, so
+# two simultaneous requests do not get the same one before the VM exists.
+# It only holds inside this process (the intermediate API has its own)
+reserved_vmids = set()
+vmid_lock = asyncio.Lock()
+
+def vmid_is_free(proxmox, vm_id):
+    try:
+        # Con `vmid`, nextid solo responde si ese id está libre
+        # With `vmid`, nextid only answers if that id is free
+        proxmox.cluster.nextid.get(vmid=vm_id)
+        return True
+    except Exception:
+        return False
+
+async def allocate_vmid(proxmox):
+    async with vmid_lock:
+        first = int(await asyncio.to_thread(proxmox.cluster.nextid.get))
+        vm_id = first
+        while vm_id in reserved_vmids or (
+            vm_id != first and not await asyncio.to_thread(vmid_is_free, proxmox, vm_id)
+        ):
+            vm_id += 1
+        reserved_vmids.add(vm_id)
+        return vm_id
+
+# Igual que create_vm_and_start, pero suelta la reserva al acabar
+# Same as create_vm_and_start, but drops the reservation at the end
+def create_vm_and_release(proxmox, node, template_id, vm_id, vm_name, disksize, cores, memory):
+    try:
+        create_vm_and_start(proxmox, node, template_id, vm_id, vm_name, disksize, cores, memory)
+    finally:
+        reserved_vmids.discard(vm_id)
     
 #====End Functions====
 
@@ -167,7 +205,14 @@ async def create_proxmox(
     proxmox_items.append(proxmox_item)
     background_tasks.add_task(process_proxmox_request, proxmox_item.dict())
     
-    create_vm_and_start(proxmox, "sv1", os, "random number???", userid, disksize, cores, memory)
+    # En segundo plano (hilo de Starlette) para no congelar el event loop;
+    # la versión completa y asíncrona está en API_Intermediate/proxmox_manager.py
+    # In the background (Starlette thread) so the event loop is not frozen;
+    # the full async version lives in API_Intermediate/proxmox_manager.py
+    vm_id = await allocate_vmid(proxmox)
+    background_tasks.add_task(
+        create_vm_and_release, proxmox, "sv1", os, vm_id, userid, disksize, cores, memory
+    )
     
     return {
         "status": "processing",
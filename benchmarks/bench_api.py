@@ -0,0 +1,296 @@
+# bench_api.py
+"""
+Prueba de carga de la API intermedia: levanta main.app con uvicorn contra
+un daemon Docker y un Proxmox de mentira (con latencia simulada) y lanza
+a la vez peticiones POST /docker/ con zips realistas y POST /proxmox/.
+Mide peticiones por segundo, latencia de despliegue p50/p95/p99 (desde el
+POST hasta que el trabajo termina) y el pico de RSS, y guarda el resultado
+en benchmarks/results/ para comparar ejecuciones.
+
+Load test for the intermediate API: runs main.app under uvicorn against a
+stand-in Docker daemon and Proxmox (with simulated latency) and fires
+POST /docker/ requests with realistic zips and POST /proxmox/ at the same
+time. Measures requests per second, p50/p95/p99 deploy latency (from the
+POST until the job finishes) and peak RSS, and stores the result in
+benchmarks/results/ so runs can be compared.
+
+    python benchmarks/bench_api.py --docker 100 --proxmox 20 --label baseline
+    python benchmarks/bench_api.py --label change --compare benchmarks/results/<baseline>.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import pathlib
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+HERE = pathlib.Path(__file__).resolve().parent
+RESULTS_DIR = HERE / "results"
+sys.path.insert(0, str(HERE.parent / "API_Intermediate"))
+sys.path.insert(0, str(HERE))
+
+from fake_docker_daemon import FakeDockerDaemon  # noqa: E402
+from fake_proxmox import FakeProxmox  # noqa: E402
+
+FINISHED = ("done", "error")
+
+
+# No se importa de bench_async_docker: eso cargaría async_docker antes de
+# que main() apunte DOCKER_HOST al daemon de mentira
+# Not imported from bench_async_docker: that would load async_docker before
+# main() points DOCKER_HOST at the stand-in daemon
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+# ---------- carga | workload ----------
+
+def build_site_zip(files: int, size_kb: int, seed: int = 0) -> bytes:
+    """
+    Zip parecido al de un alumno: HTML/CSS/JS (comprimibles) y alguna
+    imagen (aleatoria, no se comprime), repartidos en carpetas.
+
+    Zip resembling a student's: HTML/CSS/JS (compressible) and some images
+    (random, incompressible), spread across folders.
+    """
+    rnd = random.Random(seed)
+    per_file = max(1, size_kb * 1024 // max(files, 1))
+    text = ("<div class='card'><p>Lorem ipsum dolor sit amet</p></div>\n" * 64).encode()
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("index.html", text[:per_file])
+        for i in range(1, files):
+            kind = i % 5
+            if kind == 0:
+                zf.writestr(f"img/foto{i}.jpg", rnd.randbytes(per_file), zipfile.ZIP_STORED)
+            elif kind == 1:
+                zf.writestr(f"css/estilo{i}.css", (b"body{margin:0}\n" * per_file)[:per_file])
+            elif kind == 2:
+                zf.writestr(f"js/app{i}.js", (b"console.log(1);\n" * per_file)[:per_file])
+            else:
+                zf.writestr(f"pages/p{i}.html", (text * (per_file // len(text) + 1))[:per_file])
+    return buf.getvalue()
+
+
+async def wait_job(client, job_id: str, poll: float) -> str:
+    while True:
+        job = (await client.get(f"/jobs/{job_id}")).json()
+        if job["status"] in FINISHED:
+            return job["status"]
+        await asyncio.sleep(poll)
+
+
+async def one_docker(client, gate, i: int, payload: bytes, poll: float, out: dict):
+    async with gate:
+        started = time.perf_counter()
+        r = await client.post(
+            "/docker/",
+            data={"userid": f"alumno{i}", "Webtype": "Estatico", "Webname": f"web{i}"},
+            files={"userfile": (f"web{i}.zip", payload, "application/zip")},
+        )
+        out["accept"].append(time.perf_counter() - started)
+    if r.status_code != 200:
+        out["rejected"] += 1
+        return
+    status = await wait_job(client, r.json()["job_id"], poll)
+    out["latency"].append(time.perf_counter() - started)
+    out["errors"] += status == "error"
+
+
+async def one_proxmox(client, gate, i: int, poll: float, out: dict):
+    async with gate:
+        started = time.perf_counter()
+        r = await client.post("/proxmox/", data={
+            "userid": f"alumno{i}", "upassword": "bench", "os": "Ubuntu 24 Server LTS",
+            "disksize": 20, "memory": 2048, "cores": 2,
+        })
+        out["accept"].append(time.perf_counter() - started)
+    if r.status_code != 200:
+        out["rejected"] += 1
+        return
+    status = await wait_job(client, r.json()["job_id"], poll)
+    out["latency"].append(time.perf_counter() - started)
+    out["errors"] += status == "error"
+
+
+def summarize(out: dict, elapsed: float) -> dict:
+    lat, acc = out["latency"], out["accept"]
+    if not acc:
+        return {}
+    return {
+        "requests": len(acc),
+        "rejected": out["rejected"],
+        "errors": out["errors"],
+        "accept_rps": round(len(acc) / out["accept_window"], 2),
+        "deploys_per_s": round(len(lat) / elapsed, 2) if lat else 0.0,
+        "accept_p50_ms": round(percentile(acc, 50) * 1000, 1),
+        "accept_p99_ms": round(percentile(acc, 99) * 1000, 1),
+        "p50_s": round(percentile(lat, 50), 3) if lat else None,
+        "p95_s": round(percentile(lat, 95), 3) if lat else None,
+        "p99_s": round(percentile(lat, 99), 3) if lat else None,
+    }
+
+
+async def drive(base_url: str, args) -> dict:
+    import httpx
+
+    payload = build_site_zip(args.zip_files, args.zip_kb)
+    gate = asyncio.Semaphore(args.concurrency)
+    docker_out = {"accept": [], "latency": [], "rejected": 0, "errors": 0}
+    proxmox_out = {"accept": [], "latency": [], "rejected": 0, "errors": 0}
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        started = time.perf_counter()
+        tasks = [one_docker(client, gate, i, payload, args.poll, docker_out) for i in range(args.docker)]
+        tasks += [one_proxmox(client, gate, i, args.poll, proxmox_out) for i in range(args.proxmox)]
+        random.Random(1).shuffle(tasks)
+
+        async def watch_accepts():
+            total = args.docker + args.proxmox
+            while len(docker_out["accept"]) + len(proxmox_out["accept"]) < total:
+                await asyncio.sleep(0.01)
+            docker_out["accept_window"] = proxmox_out["accept_window"] = time.perf_counter() - started
+
+        await asyncio.gather(watch_accepts(), *tasks)
+        elapsed = time.perf_counter() - started
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "zip_bytes": len(payload),
+        "docker": summarize(docker_out, elapsed),
+        "proxmox": summarize(proxmox_out, elapsed),
+    }
+
+
+# ---------- entorno | environment ----------
+
+def start_server(app, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss va en KiB en Linux y en bytes en macOS
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def print_result(result: dict):
+    print(f"{result['label']} @ {result['git']}  ({result['elapsed_s']} s, zip {result['zip_bytes'] // 1024} KiB)")
+    for kind in ("docker", "proxmox"):
+        stats = result[kind]
+        if not stats:
+            continue
+        print(
+            f"  {kind:<8} {stats['requests']:>5} req  {stats['accept_rps']:>8.1f} req/s  "
+            f"{stats['deploys_per_s']:>7.2f} deploys/s  "
+            f"p50 {stats['p50_s']}s  p95 {stats['p95_s']}s  p99 {stats['p99_s']}s  "
+            f"errors {stats['errors']}  rejected {stats['rejected']}"
+        )
+    print(f"  peak RSS {result['peak_rss_mb']} MiB")
+
+
+def compare(old: dict, new: dict):
+    print(f"\n{'metric':<24} {old['label']:>12} {new['label']:>12}   delta")
+    rows = [("peak_rss_mb", old.get("peak_rss_mb"), new.get("peak_rss_mb"))]
+    for kind in ("docker", "proxmox"):
+        for key in ("accept_rps", "deploys_per_s", "p50_s", "p95_s", "p99_s"):
+            rows.append((f"{kind}.{key}", old.get(kind, {}).get(key), new.get(kind, {}).get(key)))
+    for name, a, b in rows:
+        if a is None or b is None:
+            continue
+        delta = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+        print(f"{name:<24} {a:>12} {b:>12}   {delta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--docker", type=int, default=50, help="POST /docker/ requests")
+    parser.add_argument("--proxmox", type=int, default=10, help="POST /proxmox/ requests")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight at once")
+    parser.add_argument("--zip-files", type=int, default=200)
+    parser.add_argument("--zip-kb", type=int, default=4096, help="uncompressed size of the site")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per Docker daemon call")
+    parser.add_argument("--run-latency", type=float, default=0.3, help="seconds per one-shot container")
+    parser.add_argument("--pve-latency", type=float, default=0.02, help="seconds per Proxmox API call")
+    parser.add_argument("--clone-time", type=float, default=5.0, help="seconds per full clone")
+    parser.add_argument("--start-time", type=float, default=1.0, help="seconds per VM start")
+    parser.add_argument("--poll", type=float, default=0.1, help="job status poll interval")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--compare", type=pathlib.Path, help="earlier result JSON to compare with")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    # El entorno tiene que estar listo antes de importar main
+    # The environment must be ready before importing main
+    work = pathlib.Path(tempfile.mkdtemp(prefix="iapi-bench-"))
+    sock = str(work / "docker.sock")
+    os.environ["DOCKER_HOST"] = f"unix://{sock}"
+    os.environ["JOB_DB_PATH"] = str(work / "jobs.db")
+    os.environ["BASE_PATH"] = str(work / "srv")
+    os.environ.setdefault("IMAGE_REFRESH_INTERVAL", "3600")
+
+    daemon = FakeDockerDaemon(sock, latency=args.latency, run_latency=args.run_latency)
+    daemon.start_in_thread()
+    import main as api
+    import proxmox_manager
+
+    proxmox_manager.proxmox_manager._api = FakeProxmox(
+        latency=args.pve_latency, full_clone_time=args.clone_time, start_time=args.start_time
+    )
+    server, thread = start_server(api.app, args.port)
+    try:
+        result = asyncio.run(drive(f"http://127.0.0.1:{args.port}", args))
+    finally:
+        server.should_exit = True
+        thread.join()
+        daemon.stop_thread()
+
+    result = {
+        "label": args.label,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "config": {k: (str(v) if isinstance(v, pathlib.Path) else v) for k, v in vars(args).items()},
+        **result,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print_result(result)
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{args.label}.json"
+        path.write_text(json.dumps(result, indent=2))
+        print(f"  guardado en / saved to {path}")
+    if args.compare:
+        compare(json.loads(args.compare.read_text()), result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# bench_async_docker.py
+"""
+Compara el cliente bloqueante de docker-py (un hilo por llamada) con el
+cliente asyncio de API_Intermediate/async_docker.py contra un daemon de
+mentira con latencia simulada. Cada operación es crear + arrancar +
+inspeccionar un contenedor.
+
+Compares the blocking docker-py client (one thread per call) with the
+asyncio client in API_Intermediate/async_docker.py against a stand-in
+daemon with simulated latency. Each operation is create + start + inspect
+of one container.
+
+    python benchmarks/bench_async_docker.py --ops 500 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "API_Intermediate"))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from async_docker import AsyncDockerClient  # noqa: E402
+from fake_docker_daemon import FakeDockerDaemon  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def report(name, latencies, elapsed):
+    print(
+        f"{name:<28} {len(latencies) / elapsed:>9.1f} ops/s   "
+        f"p50 {statistics.median(latencies) * 1000:7.1f} ms   "
+        f"p95 {percentile(latencies, 95) * 1000:7.1f} ms   "
+        f"p99 {percentile(latencies, 99) * 1000:7.1f} ms"
+    )
+
+
+def bench_docker_py(sock, ops, concurrency):
+    import docker
+
+    client = docker.APIClient(base_url=f"unix://{sock}", version="1.43")
+    latencies = []
+
+    def one(i):
+        started = time.perf_counter()
+        c = client.create_container("httpd:latest", name=f"py-{concurrency}-{i}")
+        client.start(c["Id"])
+        client.inspect_container(c["Id"])
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(ops)))
+    client.close()
+    report(f"docker-py ({concurrency} threads)", latencies, time.perf_counter() - started)
+
+
+async def bench_async(sock, ops, concurrency, pool_size):
+    client = AsyncDockerClient(f"unix://{sock}", pool_size=pool_size)
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with gate:
+            started = time.perf_counter()
+            ident = await client.create_container(f"aio-{pool_size}-{i}", {"Image": "httpd:latest"})
+            await client.start_container(ident)
+            await client.inspect_container(ident)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(ops)))
+    report(f"async (pool {pool_size})", latencies, time.perf_counter() - started)
+    print(f"{'':<28} conexiones abiertas / connections opened: {client.opened}")
+    await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--ops", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per daemon call")
+    parser.add_argument("--pool", type=int, nargs="+", default=[8, 32, 64])
+    args = parser.parse_args()
+
+    sock = os.path.join(tempfile.mkdtemp(), "docker.sock")
+    daemon = FakeDockerDaemon(sock, latency=args.latency)
+    daemon.start_in_thread()
+    try:
+        print(f"{args.ops} ops, concurrency {args.concurrency}, latency {args.latency * 1000:.0f} ms/call")
+        try:
+            bench_docker_py(sock, args.ops, args.concurrency)
+        except ImportError:
+            print("docker-py no instalado, se omite | docker-py not installed, skipped")
+        for pool_size in args.pool:
+            asyncio.run(bench_async(sock, args.ops, args.concurrency, pool_size))
+    finally:
+        daemon.stop_thread()
+
+
+if __name__ == "__main__":
+    main()
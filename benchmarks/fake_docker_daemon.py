@@ -0,0 +1,245 @@
+# fake_docker_daemon.py
+"""
+Daemon Docker de mentira para los benchmarks: habla HTTP/1.1 keep-alive
+sobre un socket unix, guarda los contenedores en memoria y añade una
+latencia configurable a cada llamada. Los contenedores de un solo uso de
+filebrowser (`config init`) crean de verdad su base de datos en el bind
+mount, para que el despliegue estático completo funcione contra él.
+
+Stand-in Docker daemon for the benchmarks: speaks HTTP/1.1 keep-alive over
+a unix socket, keeps containers in memory and adds a configurable latency
+to every call. filebrowser's one-shot containers (`config init`) really
+create their database in the bind mount, so the whole static deploy works
+against it.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import uuid
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+_VERSIONED = re.compile(r"^/v\d+\.\d+")
+
+
+class FakeDockerDaemon:
+    def __init__(
+        self,
+        socket_path: str,
+        latency: float = 0.005,
+        pull_latency: float = 0.0,
+        run_latency: float = 0.0,
+    ):
+        self.socket_path = socket_path
+        self.latency = latency
+        self.pull_latency = pull_latency
+        # Lo que tarda en salir un contenedor de un solo uso
+        # How long a one-shot container takes to exit
+        self.run_latency = run_latency
+        self.containers: Dict[str, dict] = {}
+        self.networks = {"caddy_net": {"Name": "caddy_net", "Id": "caddy_net"}}
+        # Imágenes sin etiqueta y volúmenes sin usar, para el recolector
+        # Untagged images and unused volumes, for the collector
+        self.images: Dict[str, dict] = {}
+        self.volumes: Dict[str, dict] = {}
+        self.requests = 0
+        self.connections = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._writers = set()
+        self._handlers = set()
+
+    # ---------- rutas | routes ----------
+
+    def _find(self, ident: str) -> Optional[dict]:
+        if ident in self.containers:
+            return self.containers[ident]
+        for c in self.containers.values():
+            if c["Id"].startswith(ident):
+                return c
+        return None
+
+    # Efecto de `filebrowser config init --database X`: crea X en el host
+    # Effect of `filebrowser config init --database X`: create X on the host
+    @staticmethod
+    def _run_command(container: dict):
+        cmd = container["Config"].get("Cmd") or []
+        if "init" not in cmd or "--database" not in cmd:
+            return
+        db = cmd[cmd.index("--database") + 1]
+        for bind in container["HostConfig"].get("Binds") or []:
+            host, mount = bind.split(":")[:2]
+            if db.startswith(mount.rstrip("/") + "/"):
+                with open(os.path.join(host, db[len(mount.rstrip("/")) + 1:]), "wb") as fp:
+                    fp.write(b"fake filebrowser db")
+
+    async def _route(self, method: str, path: str, query: Dict[str, list], body: bytes) -> Tuple[int, object]:
+        path = _VERSIONED.sub("", path)
+        await asyncio.sleep(self.latency)
+        if path == "/_ping":
+            return 200, "OK"
+        if path == "/version":
+            return 200, {"ApiVersion": "1.43", "Version": "fake"}
+        if path == "/info":
+            running = sum(1 for c in self.containers.values() if c["State"]["Running"])
+            return 200, {"NCPU": 8, "MemTotal": 16 * 2 ** 30, "Containers": len(self.containers),
+                         "ContainersRunning": running}
+        if path == "/networks" and method == "GET":
+            return 200, list(self.networks.values())
+        if path == "/networks/create":
+            name = json.loads(body or b"{}").get("Name")
+            self.networks[name] = {"Name": name, "Id": name}
+            return 201, {"Id": name}
+        if path == "/images/create":
+            await asyncio.sleep(self.pull_latency)
+            return 200, {"status": "Downloaded"}
+        if path == "/images/json":
+            return 200, list(self.images.values())
+        if path == "/volumes" and method == "GET":
+            return 200, {"Volumes": list(self.volumes.values()), "Warnings": []}
+        m = re.match(r"^/(images|volumes)/([^/]+)$", path)
+        if m and method == "DELETE":
+            kind, ident = m.groups()
+            if getattr(self, kind).pop(ident, None) is None:
+                return 404, {"message": f"No such {kind[:-1]}: {ident}"}
+            if kind == "images":
+                return 200, [{"Deleted": ident}]
+            return 204, None
+        m = re.match(r"^/images/(.+)/json$", path)
+        if m:
+            digest = hashlib.sha256(m.group(1).encode()).hexdigest()
+            return 200, {"Id": f"sha256:{digest}", "RepoDigests": [f"{m.group(1).split(':')[0]}@sha256:{digest}"]}
+        if path == "/containers/json":
+            filters = json.loads(query.get("filters", ["{}"])[0])
+            wanted = [label.partition("=") for label in filters.get("label", [])]
+            return 200, [
+                {"Id": c["Id"], "Names": ["/" + c["Name"]], "Labels": c["Config"]["Labels"],
+                 "State": "running" if c["State"]["Running"] else "exited",
+                 "Ports": [
+                     {"PrivatePort": int(port.split("/")[0]), "Type": port.split("/")[-1],
+                      "IP": b.get("HostIp") or "0.0.0.0", "PublicPort": int(b["HostPort"])}
+                     for port, bindings in (c["HostConfig"].get("PortBindings") or {}).items()
+                     for b in bindings or [] if b.get("HostPort")
+                 ]}
+                for c in self.containers.values()
+                if all(k in c["Config"]["Labels"] and (not eq or c["Config"]["Labels"][k] == v)
+                       for k, eq, v in wanted)
+            ]
+        if path == "/containers/create":
+            name = query.get("name", [uuid.uuid4().hex[:12]])[0]
+            if name in self.containers:
+                return 409, {"message": f"Conflict. The container name {name} is already in use"}
+            config = json.loads(body or b"{}")
+            container = {
+                "Id": uuid.uuid4().hex, "Name": name,
+                "Config": {"Image": config.get("Image"), "Cmd": config.get("Cmd"),
+                           "Labels": config.get("Labels") or {}},
+                "HostConfig": {"LogConfig": {"Type": "none"}, **(config.get("HostConfig") or {})},
+                "State": {"Running": False, "Status": "created"},
+            }
+            self.containers[name] = container
+            return 201, {"Id": container["Id"], "Warnings": []}
+
+        m = re.match(r"^/containers/([^/]+)(/json|/start|/stop|/wait|/stats)?$", path)
+        if m:
+            container = self._find(m.group(1))
+            if container is None:
+                return 404, {"message": f"No such container: {m.group(1)}"}
+            action = m.group(2)
+            if method == "DELETE":
+                del self.containers[container["Name"]]
+                return 204, None
+            if action == "/json":
+                return 200, container
+            if action == "/stats":
+                traffic = container.get("Traffic", 0)
+                return 200, {"networks": {"eth0": {"rx_bytes": traffic, "tx_bytes": traffic}}}
+            if action == "/start":
+                container["State"] = {"Running": True, "Status": "running"}
+                return 204, None
+            if action == "/stop":
+                container["State"] = {"Running": False, "Status": "exited"}
+                return 204, None
+            if action == "/wait":
+                await asyncio.sleep(self.run_latency)
+                self._run_command(container)
+                container["State"] = {"Running": False, "Status": "exited"}
+                return 200, {"StatusCode": 0}
+        return 404, {"message": f"page not found: {method} {path}"}
+
+    # ---------- HTTP ----------
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.add(writer)
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = b""
+                if "content-length" in headers:
+                    body = await reader.readexactly(int(headers["content-length"]))
+                url = urlparse(target)
+                self.requests += 1
+                status, payload = await self._route(method, url.path, parse_qs(url.query), body)
+                data = b"" if payload is None else (
+                    payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+                )
+                ctype = "text/plain" if isinstance(payload, str) else "application/json"
+                writer.write(
+                    f"HTTP/1.1 {status} X\r\nContent-Type: {ctype}\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    # ---------- arranque | lifecycle ----------
+
+    async def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._handle, self.socket_path)
+
+    async def stop(self):
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        # Cerrar el transporte despierta a cada handler con EOF
+        # Closing the transport wakes every handler up with EOF
+        await asyncio.wait(list(self._handlers) or [asyncio.sleep(0)], timeout=1)
+        await self._server.wait_closed()
+
+    def start_in_thread(self):
+        """Run the daemon on its own event loop, for blocking clients"""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
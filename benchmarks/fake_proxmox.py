@@ -0,0 +1,208 @@
+# fake_proxmox.py
+"""
+Sustituto de `proxmoxer.ProxmoxAPI` para los benchmarks: responde a las
+rutas que usa API_Intermediate/proxmox_manager.py con VMs en memoria. Cada
+llamada tarda `latency` y los clones/arranques son tareas con UPID que
+terminan pasado su tiempo simulado.
+
+Stand-in for `proxmoxer.ProxmoxAPI` for the benchmarks: answers the paths
+used by API_Intermediate/proxmox_manager.py with in-memory VMs. Every call
+takes `latency` and clones/starts are UPID tasks that finish once their
+simulated time has passed.
+
+`cluster/resources` describe `nodes` (por defecto uno, "sv1") con un
+almacenamiento compartido y las plantillas (`templates`) en el primero.
+
+`cluster/resources` describes `nodes` (one, "sv1", by default) with a
+shared storage and the templates (`templates`) on the first one.
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+GiB = 1024 ** 3
+
+
+class FakeProxmox:
+    def __init__(
+        self,
+        latency: float = 0.02,
+        full_clone_time: float = 20.0,
+        linked_clone_time: float = 2.0,
+        start_time: float = 1.0,
+        first_vmid: int = 200,
+        nodes: Optional[List[str]] = None,
+        node_memory: int = 64 * GiB,
+        node_cpus: int = 16,
+        storage_size: int = 1024 * GiB,
+        templates: tuple = (103,),
+    ):
+        self.latency = latency
+        self.full_clone_time = full_clone_time
+        self.linked_clone_time = linked_clone_time
+        self.start_time = start_time
+        self.first_vmid = first_vmid
+        self.node_names = nodes or ["sv1"]
+        self.node_memory = node_memory
+        self.node_cpus = node_cpus
+        self.storage_size = storage_size
+        self.templates = {
+            vmid: {"node": self.node_names[0], "config": {"scsi0": f"shared:base-{vmid}-disk-0,size=10G"}}
+            for vmid in templates
+        }
+        self.vms: Dict[int, dict] = {}
+        self.tasks: Dict[str, dict] = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> "_Resource":
+        return _Resource(self, [name])
+
+    def __call__(self, *parts: Any) -> "_Resource":
+        return _Resource(self, [str(p) for p in parts])
+
+    # ---------- rutas | routes ----------
+
+    def _task(self, kind: str, vmid: int, seconds: float) -> str:
+        upid = f"UPID:fake:{kind}:{vmid}:{time.monotonic_ns()}"
+        now = time.monotonic()
+        self.tasks[upid] = {"vmid": vmid, "kind": kind, "starts": now, "ends": now + seconds}
+        return upid
+
+    def _vm(self, vmid: str) -> dict:
+        vm = self.vms.get(int(vmid)) or self.templates.get(int(vmid))
+        if vm is None:
+            raise RuntimeError(f"500 Internal Server Error: VM {vmid} does not exist")
+        return vm
+
+    # Los clones completos escriben su avance como drive-mirror, una línea
+    # por cada 10 %
+    # Full clones log their progress like drive-mirror, one line per 10 %
+    def _log(self, task: dict, start: int) -> List[dict]:
+        lines = ["create full clone of drive scsi0"]
+        if task["kind"] == "qmclone" and task.get("full"):
+            span = task["ends"] - task["starts"]
+            done = min(1.0, (time.monotonic() - task["starts"]) / span) if span else 1.0
+            for step in range(1, int(done * 10) + 1):
+                lines.append(f"drive-scsi0: transferred {step} GiB of 10 GiB ({step * 10:.2f}%)")
+        return [{"n": n + 1, "t": text} for n, text in enumerate(lines)][start:]
+
+    def _resources(self) -> List[dict]:
+        resources: List[dict] = []
+        for node in self.node_names:
+            vms = [vm for vm in self.vms.values() if vm["node"] == node]
+            running = [vm for vm in vms if vm["status"] == "running"]
+            resources.append({
+                "type": "node", "node": node, "status": "online",
+                "maxmem": self.node_memory, "maxcpu": self.node_cpus,
+                "mem": sum(vm["maxmem"] for vm in running) // 2, "cpu": 0.05,
+            })
+            resources.append({
+                "type": "storage", "node": node, "storage": "shared",
+                "shared": 1, "status": "available",
+                "maxdisk": self.storage_size, "disk": 0,
+            })
+        for vmid, vm in self.vms.items():
+            resources.append({
+                "type": "qemu", "vmid": vmid, "node": vm["node"], "status": vm["status"],
+                "maxmem": vm["maxmem"], "maxcpu": vm["maxcpu"],
+            })
+        for vmid, vm in self.templates.items():
+            resources.append({
+                "type": "qemu", "vmid": vmid, "node": vm["node"], "status": "stopped",
+                "template": 1, "maxmem": 2 * GiB, "maxcpu": 2,
+            })
+        return resources
+
+    def handle(self, method: str, path: List[str], params: Dict[str, Any]) -> Any:
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            if path == ["version"]:
+                return {"version": "8.2.2", "release": "8.2", "repoid": "fake"}
+            if path == ["cluster", "nextid"]:
+                if "vmid" in params:
+                    if int(params["vmid"]) in self.vms:
+                        raise RuntimeError(f"400 Bad Request: VM {params['vmid']} already exists")
+                    return str(params["vmid"])
+                vmid = self.first_vmid
+                while vmid in self.vms:
+                    vmid += 1
+                return str(vmid)
+            if path == ["cluster", "resources"]:
+                return self._resources()
+
+            if path[0] != "nodes":
+                raise KeyError(path)
+            tail = path[2:]
+            if tail[0] == "tasks":
+                task = self.tasks[tail[1]]
+                if tail[2:] == ["log"]:
+                    return self._log(task, int(params.get("start", 0)))
+                if time.monotonic() < task["ends"]:
+                    return {"status": "running"}
+                if task["kind"] == "qmdestroy":
+                    self.vms.pop(task["vmid"], None)
+                elif task["vmid"] in self.vms:
+                    self.vms[task["vmid"]].pop("lock", None)
+                return {"status": "stopped", "exitstatus": "OK"}
+
+            vmid, action = tail[1], tail[2:]
+            if action == ["clone"]:
+                newid = int(params["newid"])
+                if newid in self.vms:
+                    raise RuntimeError(f"500 Internal Server Error: VM {newid} already exists")
+                linked = str(params.get("full", "1")) == "0"
+                self.vms[newid] = {
+                    "node": params.get("target", path[1]),
+                    "maxmem": 2 * GiB,
+                    "maxcpu": 2,
+                    "status": "stopped",
+                    "lock": "clone",
+                    "config": {"scsi0": f"local-lvm:vm-{newid}-disk-0,size=10G"},
+                }
+                seconds = self.linked_clone_time if linked else self.full_clone_time
+                upid = self._task("qmclone", newid, seconds)
+                self.tasks[upid]["full"] = not linked
+                return upid
+            vm = self._vm(vmid)
+            if action == [] and method == "delete":
+                if vm["status"] != "stopped":
+                    raise RuntimeError(f"500 Internal Server Error: VM {vmid} is running - destroy failed")
+                vm["lock"] = "destroyed"
+                return self._task("qmdestroy", int(vmid), self.latency)
+            if action == ["status", "current"]:
+                return {"status": vm["status"], "lock": vm.get("lock")}
+            if action == ["config"]:
+                if method == "get":
+                    return dict(vm["config"])
+                vm["config"].update(params)
+                if "memory" in params:
+                    vm["maxmem"] = int(params["memory"]) * 1024 ** 2
+                if "cores" in params:
+                    vm["maxcpu"] = int(params["cores"])
+                return None
+            if action == ["resize"]:
+                vm["config"]["scsi0"] = f"local-lvm:vm-{vmid}-disk-0,size={params['size']}"
+                return None
+            if action == ["status", "start"]:
+                vm["status"] = "running"
+                return self._task("qmstart", int(vmid), self.start_time)
+            if action == ["status", "stop"]:
+                vm["status"] = "stopped"
+                return self._task("qmstop", int(vmid), self.latency)
+            raise KeyError(path)
+
+
+class _Resource:
+    def __init__(self, api: FakeProxmox, path: List[str]):
+        self._api = api
+        self._path = path
+
+    def __getattr__(self, name: str):
+        if name in ("get", "post", "put", "delete"):
+            return lambda *args, **params: self._api.handle(name, self._path, params)
+        return _Resource(self._api, self._path + [name])
+
+    def __call__(self, *parts: Any) -> "_Resource":
+        return _Resource(self._api, self._path + [str(p) for p in parts])